@@ -0,0 +1,111 @@
+"""
+Measure the cost of validating handshake, submission and user data payloads,
+before and after validation moved to the shared schemas in webcandy.schemas.
+
+Run from the repository root: ``python -m benchmarks.validation``
+"""
+import re
+import timeit
+
+from marshmallow import Schema, fields, INCLUDE
+
+from webcandy.catalogue import Catalogue
+from webcandy.schemas import (
+    client_data_schema, submit_schema, user_data_schema
+)
+
+PATTERNS = [{'name': f'Pattern{i}', 'type': 'dynamic',
+             'args': ['color_list', 'speed'], 'default_speed': 1.0}
+            for i in range(50)]
+HANDSHAKE = {'token': 'x' * 150, 'client_name': 'MyClient',
+             'patterns': PATTERNS}
+SUBMIT = {'client_id': 'MyClient', 'pattern': 'Fade', 'speed': 2,
+          'color_list': ['#ff0000', '#ff7f00', '#ffff00', '#00ff00',
+                         '#0000ff', '#8b00ff']}
+USER_DATA = {'colors': {f'color{i}': '#%06x' % i for i in range(200)},
+             'color_lists': {f'list{i}': ['#%06x' % j for j in range(20)]
+                             for i in range(20)}}
+
+
+# -------------------------------
+# Before
+# -------------------------------
+
+class OldClientDataSchema(Schema):
+    class PatternSchema(Schema):
+        class Meta:
+            unknown = INCLUDE
+
+        name = fields.Str(required=True)
+        type = fields.Str(required=True,
+                          validate=lambda v: v in {'static', 'dynamic'})
+        args = fields.List(fields.Str(), required=True)
+        default_speed = fields.Float(validate=lambda v: v >= 0)
+
+    token = fields.Str(required=True)
+    client_name = fields.Str(required=True)
+    patterns = fields.List(fields.Nested(PatternSchema()), required=True)
+
+
+def old_is_color(s):
+    return bool(re.match(r'^#[A-Fa-f0-9]{6}$', s))
+
+
+def old_handshake():
+    OldClientDataSchema().load(HANDSHAKE)
+
+
+def old_submit():
+    data = dict(SUBMIT)
+    del data['client_id']  # no validation at all
+
+
+def old_user_data():
+    changes = {'colors': {}, 'color_lists': {}}
+    for name, color in USER_DATA['colors'].items():
+        if old_is_color(color):
+            changes['colors'][name] = color
+    for name, color_list in USER_DATA['color_lists'].items():
+        if all([old_is_color(color) for color in color_list]):
+            changes['color_lists'][name] = color_list
+
+
+# -------------------------------
+# After
+# -------------------------------
+
+catalogue = Catalogue(16, 60)
+catalogue.add(PATTERNS)
+
+
+def new_handshake():
+    # a pattern list the catalogue doesn't hold yet, as on first registration
+    Catalogue(16, 60).resolve(client_data_schema.load(HANDSHAKE))
+
+
+def new_handshake_stored():
+    # a pattern list the catalogue holds, as when a client reconnects
+    catalogue.resolve(client_data_schema.load(HANDSHAKE))
+
+
+def new_submit():
+    submit_schema.load(SUBMIT)
+
+
+def new_user_data():
+    user_data_schema.load(USER_DATA)
+
+
+def report(name: str, func, number: int) -> None:
+    best = min(timeit.repeat(func, number=number, repeat=5)) / number
+    print(f'{name:<24}{best * 1e6:>10.1f} us/payload')
+
+
+if __name__ == '__main__':
+    for label, old, new, number in [
+            ('handshake', old_handshake, new_handshake, 200),
+            ('submit', old_submit, new_submit, 2000),
+            ('user data', old_user_data, new_user_data, 100)]:
+        report(f'{label} (before)', old, number)
+        report(f'{label} (after)', new, number)
+    report('handshake (stored)', new_handshake_stored, 200)
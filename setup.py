@@ -31,9 +31,18 @@ setup(
         'opclib',
         'python-dotenv',
         'webcandy-client',
-        'websockets',
+        'websockets>=8.1',
         'werkzeug'
     ],
+    extras_require={
+        'render': ['numpy'],
+        'uvloop': ['uvloop']
+    },
+    entry_points={
+        'console_scripts': [
+            'webcandy-proxy=webcandy.proxy:main'
+        ]
+    },
     # python_requires='>=3.7',
     classifiers=[
         'Development Status :: 3 - Alpha',
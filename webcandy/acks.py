@@ -0,0 +1,132 @@
+"""
+Tracking of the messages sent to clients that acknowledge them (see
+``webcandy.protocol``), to measure how long clients take to apply lighting
+configurations and to tell callers whether they did.
+"""
+import asyncio
+import time
+
+from concurrent.futures import Future
+from typing import Dict, NamedTuple, Optional
+
+from .config import Config
+from .metrics import Histogram
+
+
+class Ack(NamedTuple):
+    """
+    The outcome of a message sent to a client that acknowledges messages.
+    """
+    acked: bool  # whether the client applied the message
+    latency: Optional[float] = None  # seconds from sending to acknowledgement
+    error: Optional[str] = None  # why the message was not applied
+
+    def status(self) -> Dict:
+        return self._asdict()
+
+
+class _Pending(NamedTuple):
+    # time.perf_counter() when the message was written to the client, or
+    # handed over to be written until it is
+    sent: float
+    future: Optional[Future]
+    timer: asyncio.TimerHandle
+
+
+class AckTracker:
+    """
+    Messages awaiting acknowledgement by a client, and the distribution of
+    its acknowledgement latency. Every method must be called from the proxy
+    server loop.
+    """
+
+    def __init__(self):
+        # map message ID to pending acknowledgement
+        self.pending: Dict[int, _Pending] = dict()
+        self.latency = Histogram()
+        self.counts = {'acked': 0, 'failed': 0, 'timed_out': 0}
+
+    def expect(self, message_id: int, sent: float,
+               future: Optional[Future] = None,
+               timeout: Optional[float] = None) -> None:
+        """
+        Start waiting for a message to be acknowledged. Does nothing if the
+        message is already awaited.
+
+        :param message_id: ID of the message
+        :param sent: ``time.perf_counter()`` when the message was handed over
+            to be written; see ``AckTracker.written``
+        :param future: future to resolve with the ``Ack`` of the message
+        :param timeout: seconds to wait for the acknowledgement; by default,
+            ``Config.ACK_TIMEOUT``
+        """
+        if message_id in self.pending:
+            return
+        timer = asyncio.get_event_loop().call_later(
+            Config.ACK_TIMEOUT if timeout is None else timeout,
+            self._resolve, message_id, Ack(False, error='timed out'),
+            'timed_out')
+        self.pending[message_id] = _Pending(sent, future, timer)
+
+    def written(self, message_id: int) -> None:
+        """
+        Measure a message's latency from now, when it was written to the
+        client, rather than from when it was handed over, so that time spent
+        queued or scheduled is not counted as the client's.
+        """
+        pending = self.pending.get(message_id)
+        if pending is not None:
+            self.pending[message_id] = pending._replace(
+                sent=time.perf_counter())
+
+    def ack(self, message_id: int,
+            error: Optional[str] = None) -> Optional[Ack]:
+        """
+        Record a client's acknowledgement of a message.
+
+        :param message_id: ID of the acknowledged message
+        :param error: why the client could not apply the message, if it could
+            not
+        :return: the outcome of the message; ``None`` if it was not awaited
+        """
+        pending = self.pending.get(message_id)
+        if pending is None:
+            return None
+
+        latency = time.perf_counter() - pending.sent
+        self.latency.observe(latency)
+        result = Ack(error is None, latency, error)
+        self._resolve(message_id, result,
+                      'acked' if error is None else 'failed')
+        return result
+
+    def fail(self, message_id: int, error: str) -> None:
+        """
+        Stop waiting for a message that will not be acknowledged, e.g. because
+        it was never sent.
+        """
+        self._resolve(message_id, Ack(False, error=error), 'failed')
+
+    def close(self) -> None:
+        """
+        Fail every pending message, e.g. when the client disconnects.
+        """
+        for message_id in list(self.pending):
+            self.fail(message_id, 'disconnected')
+
+    def _resolve(self, message_id: int, result: Ack, outcome: str) -> None:
+        pending = self.pending.pop(message_id, None)
+        if pending is None:
+            return
+        pending.timer.cancel()
+        self.counts[outcome] += 1
+        if pending.future and not pending.future.done():
+            pending.future.set_result(result)
+
+    def status(self) -> Dict:
+        """
+        Get the counts of acknowledgement outcomes, the number of pending
+        messages and the latency distribution.
+        """
+        return dict(self.counts, pending=len(self.pending),
+                    latency=self.latency.status())
@@ -1,9 +1,10 @@
 import os
+import time
 import signal
 import threading
 import asyncio
 
-from flask import Flask
+from flask import Flask, g, request
 from flask.logging import default_handler
 from webcandy_client import start_client
 from opclib import FadecandyServer
@@ -11,13 +12,30 @@ from opclib import FadecandyServer
 from . import routes
 from .config import Config, configure_logger
 from .extensions import db, migrate, api
+from .metrics import metrics
 from .models import User
+from .profiling import profiler
 from .server import clients, proxy_server
+from .storage import user_data, import_json_data
+from .tracing import tracer
 
+REQUESTS = metrics.counter(
+    'webcandy_http_requests_total',
+    'HTTP requests handled, by resource, method and status code',
+    ('resource', 'method', 'status'))
+REQUEST_SECONDS = metrics.histogram(
+    'webcandy_http_request_duration_seconds',
+    'Seconds spent handling HTTP requests, by resource and method',
+    ('resource', 'method'))
 
-def create_app():
+
+def create_app(start_proxy: bool = True):
     """
     Build the Flask app and start the client manager.
+
+    :param start_proxy: whether to start the proxy server (and standalone
+        client, if configured) in this process; the proxy server is never
+        started here if clients are reached through a separate proxy process
     """
     app = Flask(__name__)
     app.config.from_object(Config)
@@ -27,6 +45,9 @@ def create_app():
 
     register_views(app)
     register_extensions(app)
+    register_commands(app)
+    register_metrics(app)
+    register_profiling(app)
 
     if app.config['ENV'] == 'production':
         host = '0.0.0.0'
@@ -34,10 +55,11 @@ def create_app():
         host = '127.0.0.1'
 
     # TODO: Allow non-default port for proxy server
-    if not proxy_server.running:
+    if start_proxy and Config.CLIENT_REGISTRY != 'ipc' and \
+            not proxy_server.running:
         proxy_server.start(host=host)
 
-    if Config.STANDALONE:
+    if start_proxy and Config.STANDALONE:
         token = None
 
         with app.app_context():
@@ -86,6 +108,9 @@ def register_extensions(app: Flask) -> None:
     migrate.init_app(app, db)
     api.init_app(app)
     clients.init_app(app)
+    user_data.init_app(app)
+    tracer.init_app(app)
+    profiler.init_app(app)
 
 
 def register_views(app: Flask) -> None:
@@ -96,10 +121,88 @@ def register_views(app: Flask) -> None:
     api.add_resource(routes.NewUser, '/new_user')
     api.add_resource(routes.UserInfo, '/user/info')
     api.add_resource(routes.UserData, '/user/data')
+    api.add_resource(routes.Palette, '/user/palette')
     api.add_resource(routes.UserClients, '/user/clients')
+    api.add_resource(routes.UserEvents, '/user/events')
+    api.add_resource(routes.EventToken, '/user/events/token')
     api.add_resource(routes.Submit, '/submit')
+    api.add_resource(routes.Broadcast, '/broadcast')
+    api.add_resource(routes.Schedule, '/schedule')
+    api.add_resource(routes.Stream, '/stream')
+    api.add_resource(routes.RenderPreview, '/render/preview')
+    api.add_resource(routes.RenderStream, '/render/stream')
+    api.add_resource(routes.Traces, '/admin/traces')
     api.add_resource(routes.CatchAll, '/<path:path>')
 
     app.register_blueprint(routes.views)
     app.register_error_handler(404, routes.not_found)
     app.register_error_handler(500, routes.internal_server_error)
+
+
+def register_metrics(app: Flask) -> None:
+    """
+    Count and time the requests handled by each resource or view.
+    """
+    if not app.config['METRICS_ENABLED']:
+        return
+
+    @app.before_request
+    def start_timer():
+        g.request_start = time.perf_counter()
+
+    @app.after_request
+    def record_request(response):
+        start = g.get('request_start')
+        if start is None:
+            return response  # failed before the timer started
+
+        # label by resource rather than path, which is unbounded
+        resource = _resource_name(app)
+        REQUESTS.labels(resource, request.method,
+                        response.status_code).inc()
+        REQUEST_SECONDS.labels(resource, request.method).observe(
+            time.perf_counter() - start)
+        return response
+
+
+def register_profiling(app: Flask) -> None:
+    """
+    Profile a fraction of the requests to the resources named by the
+    ``PROFILE_RESOURCES`` setting, if profiling is enabled.
+    """
+    if not profiler.enabled:
+        return
+
+    @app.before_request
+    def start_profile():
+        g.profile = profiler.begin(_resource_name(app))
+
+    @app.teardown_request
+    def end_profile(_):
+        profile = g.pop('profile', None)
+        if profile:
+            profile.end()
+
+
+def _resource_name(app: Flask) -> str:
+    """
+    Get the name of the resource, or view function, handling the current
+    request.
+    """
+    view = app.view_functions.get(request.endpoint)
+    return getattr(view, 'view_class', view).__name__ if view else 'unmatched'
+
+
+def register_commands(app: Flask) -> None:
+    """
+    Register Flask CLI commands.
+    """
+
+    @app.cli.command('import-user-data')
+    def import_user_data():
+        """
+        Copy user data from JSON files into the database.
+        """
+        imported = import_json_data()
+        for user_id, count in imported.items():
+            app.logger.info(f'Imported {count} items for user {user_id}')
@@ -0,0 +1,93 @@
+import time
+import threading
+
+from collections import OrderedDict
+from typing import Any, Dict, Hashable
+
+
+class TTLCache:
+    """
+    Thread-safe LRU cache whose entries expire after a time to live.
+    """
+
+    def __init__(self, maxsize: int, ttl: float):
+        """
+        :param maxsize: the maximum number of entries to keep; if not positive,
+            nothing is cached
+        :param ttl: default number of seconds an entry stays valid
+        """
+        self.maxsize = maxsize
+        self.ttl = ttl
+
+        # map key to (expiry, value), least recently used first
+        self._data: 'OrderedDict[Hashable, tuple]' = OrderedDict()
+        self._lock = threading.Lock()
+
+        self.hits = 0
+        self.misses = 0
+
+    def __len__(self) -> int:
+        return len(self._data)
+
+    def get(self, key: Hashable, default: Any = None) -> Any:
+        """
+        Get the value stored for a key if it has not expired.
+
+        :param key: the key to look up
+        :param default: the value to return if no valid entry exists
+        :return: the stored value, or ``default``
+        """
+        with self._lock:
+            entry = self._data.get(key)
+            if entry is not None:
+                if entry[0] > time.monotonic():
+                    self._data.move_to_end(key)
+                    self.hits += 1
+                    return entry[1]
+                del self._data[key]
+            self.misses += 1
+            return default
+
+    def set(self, key: Hashable, value: Any, ttl: float = None) -> None:
+        """
+        Store a value, evicting the least recently used entry if the cache is
+        full.
+
+        :param key: the key to store the value under
+        :param value: the value to store
+        :param ttl: number of seconds the entry stays valid, capped at the
+            cache's default; the default if ``None``
+        """
+        if self.maxsize <= 0:
+            return
+
+        ttl = self.ttl if ttl is None else min(ttl, self.ttl)
+        if ttl <= 0:
+            return
+
+        with self._lock:
+            self._data[key] = (time.monotonic() + ttl, value)
+            self._data.move_to_end(key)
+            while len(self._data) > self.maxsize:
+                self._data.popitem(last=False)
+
+    def pop(self, key: Hashable) -> None:
+        """
+        Remove the entry for a key, if one exists.
+        """
+        with self._lock:
+            self._data.pop(key, None)
+
+    def clear(self) -> None:
+        """
+        Remove all entries. Hit and miss counts are kept.
+        """
+        with self._lock:
+            self._data.clear()
+
+    def stats(self) -> Dict[str, int]:
+        """
+        Get the size and hit/miss counts of this cache.
+        """
+        return {'size': len(self._data), 'hits': self.hits,
+                'misses': self.misses}
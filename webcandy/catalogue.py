@@ -0,0 +1,179 @@
+import json
+import hashlib
+
+from typing import Dict, List, Optional, Tuple
+from marshmallow import Schema, fields, INCLUDE
+
+from .cache import TTLCache
+from .config import Config
+
+Patterns = List[Dict]
+
+
+class PatternSchema(Schema):
+    """
+    Schema for necessary information about a lighting pattern.
+    """
+
+    class Meta:
+        unknown = INCLUDE
+
+    def one_of(*args):
+        choices = set(args)
+        return lambda v: v in choices
+
+    name = fields.Str(required=True)
+    type = fields.Str(required=True,
+                      validate=one_of('static', 'dynamic'))
+    args = fields.List(fields.Str(), required=True)
+    default_speed = fields.Float(validate=lambda v: v >= 0)
+
+
+pattern_schema = PatternSchema(many=True)
+
+
+def catalogue_hash(patterns: Patterns) -> str:
+    """
+    Get the content hash of a list of patterns. Lists with the same patterns
+    in the same order have the same hash, regardless of key order.
+    """
+    canonical = json.dumps(patterns, sort_keys=True, separators=(',', ':'))
+    return hashlib.sha256(canonical.encode()).hexdigest()
+
+
+def _unchanged(sent: Patterns, validated: Patterns) -> bool:
+    """
+    Check if validation left a pattern list as it was sent, so that it
+    hashes the same. The only value validation changes is an integer
+    "default_speed", which it turns into a float that compares equal.
+    """
+    return all(type(p.get('default_speed')) is type(v.get('default_speed'))
+               and p == v for p, v in zip(sent, validated))
+
+
+class Catalogue:
+    """
+    Content-addressed store of the pattern lists clients register with.
+
+    Clients that reconnect, or that run the same controller software, tend to
+    register the same patterns over and over. Each distinct list is validated
+    once and kept under its hash, and every client registered with it shares
+    the same list object. A client that knows the hash of its patterns can
+    register with just the hash, or with the hash of a previous list and the
+    changes since.
+    """
+
+    def __init__(self, maxsize: int = Config.CATALOGUE_SIZE,
+                 ttl: float = Config.CATALOGUE_TTL):
+        """
+        :param maxsize: number of pattern lists to keep
+        :param ttl: seconds a pattern list is kept after it was last stored
+        """
+        # map hash to (hash of the stored list, stored list)
+        self.cache = TTLCache(maxsize, ttl)
+
+    def get(self, patterns_hash: str) -> Optional[Tuple[str, Patterns]]:
+        """
+        Get a stored pattern list.
+
+        :return: the hash and pattern list stored under the given hash, which
+            is either the same hash or that of the list as it was sent before
+            validation; ``None`` if nothing is stored under the hash
+        """
+        return self.cache.get(patterns_hash)
+
+    def _store(self, patterns: Patterns, patterns_hash: str = None,
+               *aliases: str) -> Tuple[str, Patterns]:
+        """
+        Store a validated pattern list, reusing an equal stored list if there
+        is one.
+
+        :param patterns_hash: the hash of the list, if already known
+        :param aliases: other hashes to store the list under
+        :return: the hash of the list and the stored list
+        """
+        patterns_hash = patterns_hash or catalogue_hash(patterns)
+        entry = self.cache.get(patterns_hash) or (patterns_hash, patterns)
+        for key in (patterns_hash,) + aliases:
+            self.cache.set(key, entry)
+        return entry
+
+    def add(self, patterns: Patterns) -> Tuple[str, Patterns]:
+        """
+        Store a pattern list sent by a client. The list is only validated if
+        it is not stored yet.
+
+        :param patterns: the pattern list, as sent by the client
+        :return: the hash of the list and the stored list
+        :raises ValidationError: if the list is invalid
+        """
+        sent_hash = catalogue_hash(patterns)
+        entry = self.get(sent_hash)
+        if entry is not None:
+            return entry
+
+        patterns_hash = sent_hash
+        validated = pattern_schema.load(patterns)
+        if not _unchanged(patterns, validated):
+            # validation can normalize values, so the list sent may hash
+            # differently from the list stored; remember both
+            patterns_hash = catalogue_hash(validated)
+        return self._store(validated, patterns_hash, sent_hash)
+
+    def apply(self, base_hash: str, add: Patterns = None,
+              remove: List[str] = None) -> Tuple[str, Patterns]:
+        """
+        Store a pattern list made by changing a stored one. Only the added
+        patterns are validated.
+
+        :param base_hash: hash of the stored list to change
+        :param add: patterns to add, replacing stored ones of the same name
+        :param remove: names of patterns to remove
+        :return: the hash of the new list and the stored list
+        :raises KeyError: if no list is stored with the base hash
+        :raises ValidationError: if any of the added patterns is invalid
+        """
+        entry = self.get(base_hash)
+        if entry is None:
+            raise KeyError(base_hash)
+
+        added = {p['name']: p for p in pattern_schema.load(add or [])}
+        removed = set(remove or ())
+
+        patterns = []
+        for pattern in entry[1]:
+            name = pattern['name']
+            if name not in removed:
+                patterns.append(added.pop(name, pattern))
+        patterns.extend(added.values())
+        return self._store(patterns)
+
+    def resolve(self, data: dict) -> Tuple[str, Patterns]:
+        """
+        Get the pattern list described by a client's registration data, which
+        holds one of:
+
+        - "patterns": the full pattern list
+        - "patterns_hash": the hash of a stored pattern list
+        - "patterns_base" and "patterns_diff": the hash of a stored pattern
+          list, and a dictionary of patterns to "add" and names to "remove"
+
+        :return: the hash of the list and the stored list
+        :raises KeyError: if the registration data refers to a pattern list
+            that is not stored
+        :raises ValidationError: if any of the patterns is invalid
+        """
+        if 'patterns' in data:
+            return self.add(data['patterns'])
+        if 'patterns_hash' in data:
+            entry = self.get(data['patterns_hash'])
+            if entry is None:
+                raise KeyError(data['patterns_hash'])
+            return entry
+
+        diff = data['patterns_diff']
+        return self.apply(data['patterns_base'], diff.get('add'),
+                          diff.get('remove'))
+
+
+catalogue = Catalogue()
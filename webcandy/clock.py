@@ -0,0 +1,73 @@
+"""
+Estimation of the offset between the clocks of the proxy server and a client,
+so that several clients can be told to start a pattern at the same instant.
+
+Each probe of a client's clock (see ``webcandy.protocol``) yields four
+timestamps: ``t0`` when the server sent the probe, ``t1`` and ``t2`` when the
+client received and answered it, by the client's clock, and ``t3`` when the
+server received the answer. As in NTP, the offset of the client's clock is
+``((t1 - t0) + (t2 - t3)) / 2`` and the round trip delay is
+``(t3 - t0) - (t2 - t1)``; the offset is off by at most half the delay.
+"""
+from collections import deque
+from typing import Deque, Dict, Optional, Tuple
+
+from .config import Config
+
+# seconds between the clock probes sent to a client as soon as it registers
+PROBE_INTERVAL = 0.05
+
+
+class ClockEstimate:
+    """
+    Running estimate of a client's clock offset from its most recent probes.
+    """
+
+    def __init__(self, samples: int = Config.CLOCK_SAMPLES):
+        """
+        :param samples: number of recent probes to estimate from
+        """
+        # (delay, offset) of recent probes
+        self.samples: Deque[Tuple[float, float]] = deque(maxlen=samples)
+        self.offset: Optional[float] = None  # client time - server time
+        self.delay: Optional[float] = None  # round trip, in seconds
+
+    def add(self, t0: float, t1: float, t2: float, t3: float) -> None:
+        """
+        Update the estimate with the timestamps of a probe.
+
+        :raises ValueError: if the timestamps are inconsistent
+        """
+        delay = (t3 - t0) - (t2 - t1)
+        if delay < 0 or t2 < t1:
+            raise ValueError(f'Inconsistent clock probe timestamps '
+                             f'{(t0, t1, t2, t3)}')
+
+        self.samples.append((delay, ((t1 - t0) + (t2 - t3)) / 2))
+        # the probe with the least delay was least skewed by queuing on
+        # either side, so its offset is the most accurate
+        self.delay, self.offset = min(self.samples)
+
+    @property
+    def error(self) -> Optional[float]:
+        """
+        Largest amount by which the offset can be wrong, in seconds.
+        """
+        return None if self.delay is None else self.delay / 2
+
+    def to_client(self, server_time: float) -> float:
+        """
+        Convert a time by the server's clock to the client's clock.
+
+        :raises ValueError: if no probe has been answered yet
+        """
+        if self.offset is None:
+            raise ValueError('Clock offset is unknown')
+        return server_time + self.offset
+
+    def status(self) -> Dict:
+        """
+        Get the state of the estimate, in seconds.
+        """
+        return {'offset': self.offset, 'delay': self.delay,
+                'error': self.error, 'samples': len(self.samples)}
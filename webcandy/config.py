@@ -21,6 +21,127 @@ class Config:
     WC_USERNAME - User to make standalone client for
     WC_CLIENTNAME - Standalone client name (default: "Standalone")
 
+    Proxy server:
+    OUTBOX_SIZE - Maximum number of messages waiting to be sent to a single
+                  client (default: 16)
+    OUTBOX_DROP_POLICY - Which message to drop when a client's outbox is full,
+                         "oldest" or "newest" (default: oldest)
+    HEARTBEAT_INTERVAL - Seconds between pings to each client (default: 10)
+    HEARTBEAT_TIMEOUT - Seconds a client has to answer a ping before it is
+                        disconnected (default: 5)
+    HANDSHAKE_TIMEOUT - Seconds a new client has to register before it is
+                        disconnected (default: 10)
+    HANDSHAKE_FAILURE_LIMIT - Number of failed registrations after which a host
+                              is refused until its failures expire
+                              (default: 10)
+    HANDSHAKE_FAILURE_WINDOW - Seconds a failed registration counts against
+                               its host (default: 60)
+    REGISTER_WORKERS - Number of threads verifying tokens of registering
+                       clients (default: 4)
+    CATALOGUE_SIZE - Number of distinct pattern lists to remember so clients
+                     can register with a hash of their patterns (default: 256)
+    CATALOGUE_TTL - Seconds a pattern list is remembered after a client last
+                    registered with it (default: 86400)
+    STREAM_BUFFER - Number of pixel frames waiting to be streamed to a single
+                    client before the oldest is dropped (default: 3)
+    STREAM_MAX_FPS - Highest frame rate a pixel stream may use (default: 120)
+    STREAM_MAX_PIXELS - Largest number of pixels in a streamed frame
+                        (default: 4096)
+    RENDER_CACHE_SIZE - Number of rendered frames to keep for reuse when
+                        previewing or streaming patterns (default: 4096)
+    SCHEDULE_MAX_CUES - Number of cues a scheduled timeline can have
+                        (default: 1000)
+    SCHEDULE_MAX_TIMELINES - Number of timelines a user can have scheduled at
+                             once (default: 100)
+    CLOCK_SAMPLES - Number of recent clock probes a client's clock offset is
+                    estimated from (default: 8)
+    CLOCK_PROBES - Number of clock probes sent to a client as soon as it
+                   registers, before one per heartbeat (default: 4)
+    SYNC_LEAD - Least number of seconds ahead a synchronized start is
+                scheduled (default: 0.1)
+    ACK_TIMEOUT - Seconds to wait for a client to acknowledge a message
+                  before counting it as timed out (default: 5)
+    EVENTS_QUEUE_SIZE - Number of client events an event stream can fall
+                        behind by before events are dropped (default: 256)
+    EVENTS_MAX_SUBSCRIBERS - Number of event streams a user can have open at
+                             once (default: 16)
+    EVENTS_MAX_STREAMS - Number of event streams a process serves at once,
+                         each holding one of its worker threads; keep it
+                         below the threads per gunicorn worker
+                         (default: 8)
+    EVENTS_KEEPALIVE - Seconds without events after which an event stream is
+                       sent a comment, to detect closed streams (default: 15)
+    EVENTS_TOKEN_SECONDS - Seconds an event stream token, which opens a single
+                           user's event streams only, stays valid
+                           (default: 60)
+
+    CLIENT_REGISTRY - How clients connected to other processes (e.g. other
+                      gunicorn workers) are found, "local" if the app runs as
+                      a single process, "sqlite" to share a registry
+                      database between processes or "ipc" to use a proxy
+                      server started with webcandy-proxy (default: local)
+    CLIENT_REGISTRY_PATH - Path of the registry database
+                           (default: data/registry.db)
+    CLIENT_REGISTRY_POLL - Seconds between checks for data published to this
+                           process' clients (default: 0.01)
+    PROXY_IPC_PATH - Unix socket of the webcandy-proxy command channel
+                     (default: /tmp/webcandy-proxy.sock)
+
+    Caching:
+    TOKEN_CACHE_SIZE - Number of verified auth tokens to remember (default: 1024)
+    TOKEN_CACHE_TTL - Seconds a verified token is trusted without checking its
+                      signature again; never past token expiry (default: 300)
+    USER_CACHE_SIZE - Number of user rows to keep in memory (default: 1024)
+    USER_CACHE_TTL - Seconds a user row is kept in memory; changes to a user
+                     only clear the cache of the process making them, so
+                     other processes may use the old row for this long
+                     (default: 300)
+
+    Storage:
+    USER_DATA_BACKEND - Where colors and color lists are stored, "json" for
+                        per-user JSON files or "sql" for database tables
+                        (default: json)
+    USER_DATA_FLUSH_DELAY - Seconds to batch changes to a user's data before
+                            writing them to disk; if 0, changes are written
+                            immediately (default: 0)
+    PALETTE_BATCH_SIZE - Number of imported colors and color lists written to
+                         storage at once (default: 1000)
+
+    Metrics:
+    METRICS_ENABLED - Whether measurements are exported in the Prometheus text
+                      format at /metrics, labelled with the pid of the
+                      process that kept them (default: FALSE)
+    METRICS_TOKEN - Token scrapers must send as "Authorization: Bearer
+                    <token>" to read /metrics; if not set, anyone who can
+                    reach the app can read them, so only leave it unset if
+                    /metrics is blocked from outside
+
+    Profiling:
+    PROFILE_DIR - Directory profiles of sampled calls are written to; if not
+                  set, nothing is profiled
+    PROFILE_RATE - Fraction of the calls to profiled resources that are
+                   profiled (default: 0.01)
+    PROFILE_RESOURCES - Comma-separated names of the resources to profile
+                        (e.g. Submit,UserData), including ws_handler for
+                        client registrations (default: all)
+    PROFILE_MODE - "pstats" to profile calls with cProfile, or "collapsed" to
+                   sample their stacks and write collapsed stacks for flame
+                   graphs (default: pstats)
+    PROFILE_INTERVAL - Seconds between stack samples in collapsed mode
+                       (default: 0.001)
+    PROFILE_KEEP - Number of profiles kept per resource; older ones are
+                   deleted as new ones are written (default: 100)
+
+    Tracing:
+    TRACING - Whether lighting submissions are traced, "memory" to keep recent
+              traces in memory or "file" to also append them to TRACE_FILE
+              (default: disabled)
+    TRACE_BUFFER_SIZE - Number of recent traces kept in memory (default: 256)
+    TRACE_FILE - Path of the file traces are appended to, as JSON lines
+                 (default: data/traces.jsonl)
+    ADMIN_USERNAMES - Comma-separated usernames of the users allowed to view
+                      traces (default: none)
+
     Logging:
     LOG_LEVEL - Lowest level of logs to output (default: INFO)
     LOF_FORMAT - Logger output format
@@ -57,6 +178,74 @@ class Config:
 
     WC_CLIENTNAME = os.getenv('WC_CLIENTNAME') or 'Standalone'
 
+    # proxy server
+    OUTBOX_SIZE = int(os.getenv('OUTBOX_SIZE') or 16)
+    OUTBOX_DROP_POLICY = (os.getenv('OUTBOX_DROP_POLICY') or 'oldest').lower()
+    HEARTBEAT_INTERVAL = float(os.getenv('HEARTBEAT_INTERVAL') or 10)
+    HEARTBEAT_TIMEOUT = float(os.getenv('HEARTBEAT_TIMEOUT') or 5)
+    HANDSHAKE_TIMEOUT = float(os.getenv('HANDSHAKE_TIMEOUT') or 10)
+    HANDSHAKE_FAILURE_LIMIT = int(os.getenv('HANDSHAKE_FAILURE_LIMIT') or 10)
+    HANDSHAKE_FAILURE_WINDOW = float(
+        os.getenv('HANDSHAKE_FAILURE_WINDOW') or 60)
+    REGISTER_WORKERS = int(os.getenv('REGISTER_WORKERS') or 4)
+    CATALOGUE_SIZE = int(os.getenv('CATALOGUE_SIZE') or 256)
+    CATALOGUE_TTL = float(os.getenv('CATALOGUE_TTL') or 86400)
+    STREAM_BUFFER = int(os.getenv('STREAM_BUFFER') or 3)
+    STREAM_MAX_FPS = float(os.getenv('STREAM_MAX_FPS') or 120)
+    STREAM_MAX_PIXELS = int(os.getenv('STREAM_MAX_PIXELS') or 4096)
+    RENDER_CACHE_SIZE = int(os.getenv('RENDER_CACHE_SIZE') or 4096)
+    SCHEDULE_MAX_CUES = int(os.getenv('SCHEDULE_MAX_CUES') or 1000)
+    SCHEDULE_MAX_TIMELINES = int(os.getenv('SCHEDULE_MAX_TIMELINES') or 100)
+    CLOCK_SAMPLES = int(os.getenv('CLOCK_SAMPLES') or 8)
+    CLOCK_PROBES = int(os.getenv('CLOCK_PROBES') or 4)
+    SYNC_LEAD = float(os.getenv('SYNC_LEAD') or 0.1)
+    ACK_TIMEOUT = float(os.getenv('ACK_TIMEOUT') or 5)
+    EVENTS_QUEUE_SIZE = int(os.getenv('EVENTS_QUEUE_SIZE') or 256)
+    EVENTS_MAX_SUBSCRIBERS = int(os.getenv('EVENTS_MAX_SUBSCRIBERS') or 16)
+    EVENTS_MAX_STREAMS = int(os.getenv('EVENTS_MAX_STREAMS') or 8)
+    EVENTS_KEEPALIVE = float(os.getenv('EVENTS_KEEPALIVE') or 15)
+    EVENTS_TOKEN_SECONDS = int(os.getenv('EVENTS_TOKEN_SECONDS') or 60)
+
+    CLIENT_REGISTRY = (os.getenv('CLIENT_REGISTRY') or 'local').lower()
+    CLIENT_REGISTRY_PATH = os.getenv('CLIENT_REGISTRY_PATH') or \
+        f'{DATA_DIR}/registry.db'
+    CLIENT_REGISTRY_POLL = float(os.getenv('CLIENT_REGISTRY_POLL') or 0.01)
+    PROXY_IPC_PATH = os.getenv('PROXY_IPC_PATH') or '/tmp/webcandy-proxy.sock'
+
+    # caching
+    TOKEN_CACHE_SIZE = int(os.getenv('TOKEN_CACHE_SIZE') or 1024)
+    TOKEN_CACHE_TTL = float(os.getenv('TOKEN_CACHE_TTL') or 300)
+    USER_CACHE_SIZE = int(os.getenv('USER_CACHE_SIZE') or 1024)
+    USER_CACHE_TTL = float(os.getenv('USER_CACHE_TTL') or 300)
+
+    # storage
+    USER_DATA_BACKEND = (os.getenv('USER_DATA_BACKEND') or 'json').lower()
+    USER_DATA_FLUSH_DELAY = float(os.getenv('USER_DATA_FLUSH_DELAY') or 0)
+    PALETTE_BATCH_SIZE = int(os.getenv('PALETTE_BATCH_SIZE') or 1000)
+
+    # metrics
+    METRICS_ENABLED = (os.getenv('METRICS_ENABLED') or '').lower() in {
+        'true', 't', 'yes', 'y', '1'}
+    METRICS_TOKEN = os.getenv('METRICS_TOKEN')
+
+    # profiling
+    PROFILE_DIR = os.getenv('PROFILE_DIR')
+    PROFILE_RATE = float(os.getenv('PROFILE_RATE') or 0.01)
+    PROFILE_RESOURCES = {name.strip() for name in
+                         (os.getenv('PROFILE_RESOURCES') or '').split(',')
+                         if name.strip()}
+    PROFILE_MODE = (os.getenv('PROFILE_MODE') or 'pstats').lower()
+    PROFILE_INTERVAL = float(os.getenv('PROFILE_INTERVAL') or 0.001)
+    PROFILE_KEEP = int(os.getenv('PROFILE_KEEP') or 100)
+
+    # tracing
+    TRACING = (os.getenv('TRACING') or '').lower() or None
+    TRACE_BUFFER_SIZE = int(os.getenv('TRACE_BUFFER_SIZE') or 256)
+    TRACE_FILE = os.getenv('TRACE_FILE') or f'{DATA_DIR}/traces.jsonl'
+    ADMIN_USERNAMES = {name.strip() for name in
+                       (os.getenv('ADMIN_USERNAMES') or '').split(',')
+                       if name.strip()}
+
     # sqlalchemy
     SQLALCHEMY_DATABASE_URI = os.getenv(
         'DATABASE_URL') or f'sqlite:///{DATA_DIR}/webcandy.db'
@@ -0,0 +1,186 @@
+"""
+Push channel of per-user events about clients, streamed to the web UI as
+server-sent events so that it doesn't have to poll for client changes.
+
+Events are published by the proxy server as they happen:
+
+- ``connected``: a client registered; data holds its "client_name" and
+  "status"
+- ``disconnected``: a client was unregistered; data holds its "client_name"
+- ``lighting``: a lighting configuration was queued for clients; data holds
+  the "client_names" and the "config"
+- ``delivered``: a message was written to a client, or could not be; data
+  holds the "client_name" and "success"
+- ``acked``: a client acknowledged a message; data holds the "client_name",
+  the message "id", whether it was "acked", the "latency" and any "error"
+- ``missed``: the subscriber fell behind and "count" events were dropped;
+  state should be fetched again
+"""
+import json
+import queue
+import threading
+
+from collections import defaultdict
+from typing import Callable, Dict, Optional, Set
+
+from .config import Config
+
+
+def format_event(event: str, data) -> str:
+    """
+    Serialize an event in the server-sent events format.
+    """
+    return f'event: {event}\ndata: {json.dumps(data)}\n\n'
+
+
+class Subscription:
+    """
+    A subscriber's queue of serialized events. Use as a context manager to
+    unsubscribe when done.
+    """
+
+    def __init__(self, bus: 'EventBus', user_id: int, size: int):
+        self.bus = bus
+        self.user_id = user_id
+        self.queue: queue.Queue = queue.Queue(size)
+        # events dropped since the subscriber last caught up
+        self.missed = 0
+        # called after each event, for subscribers that can't block on get
+        self.notify: Optional[Callable[[], None]] = None
+
+    def put(self, event: str) -> None:
+        """
+        Queue a serialized event without blocking; if the queue is full, the
+        event is dropped.
+        """
+        try:
+            self.queue.put_nowait(event)
+        except queue.Full:
+            self.missed += 1
+        if self.notify:
+            self.notify()
+
+    def get(self, timeout: Optional[float] = None) -> Optional[str]:
+        """
+        Get the next serialized event, preceded by a ``missed`` event if any
+        were dropped.
+
+        :param timeout: seconds to wait for an event
+        :return: the event; ``None`` if none arrived in time
+        """
+        if self.missed:
+            missed, self.missed = self.missed, 0
+            return format_event('missed', {'count': missed})
+        try:
+            return self.queue.get(timeout=timeout)
+        except queue.Empty:
+            return None
+
+    def close(self) -> None:
+        self.bus.unsubscribe(self)
+
+    def __enter__(self) -> 'Subscription':
+        return self
+
+    def __exit__(self, *_) -> None:
+        self.close()
+
+
+class EventBus:
+    """
+    Fan events out to the subscribers of each user. Events are serialized
+    once, however many subscribers there are, and only if there are any.
+    Safe to use from any thread.
+    """
+
+    def __init__(self, queue_size: int = Config.EVENTS_QUEUE_SIZE,
+                 max_subscribers: int = Config.EVENTS_MAX_SUBSCRIBERS):
+        """
+        :param queue_size: number of events a subscriber can fall behind by
+            before events are dropped
+        :param max_subscribers: number of subscribers a user can have at once
+        """
+        self.queue_size = queue_size
+        self.max_subscribers = max_subscribers
+        self._subscribers: Dict[int, Set[Subscription]] = defaultdict(set)
+        self._lock = threading.Lock()
+
+    def subscribe(self, user_id: int) -> Subscription:
+        """
+        Subscribe to a user's events.
+
+        :raises ValueError: if the user has too many subscribers
+        """
+        subscription = Subscription(self, user_id, self.queue_size)
+        with self._lock:
+            if len(self._subscribers[user_id]) >= self.max_subscribers:
+                raise ValueError(f'At most {self.max_subscribers} event '
+                                 f'streams can be open at once')
+            self._subscribers[user_id].add(subscription)
+        return subscription
+
+    def unsubscribe(self, subscription: Subscription) -> None:
+        with self._lock:
+            subscribers = self._subscribers.get(subscription.user_id)
+            if subscribers is not None:
+                subscribers.discard(subscription)
+                if not subscribers:
+                    del self._subscribers[subscription.user_id]
+
+    def has_subscribers(self, user_id: int) -> bool:
+        """
+        Check if a user has any subscribers, to skip building events nobody
+        would receive.
+        """
+        return user_id in self._subscribers
+
+    def publish(self, user_id: int, event: str, data) -> None:
+        """
+        Send an event to every subscriber of a user.
+
+        :param user_id: the user the event concerns
+        :param event: the event type
+        :param data: JSON serializable event data
+        """
+        with self._lock:
+            subscribers = list(self._subscribers.get(user_id, ()))
+        if not subscribers:
+            return
+
+        serialized = format_event(event, data)
+        for subscription in subscribers:
+            subscription.put(serialized)
+
+
+class StreamSlots:
+    """
+    Count the event streams served by this process. A stream holds the
+    worker thread serving it for as long as it is open, so they have to be
+    capped per process, not just per user, to leave threads for the rest of
+    the API. Safe to use from any thread.
+    """
+
+    def __init__(self):
+        self.open = 0
+        self._lock = threading.Lock()
+
+    def acquire(self, limit: int) -> bool:
+        """
+        Take a slot for a new stream.
+
+        :param limit: number of streams this process can serve at once
+        :return: ``True`` if a slot was taken; ``False`` if all are in use
+        """
+        with self._lock:
+            if self.open >= limit:
+                return False
+            self.open += 1
+            return True
+
+    def release(self) -> None:
+        with self._lock:
+            self.open -= 1
+
+
+event_bus = EventBus()
+stream_slots = StreamSlots()
@@ -0,0 +1,318 @@
+"""
+Measurements of the server's behaviour, exported at ``/metrics`` in the
+Prometheus text format.
+
+Metrics updated on hot paths (requests, token verification, storage, sends)
+are kept in labelled series guarded by a lock per metric, so they can be
+updated from the Flask threads and the proxy server loop alike. State that
+is already tracked elsewhere, such as the clients of the proxy server, is
+read by collectors when the metrics are scraped instead of being mirrored
+on every change.
+"""
+import os
+import hmac
+import math
+import time
+import bisect
+import hashlib
+import threading
+
+from contextlib import contextmanager
+from typing import Callable, Dict, Iterable, List, Sequence, Tuple, Union
+
+# upper bounds, in seconds, of the default latency buckets
+LATENCY_BUCKETS = (0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1, 2.5, 5, 10)
+
+
+class Histogram:
+    """
+    Distribution of observed values over fixed buckets, as used by Prometheus:
+    each bucket counts the observations less than or equal to its upper
+    bound, and the sum and count of all observations are kept.
+    """
+
+    def __init__(self, buckets: Sequence[float] = LATENCY_BUCKETS):
+        """
+        :param buckets: the upper bounds of the buckets, in increasing order;
+            a bucket for everything larger is added
+        """
+        self.buckets = tuple(buckets)
+        # observations in each bucket alone; cumulated when read
+        self._counts = [0] * (len(self.buckets) + 1)
+        self.sum = 0.0
+        self.count = 0
+
+    def copy(self) -> 'Histogram':
+        histogram = Histogram(self.buckets)
+        histogram._counts = list(self._counts)
+        histogram.sum = self.sum
+        histogram.count = self.count
+        return histogram
+
+    def observe(self, value: float) -> None:
+        self._counts[bisect.bisect_left(self.buckets, value)] += 1
+        self.sum += value
+        self.count += 1
+
+    def cumulative(self) -> Dict[float, int]:
+        """
+        Get the number of observations less than or equal to each upper
+        bound, including infinity.
+        """
+        counts = dict()
+        total = 0
+        for bound, count in zip(self.buckets + (float('inf'),), self._counts):
+            total += count
+            counts[bound] = total
+        return counts
+
+    def quantile(self, q: float) -> float:
+        """
+        Estimate a quantile by interpolating within the bucket it falls in.
+
+        :param q: the quantile, between 0 and 1
+        :return: the estimate; ``nan`` if nothing was observed
+        """
+        if not self.count:
+            return float('nan')
+
+        rank = q * self.count
+        lower, below = 0.0, 0
+        for bound, total in self.cumulative().items():
+            if total >= rank:
+                if bound == float('inf'):
+                    return lower  # no upper bound to interpolate towards
+                inside = total - below
+                return lower + (bound - lower) * (rank - below) / inside \
+                    if inside else bound
+            lower, below = bound, total
+        return lower
+
+    def status(self) -> Dict:
+        """
+        Get a JSON serializable summary of the distribution.
+        """
+        return {'count': self.count,
+                'sum': self.sum,
+                'p50': self.quantile(0.5) if self.count else None,
+                'p99': self.quantile(0.99) if self.count else None,
+                'buckets': {str(bound): total
+                            for bound, total in self.cumulative().items()}}
+
+
+class Series:
+    """
+    The value of a metric for one combination of label values.
+    """
+    __slots__ = ('value', '_lock')
+
+    def __init__(self, value: Union[float, Histogram],
+                 lock: threading.Lock):
+        self.value = value
+        self._lock = lock
+
+    def inc(self, amount: float = 1) -> None:
+        with self._lock:
+            self.value += amount
+
+    def dec(self, amount: float = 1) -> None:
+        with self._lock:
+            self.value -= amount
+
+    def set(self, value: float) -> None:
+        self.value = value
+
+    def observe(self, value: float) -> None:
+        with self._lock:
+            self.value.observe(value)
+
+    @contextmanager
+    def time(self):
+        """
+        Observe the number of seconds spent in a ``with`` block.
+        """
+        start = time.perf_counter()
+        try:
+            yield
+        finally:
+            self.observe(time.perf_counter() - start)
+
+    def snapshot(self) -> Union[float, Histogram]:
+        with self._lock:
+            return self.value.copy() if isinstance(self.value, Histogram) \
+                else self.value
+
+
+class Metric:
+    """
+    A named metric of one of the Prometheus types, with a series per
+    combination of label values.
+    """
+    TYPES = {'counter', 'gauge', 'histogram'}
+
+    def __init__(self, name: str, kind: str, documentation: str,
+                 labelnames: Sequence[str] = (),
+                 buckets: Sequence[float] = LATENCY_BUCKETS):
+        """
+        :param name: the metric name; counters should end in ``_total``
+        :param kind: ``'counter'``, ``'gauge'`` or ``'histogram'``
+        :param documentation: what the metric measures
+        :param labelnames: names of the labels distinguishing its series
+        :param buckets: upper bounds of the buckets of a histogram
+        :raises ValueError: if ``kind`` is invalid
+        """
+        if kind not in self.TYPES:
+            raise ValueError(f'Invalid metric type {kind!r}')
+        self.name = name
+        self.kind = kind
+        self.documentation = documentation
+        self.labelnames = tuple(labelnames)
+        self.buckets = tuple(buckets)
+        self._series: Dict[Tuple[str, ...], Series] = dict()
+        self._lock = threading.Lock()
+
+    def labels(self, *values) -> Series:
+        """
+        Get the series for some label values, creating it if needed.
+
+        :raises ValueError: if the number of values doesn't match the labels
+        """
+        key = tuple(str(value) for value in values)
+        series = self._series.get(key)
+        if series is None:
+            if len(key) != len(self.labelnames):
+                raise ValueError(f'{self.name} expects labels '
+                                 f'{self.labelnames}, got {values}')
+            with self._lock:
+                series = self._series.setdefault(key, Series(
+                    Histogram(self.buckets) if self.kind == 'histogram'
+                    else 0.0, self._lock))
+        return series
+
+    def render(self, labels: Dict[str, str] = None) -> List[str]:
+        """
+        Get the lines of this metric in the Prometheus text format.
+
+        :param labels: labels to add to every sample
+        """
+        extra = labels or dict()
+        lines = [f'# HELP {self.name} {_escape(self.documentation, False)}',
+                 f'# TYPE {self.name} {self.kind}']
+        for key, series in sorted(self._series.copy().items()):
+            labels = dict(zip(self.labelnames, key), **extra)
+            value = series.snapshot()
+            if not isinstance(value, Histogram):
+                lines.append(_sample(self.name, labels, value))
+                continue
+            for bound, total in value.cumulative().items():
+                lines.append(_sample(f'{self.name}_bucket',
+                                     dict(labels, le=_number(bound)), total))
+            lines.append(_sample(f'{self.name}_sum', labels, value.sum))
+            lines.append(_sample(f'{self.name}_count', labels, value.count))
+        return lines
+
+
+class Metrics:
+    """
+    The metrics of this process: those updated as things happen, and
+    collectors that produce metrics from existing state when scraped.
+    """
+
+    def __init__(self):
+        self._metrics: Dict[str, Metric] = dict()
+        self._collectors: List[Callable[[], Iterable[Metric]]] = []
+
+    def _add(self, metric: Metric) -> Metric:
+        if metric.name in self._metrics:
+            raise ValueError(f'Metric {metric.name!r} already exists')
+        self._metrics[metric.name] = metric
+        return metric
+
+    def counter(self, name: str, documentation: str,
+                labelnames: Sequence[str] = ()) -> Metric:
+        return self._add(Metric(name, 'counter', documentation, labelnames))
+
+    def gauge(self, name: str, documentation: str,
+              labelnames: Sequence[str] = ()) -> Metric:
+        return self._add(Metric(name, 'gauge', documentation, labelnames))
+
+    def histogram(self, name: str, documentation: str,
+                  labelnames: Sequence[str] = (),
+                  buckets: Sequence[float] = LATENCY_BUCKETS) -> Metric:
+        return self._add(Metric(name, 'histogram', documentation, labelnames,
+                                buckets))
+
+    def collector(self, collect: Callable[[], Iterable[Metric]]) \
+            -> Callable[[], Iterable[Metric]]:
+        """
+        Register a function returning metrics to export when scraped. May be
+        used as a decorator.
+        """
+        self._collectors.append(collect)
+        return collect
+
+    def render(self, labels: Dict[str, str] = None) -> str:
+        """
+        Get every metric in the Prometheus text format.
+
+        :param labels: labels to add to every sample, such as
+            ``process_labels()``
+        """
+        metrics = list(self._metrics.values())
+        for collect in self._collectors:
+            metrics.extend(collect())
+
+        lines = []
+        for metric in metrics:
+            lines.extend(metric.render(labels))
+        return '\n'.join(lines) + '\n'
+
+
+# content type of the text format
+CONTENT_TYPE = 'text/plain; version=0.0.4; charset=utf-8'
+
+
+def process_labels() -> Dict[str, str]:
+    """
+    Labels telling apart the metrics of the processes serving the app. Each
+    process keeps metrics of its own, and a scrape of a port shared by
+    several (e.g. gunicorn workers) reaches just one of them, so each
+    process's series are kept apart rather than mixed into one series that
+    jumps between their values; sum them across "pid" to get totals.
+    """
+    return {'pid': str(os.getpid())}
+
+
+def pseudonym(value, key: str) -> str:
+    """
+    Stand-in for an identifying label value, such as a user ID: a keyed hash
+    of it, which tells the series of different values apart without revealing
+    the values to whoever can read the metrics.
+
+    :param value: the value to stand in for
+    :param key: secret the hash is keyed with
+    :return: 12 hex digits
+    """
+    return hmac.new(key.encode(), str(value).encode(),
+                    hashlib.sha256).hexdigest()[:12]
+
+
+def _escape(text: str, quote: bool = True) -> str:
+    text = text.replace('\\', '\\\\').replace('\n', '\\n')
+    return text.replace('"', '\\"') if quote else text
+
+
+def _number(value: float) -> str:
+    if math.isinf(value):
+        return '+Inf' if value > 0 else '-Inf'
+    return repr(float(value)) if isinstance(value, float) else str(value)
+
+
+def _sample(name: str, labels: Dict[str, str], value: float) -> str:
+    if labels:
+        name += '{' + ','.join(f'{label}="{_escape(text)}"'
+                               for label, text in labels.items()) + '}'
+    return f'{name} {_number(value)}'
+
+
+metrics = Metrics()
@@ -1,13 +1,33 @@
+import time
+
 from werkzeug.security import generate_password_hash, check_password_hash
 from itsdangerous import (
     TimedJSONWebSignatureSerializer as Serializer,
     SignatureExpired,
     BadSignature
 )
-from typing import Union, Optional
+from sqlalchemy import event
+from sqlalchemy.orm import make_transient_to_detached
+from typing import Union, Optional, Tuple
 
+from .cache import TTLCache
 from .config import Config
 from .extensions import db
+from .metrics import metrics
+
+# map verified token to the user_id stored in it
+token_cache = TTLCache(Config.TOKEN_CACHE_SIZE, Config.TOKEN_CACHE_TTL)
+# map user_id to a detached copy of the user's row
+user_cache = TTLCache(Config.USER_CACHE_SIZE, Config.USER_CACHE_TTL)
+
+# keeps event stream tokens and auth tokens from passing as each other
+STREAM_TOKEN_SALT = 'events'
+
+TOKEN_SECONDS = metrics.histogram(
+    'webcandy_token_verification_seconds',
+    'Seconds spent verifying auth tokens, by outcome (cached, verified, '
+    'expired or invalid)',
+    ('outcome',))
 
 
 class User(db.Model):
@@ -24,6 +44,9 @@ class User(db.Model):
         Get the user associated with a user_id or access token. Must be called
         from within Flask application context.
 
+        Verified tokens and user rows are cached, so repeated calls with the
+        same token skip both signature verification and the database query.
+
         :param user_id_or_token: the user_id or token to process
         :return: the user associated with the token; ``None`` if token is
             invalid or no user could be identified
@@ -32,20 +55,61 @@ class User(db.Model):
         if isinstance(user_id_or_token, int):
             user_id = user_id_or_token
         elif isinstance(user_id_or_token, str):
-            s = Serializer(Config.SECRET_KEY)
-            try:
-                data = s.loads(user_id_or_token)
-            except SignatureExpired:
-                return None  # valid token, but expired
-            except BadSignature:
-                return None  # invalid token
+            start = time.perf_counter()
+            user_id, outcome = cls._verify(user_id_or_token)
+            TOKEN_SECONDS.labels(outcome).observe(time.perf_counter() - start)
+            if user_id is None:
+                return None
 
-            try:
-                user_id = data['id']
-            except KeyError:
-                raise ValueError('Improperly formatted data in token')
+        return cls._load(user_id)
 
-        return cls.query.get(user_id)
+    @staticmethod
+    def _verify(token: str) -> Tuple[Optional[int], str]:
+        """
+        Get the user_id stored in a token, using the token cache if possible.
+
+        :return: the user_id, or ``None`` if the token is expired or invalid,
+            and the outcome of verification
+        :raises ValueError: if the token's data is improperly formatted
+        """
+        user_id = token_cache.get(token)
+        if user_id is not None:
+            return user_id, 'cached'
+
+        s = Serializer(Config.SECRET_KEY)
+        try:
+            data, header = s.loads(token, return_header=True)
+        except SignatureExpired:
+            return None, 'expired'  # valid token, but expired
+        except BadSignature:
+            return None, 'invalid'  # invalid token
+
+        try:
+            user_id = data['id']
+        except KeyError:
+            raise ValueError('Improperly formatted data in token')
+
+        # never trust a cached token past its expiry
+        token_cache.set(token, user_id, header['exp'] - time.time())
+        return user_id, 'verified'
+
+    @classmethod
+    def _load(cls, user_id: Optional[int]) -> Optional['User']:
+        """
+        Get a user by ID, using the user cache if possible. The returned
+        instance belongs to the current session either way.
+        """
+        cached = user_cache.get(user_id)
+        if cached is not None:
+            return db.session.merge(cached, load=False)
+
+        user = cls.query.get(user_id)
+        if user is not None:
+            copy = cls(user_id=user.user_id, username=user.username,
+                       email=user.email, password_hash=user.password_hash)
+            make_transient_to_detached(copy)
+            user_cache.set(user.user_id, copy)
+        return user
 
     def set_password(self, password: str) -> None:
         self.password_hash = generate_password_hash(password)
@@ -63,5 +127,110 @@ class User(db.Model):
         s = Serializer(Config.SECRET_KEY, expires_in=expiration)
         return s.dumps({'id': self.user_id})
 
+    def generate_stream_token(
+            self, expiration: int = Config.EVENTS_TOKEN_SECONDS) -> bytes:
+        """
+        Generate a short-lived token that only opens this ``User``'s event
+        streams. Browsers cannot set headers on event streams, so the token
+        has to go in the URL, where it may end up in access logs; unlike an
+        authentication token, it is of no use by the time anyone reads them.
+
+        :param expiration: the number of seconds the token should expire in
+        :return: the generated stream token
+        """
+        s = Serializer(Config.SECRET_KEY, salt=STREAM_TOKEN_SALT,
+                       expires_in=expiration)
+        return s.dumps({'id': self.user_id})
+
+    @classmethod
+    def verify_stream_token(cls, token: str) -> Optional['User']:
+        """
+        Get the user associated with an event stream token. Must be called
+        from within Flask application context.
+
+        :return: the user; ``None`` if the token is expired or invalid
+        """
+        s = Serializer(Config.SECRET_KEY, salt=STREAM_TOKEN_SALT)
+        try:
+            data = s.loads(token)
+        except BadSignature:  # including SignatureExpired
+            return None
+        return cls._load(data.get('id'))
+
     def __repr__(self):
         return f'<User {self.username}>'
+
+
+@event.listens_for(User, 'after_update')
+@event.listens_for(User, 'after_delete')
+def _invalidate_user(_mapper, _connection, target: User) -> None:
+    """
+    Drop a user's cached row whenever it is changed in the database. Only the
+    cache of the process making the change is cleared: other processes (e.g.
+    other gunicorn workers) keep serving the row they cached, password hash
+    included, for up to ``USER_CACHE_TTL`` seconds.
+    """
+    user_cache.pop(target.user_id)
+
+
+class Color(db.Model):
+    """
+    A named color saved by a user. Only used by the SQL user data backend.
+    """
+    __tablename__ = 'colors'
+
+    user_id = db.Column(db.Integer, db.ForeignKey('users.user_id'),
+                        primary_key=True)
+    name = db.Column(db.String(64), primary_key=True)
+    value = db.Column(db.String(7), nullable=False)
+
+    def __repr__(self):
+        return f'<Color {self.name} of user {self.user_id}>'
+
+
+class ColorList(db.Model):
+    """
+    A named list of colors saved by a user, stored as a JSON array. Only used
+    by the SQL user data backend.
+    """
+    __tablename__ = 'color_lists'
+
+    user_id = db.Column(db.Integer, db.ForeignKey('users.user_id'),
+                        primary_key=True)
+    name = db.Column(db.String(64), primary_key=True)
+    value = db.Column(db.Text, nullable=False)
+
+    def __repr__(self):
+        return f'<ColorList {self.name} of user {self.user_id}>'
+
+
+class ClientGroup(db.Model):
+    """
+    A named group of client names saved by a user, stored as a JSON array.
+    Only used by the SQL user data backend.
+    """
+    __tablename__ = 'client_groups'
+
+    user_id = db.Column(db.Integer, db.ForeignKey('users.user_id'),
+                        primary_key=True)
+    name = db.Column(db.String(64), primary_key=True)
+    value = db.Column(db.Text, nullable=False)
+
+    def __repr__(self):
+        return f'<ClientGroup {self.name} of user {self.user_id}>'
+
+
+class Scene(db.Model):
+    """
+    A named lighting configuration and the clients to send it to, saved by a
+    user and stored as a JSON object. Only used by the SQL user data backend.
+    """
+    __tablename__ = 'scenes'
+
+    user_id = db.Column(db.Integer, db.ForeignKey('users.user_id'),
+                        primary_key=True)
+    name = db.Column(db.String(64), primary_key=True)
+    value = db.Column(db.Text, nullable=False)
+
+    def __repr__(self):
+        return f'<Scene {self.name} of user {self.user_id}>'
@@ -0,0 +1,170 @@
+import time
+import asyncio
+import logging
+import websockets
+
+from collections import deque
+from concurrent.futures import Future
+from typing import Any, Deque, Dict, List, Optional
+
+from . import util
+from .config import configure_logger
+from .metrics import metrics
+
+logger = logging.getLogger(__name__)
+configure_logger(logger)
+
+# coalescing key for lighting configurations; only the latest one matters
+LIGHTING = 'lighting'
+
+DROP_POLICIES = {'oldest', 'newest'}
+
+SEND_SECONDS = metrics.histogram(
+    'webcandy_outbox_send_seconds',
+    'Seconds from queueing a message for a client to writing it')
+
+
+class Outbox:
+    """
+    Bounded queue of messages waiting to be written to a single client.
+
+    A writer task on the proxy server loop drains the queue in order. Messages
+    put with the same coalescing key supersede each other while waiting, so a
+    slow client only receives the most recent of a burst of lighting
+    configurations. All methods except ``stats`` must be called from the
+    proxy server loop.
+    """
+
+    def __init__(self, protocol: websockets.WebSocketServerProtocol,
+                 maxsize: int = 16, drop_policy: str = 'oldest'):
+        """
+        :param protocol: the protocol of the client to write to
+        :param maxsize: maximum number of messages waiting to be written
+        :param drop_policy: which message to drop when the queue is full;
+            ``'oldest'`` to drop the message at the front of the queue,
+            ``'newest'`` to refuse the message being put
+        :raises ValueError: if ``maxsize`` or ``drop_policy`` is invalid
+        """
+        if maxsize < 1:
+            raise ValueError(f'maxsize must be positive, got {maxsize}')
+        if drop_policy not in DROP_POLICIES:
+            raise ValueError(f'Invalid drop policy {drop_policy!r}')
+
+        self.protocol = protocol
+        self.maxsize = maxsize
+        self.drop_policy = drop_policy
+
+        # entries are [key, message, future, time queued] lists so they can
+        # be coalesced in place
+        self._queue: Deque[List[Any]] = deque()
+        self._keyed: Dict[str, List[Any]] = dict()
+        self._wakeup: Optional[asyncio.Event] = None
+        self._writer: Optional[asyncio.Task] = None
+        self._closed = False
+
+        self.sent = 0
+        self.coalesced = 0
+        self.dropped = 0
+
+    def __len__(self) -> int:
+        return len(self._queue)
+
+    def put(self, message: Any, future: Future = None,
+            key: str = None) -> None:
+        """
+        Queue a message to be written.
+
+        :param message: the serialized message
+        :param future: resolved to ``True`` once the message is written, or
+            ``False`` if it is coalesced, dropped or cannot be written
+        :param key: coalescing key; a waiting message with the same key is
+            replaced by this one
+        """
+        if self._closed:
+            _resolve(future, False)
+            return
+
+        if key is not None and key in self._keyed:
+            entry = self._keyed[key]
+            _resolve(entry[2], False)
+            entry[1], entry[2], entry[3] = message, future, time.perf_counter()
+            self.coalesced += 1
+            return
+
+        if len(self._queue) >= self.maxsize:
+            self.dropped += 1
+            if self.drop_policy == 'newest':
+                _resolve(future, False)
+                return
+            old_key, _, old_future, _ = self._queue.popleft()
+            if old_key is not None:
+                del self._keyed[old_key]
+            _resolve(old_future, False)
+
+        entry = [key, message, future, time.perf_counter()]
+        self._queue.append(entry)
+        if key is not None:
+            self._keyed[key] = entry
+
+        if self._writer is None:
+            self._wakeup = asyncio.Event()
+            self._writer = asyncio.ensure_future(self._write())
+        self._wakeup.set()
+
+    async def _write(self) -> None:
+        """
+        Write queued messages to the client until the connection closes.
+        """
+        while True:
+            while self._queue:
+                key, message, future, queued = self._queue.popleft()
+                if key is not None:
+                    del self._keyed[key]
+
+                try:
+                    await self.protocol.send(message)
+                except websockets.ConnectionClosed:
+                    logger.error(
+                        f'Connection to '
+                        f'{util.format_addr(self.protocol.remote_address)} '
+                        f'closed before data could be sent')
+                    _resolve(future, False)
+                    self.close()
+                    return
+
+                self.sent += 1
+                SEND_SECONDS.labels().observe(time.perf_counter() - queued)
+                _resolve(future, True)
+
+            self._wakeup.clear()
+            await self._wakeup.wait()
+
+    def close(self) -> None:
+        """
+        Stop the writer task and fail any messages still waiting. Messages
+        put after closing fail immediately.
+        """
+        self._closed = True
+        if self._writer is not None and \
+                self._writer is not asyncio.current_task():
+            self._writer.cancel()
+        self._writer = None
+
+        while self._queue:
+            _resolve(self._queue.popleft()[2], False)
+        self._keyed.clear()
+
+    def stats(self) -> Dict[str, int]:
+        """
+        Get the queue depth and message counters of this outbox.
+        """
+        return {'queued': len(self._queue), 'sent': self.sent,
+                'coalesced': self.coalesced, 'dropped': self.dropped}
+
+
+def _resolve(future: Optional[Future], result: bool) -> None:
+    """
+    Set the result of a future if there is one that is still pending.
+    """
+    if future is not None and not future.done():
+        future.set_result(result)
@@ -0,0 +1,251 @@
+"""
+Bulk import and export of colors and color lists.
+
+Supported formats:
+
+- ``jsonl``: one JSON object per line, either ``{"name": ..., "color": ...}``
+  for a color or ``{"name": ..., "color_list": [...]}`` for a color list
+- ``csv``: rows of ``kind,name,color[,color...]``, where kind is ``color`` or
+  ``color_list``; a header row starting with ``kind`` is skipped
+- ``gpl``: a GIMP palette; each entry is imported as a color, and the palette
+  as a whole as a color list named after the palette
+
+Imports are parsed line by line as the body is read, and written to storage
+in batches, so neither the body nor the full set of changes is ever held in
+memory at once.
+"""
+import io
+import csv
+import json
+
+from typing import Any, Callable, Dict, Iterable, Iterator, List, NamedTuple, \
+    Optional, Tuple
+
+from . import util
+from .storage import user_data, summarize_changes
+
+FORMATS = ('jsonl', 'csv', 'gpl')
+
+MIMETYPES = {'jsonl': 'application/x-ndjson',
+             'csv': 'text/csv',
+             'gpl': 'application/x-gimp-palette'}
+
+
+class Entry(NamedTuple):
+    """
+    An item parsed from an imported palette, or a line that could not be
+    parsed.
+    """
+    line: int
+    section: Optional[str] = None  # "colors" or "color_lists"
+    name: Optional[str] = None
+    value: Any = None  # a color, or a list of colors
+    error: Optional[str] = None
+
+
+def parse_jsonl(lines: Iterable[str]) -> Iterator[Entry]:
+    """
+    Parse a palette in the jsonl format.
+    """
+    for number, line in enumerate(lines, 1):
+        if not line.strip():
+            continue
+        try:
+            item = json.loads(line)
+            name = item['name']
+            if 'color_list' in item:
+                yield Entry(number, 'color_lists', name, item['color_list'])
+            else:
+                yield Entry(number, 'colors', name, item['color'])
+        except (ValueError, KeyError, TypeError) as err:
+            yield Entry(number, error=f'Invalid line: {err!r}')
+
+
+def parse_csv(lines: Iterable[str]) -> Iterator[Entry]:
+    """
+    Parse a palette in the csv format.
+    """
+    reader = csv.reader(lines)
+    for row in reader:
+        number = reader.line_num
+        if not row or (number == 1 and row[0] == 'kind'):
+            continue
+        if len(row) < 3 or row[0] not in ('color', 'color_list'):
+            yield Entry(number, error='Expected kind,name,color[,color...]')
+        elif row[0] == 'color':
+            if len(row) != 3:
+                yield Entry(number, error='Expected a single color')
+            else:
+                yield Entry(number, 'colors', row[1], row[2])
+        else:
+            yield Entry(number, 'color_lists', row[1], row[2:])
+
+
+def parse_gpl(lines: Iterable[str]) -> Iterator[Entry]:
+    """
+    Parse a palette in the GIMP palette format.
+    """
+    palette_name = None
+    palette: List[str] = []
+    for number, line in enumerate(lines, 1):
+        line = line.strip()
+        if number == 1:
+            if line != 'GIMP Palette':
+                yield Entry(number, error='Expected "GIMP Palette" header')
+                return
+            continue
+        if line.startswith('Name:'):
+            palette_name = line[5:].strip()
+            continue
+        if not line or line.startswith('#') or line.startswith('Columns:'):
+            continue
+
+        parts = line.split(None, 3)
+        try:
+            channels = [int(c) for c in parts[:3]]
+            if len(channels) != 3 or not all(0 <= c <= 255 for c in channels):
+                raise ValueError(line)
+        except ValueError:
+            yield Entry(number, error='Expected "R G B name"')
+            continue
+
+        color = '#%02x%02x%02x' % tuple(channels)
+        palette.append(color)
+        name = parts[3].strip() if len(parts) > 3 else \
+            f'{palette_name or "color"} {len(palette)}'
+        yield Entry(number, 'colors', name, color)
+
+    if palette_name and palette:
+        yield Entry(number, 'color_lists', palette_name, palette)
+
+
+PARSERS: Dict[str, Callable[[Iterable[str]], Iterator[Entry]]] = {
+    'jsonl': parse_jsonl,
+    'csv': parse_csv,
+    'gpl': parse_gpl
+}
+
+
+def _validate(batch: Dict[str, Dict[str, Entry]],
+              errors: List[Dict]) -> Dict[str, Dict[str, Any]]:
+    """
+    Normalize the colors of a batch of entries, moving invalid ones to
+    ``errors``.
+
+    :return: the valid changes, grouped by section
+    """
+    changes = dict()
+
+    entries = list(batch.get('colors', dict()).values())
+    parsed = util.parse_colors([e.value for e in entries])
+    invalid = set(parsed.invalid)
+    for i, entry in enumerate(entries):
+        if i in invalid:
+            errors.append({'line': entry.line,
+                           'message': f'Invalid color {entry.value!r}'})
+        else:
+            changes.setdefault('colors', dict())[entry.name] = parsed.colors[i]
+
+    for entry in batch.get('color_lists', dict()).values():
+        if not isinstance(entry.value, list):
+            errors.append({'line': entry.line, 'message': 'Invalid color list'})
+            continue
+        parsed = util.parse_colors(entry.value)
+        if parsed.invalid:
+            errors.append({'line': entry.line,
+                           'message': f'Invalid colors at {parsed.invalid}'})
+        else:
+            changes.setdefault('color_lists', dict())[entry.name] = \
+                parsed.colors
+
+    return changes
+
+
+def import_palette(user_id: int, entries: Iterable[Entry],
+                   batch_size: int = 1000) -> Tuple[Dict, List[Dict]]:
+    """
+    Add or modify a user's colors and color lists from parsed palette entries.
+    Entries are validated and written ``batch_size`` at a time; invalid
+    entries are skipped.
+
+    :param user_id: ID of the user to import to
+    :param entries: the parsed entries
+    :param batch_size: number of entries to write at once
+    :return: a summary of the changes in the form returned by
+        ``summarize_changes``, and the line and message of each skipped entry
+    """
+    summary: Dict = dict()
+    errors: List[Dict] = []
+    # entries of a batch by section and name; later entries replace earlier
+    batch: Dict[str, Dict[str, Entry]] = dict()
+    size = 0
+
+    def flush():
+        changes = _validate(batch, errors)
+        if changes:
+            summarize_changes(changes, user_data.put(user_id, changes),
+                              summary)
+        batch.clear()
+
+    for entry in entries:
+        if entry.error:
+            errors.append({'line': entry.line, 'message': entry.error})
+            continue
+        if not isinstance(entry.name, str) or not entry.name:
+            errors.append({'line': entry.line, 'message': 'Invalid name'})
+            continue
+
+        batch.setdefault(entry.section, dict())[entry.name] = entry
+        size += 1
+        if size >= batch_size:
+            flush()
+            size = 0
+
+    if batch:
+        flush()
+    # colors are validated a batch at a time, after the lines before them
+    errors.sort(key=lambda e: e['line'])
+    return summary, errors
+
+
+def export_jsonl(data: Dict) -> Iterator[str]:
+    """
+    Write colors and color lists in the jsonl format.
+    """
+    for name, color in data.get('colors', dict()).items():
+        yield json.dumps({'name': name, 'color': color}) + '\n'
+    for name, color_list in data.get('color_lists', dict()).items():
+        yield json.dumps({'name': name, 'color_list': color_list}) + '\n'
+
+
+def export_csv(data: Dict) -> Iterator[str]:
+    """
+    Write colors and color lists in the csv format.
+    """
+    buffer = io.StringIO()
+    writer = csv.writer(buffer)
+
+    def row(*values) -> str:
+        buffer.seek(0)
+        buffer.truncate()
+        writer.writerow(values)
+        return buffer.getvalue()
+
+    yield row('kind', 'name', 'colors')
+    for name, color in data.get('colors', dict()).items():
+        yield row('color', name, color)
+    for name, color_list in data.get('color_lists', dict()).items():
+        yield row('color_list', name, *color_list)
+
+
+def export_gpl(name: str, colors: Iterable[Tuple[str, str]]) -> Iterator[str]:
+    """
+    Write a GIMP palette.
+
+    :param name: the name of the palette
+    :param colors: the name and color of each entry
+    """
+    yield f'GIMP Palette\nName: {name}\n#\n'
+    for color_name, color in colors:
+        r, g, b = bytes.fromhex(color[1:])
+        yield f'{r:3} {g:3} {b:3}\t{color_name}\n'
@@ -0,0 +1,264 @@
+"""
+Profiling of a fraction of the requests to chosen resources, and of client
+registrations by the proxy server, to diagnose regressions in production
+without redeploying.
+
+Each profiled call is written to its own file in the profile directory, named
+after what was profiled, e.g. ``Submit.1571234567890.1234.0.prof``. Only the
+most recent ``PROFILE_KEEP`` files of each name are kept:
+
+- in ``pstats`` mode, calls are profiled with ``cProfile`` and written in the
+  ``pstats`` format; combine them with ``pstats.Stats(*paths)``
+- in ``collapsed`` mode, the stack of the profiled thread is sampled at an
+  interval and written as collapsed stacks (one ``frame;frame;frame count``
+  line per distinct stack), ready for flame graph tools
+
+Client registrations run on the proxy server loop, so their profiles also
+include whatever else the loop ran while they were waiting. Only one call is
+profiled per thread at a time; calls made while another is being profiled
+are not profiled.
+"""
+import os
+import sys
+import time
+import random
+import cProfile
+import logging
+import threading
+import itertools
+
+from collections import Counter
+from contextlib import contextmanager
+from typing import Dict, Optional, Set
+from flask import Flask
+
+from .config import configure_logger
+
+logger = logging.getLogger(__name__)
+configure_logger(logger)
+
+PSTATS = 'pstats'
+COLLAPSED = 'collapsed'
+PROFILE_MODES = {PSTATS, COLLAPSED}
+
+# name profiled client registrations are written under
+WS_HANDLER = 'ws_handler'
+
+# distinguishes profiles written in the same millisecond
+_sequence = itertools.count()
+
+
+def collapse(frame) -> str:
+    """
+    Describe the stack of a frame in the collapsed format, outermost first.
+    """
+    names = []
+    while frame is not None:
+        code = frame.f_code
+        names.append(f'{code.co_name} '
+                     f'({os.path.basename(code.co_filename)}:'
+                     f'{code.co_firstlineno})')
+        frame = frame.f_back
+    return ';'.join(reversed(names))
+
+
+class Sampler:
+    """
+    Background thread counting the stacks of the threads being profiled.
+    """
+
+    def __init__(self, interval: float):
+        """
+        :param interval: seconds between samples
+        """
+        self.interval = interval
+        # map thread ID to counts of its stacks
+        self._targets: Dict[int, Counter] = dict()
+        self._lock = threading.Lock()
+        self._thread: Optional[threading.Thread] = None
+
+    def start(self, thread_id: int) -> None:
+        with self._lock:
+            self._targets[thread_id] = Counter()
+            if self._thread is None:
+                self._thread = threading.Thread(target=self._run, daemon=True)
+                self._thread.start()
+
+    def stop(self, thread_id: int) -> Counter:
+        """
+        Stop sampling a thread.
+
+        :return: the number of times each stack was sampled
+        """
+        with self._lock:
+            return self._targets.pop(thread_id)
+
+    def _run(self) -> None:
+        while True:
+            time.sleep(self.interval)
+            with self._lock:
+                if not self._targets:
+                    continue
+                frames = sys._current_frames()
+                for thread_id, counts in self._targets.items():
+                    frame = frames.get(thread_id)
+                    if frame is not None:
+                        counts[collapse(frame)] += 1
+
+
+class Profiler:
+    """
+    Profiles a fraction of the calls made under the configured names.
+    """
+
+    def __init__(self, app: Flask = None):
+        self.directory: Optional[str] = None
+        self.rate = 0.0
+        self.names: Optional[Set[str]] = None  # every name if None
+        self.mode = PSTATS
+        self.keep = 100  # files kept per name
+        self.sampler: Optional[Sampler] = None
+        # threads with a call being profiled
+        self._active: Set[int] = set()
+        self._lock = threading.Lock()
+        if app:
+            self.init_app(app)
+
+    def init_app(self, app: Flask) -> None:
+        """
+        Set up profiling according to the app's ``PROFILE_*`` settings.
+
+        :raises ValueError: if the profile mode is invalid
+        """
+        mode = app.config.get('PROFILE_MODE', PSTATS)
+        if mode not in PROFILE_MODES:
+            raise ValueError(f"Invalid profile mode {mode!r}; expected "
+                             f"'pstats' or 'collapsed'")
+        self.mode = mode
+        self.directory = app.config.get('PROFILE_DIR')
+        self.rate = app.config.get('PROFILE_RATE', 0.0)
+        self.names = app.config.get('PROFILE_RESOURCES') or None
+        self.keep = app.config.get('PROFILE_KEEP', 100)
+        if self.directory:
+            os.makedirs(self.directory, exist_ok=True)
+            if mode == COLLAPSED and self.sampler is None:
+                self.sampler = Sampler(
+                    app.config.get('PROFILE_INTERVAL', 0.001))
+
+    @property
+    def enabled(self) -> bool:
+        return bool(self.directory) and self.rate > 0
+
+    def wants(self, name: str) -> bool:
+        """
+        Decide whether to profile a call made under a name.
+        """
+        return self.enabled and (self.names is None or name in self.names) \
+            and random.random() < self.rate
+
+    def begin(self, name: str) -> Optional['Profile']:
+        """
+        Start profiling the current thread if the call should be profiled.
+
+        :param name: what is being called, e.g. the name of a resource
+        :return: the profile to ``end`` once the call returns; ``None`` if the
+            call is not profiled
+        """
+        if not self.wants(name):
+            return None
+
+        thread_id = threading.get_ident()
+        with self._lock:
+            if thread_id in self._active:
+                return None
+            self._active.add(thread_id)
+
+        profile = Profile(self, name, thread_id)
+        try:
+            profile.start()
+        except ValueError as err:  # another profiler is active
+            logger.warning(f'Could not profile {name}: {err}')
+            self._release(thread_id)
+            return None
+        return profile
+
+    @contextmanager
+    def profile(self, name: str):
+        """
+        Profile a fraction of the executions of a ``with`` block.
+        """
+        profile = self.begin(name)
+        try:
+            yield
+        finally:
+            if profile:
+                profile.end()
+
+    def prune(self, name: str) -> None:
+        """
+        Delete the oldest profiles written under a name, beyond the most
+        recent ``keep``, including those written by other processes.
+        """
+        profiles = []
+        for filename in os.listdir(self.directory):
+            parts = filename.rsplit('.', 4)
+            if len(parts) == 5 and parts[0] == name and \
+                    parts[1].isdigit() and parts[3].isdigit():
+                profiles.append(((int(parts[1]), int(parts[3])), filename))
+
+        profiles.sort()
+        for _, filename in profiles[:max(len(profiles) - self.keep, 0)]:
+            try:
+                os.remove(os.path.join(self.directory, filename))
+            except FileNotFoundError:
+                pass  # pruned by another process
+
+    def _release(self, thread_id: int) -> None:
+        with self._lock:
+            self._active.discard(thread_id)
+
+
+class Profile:
+    """
+    The profile of one call, written to the profile directory when it ends.
+    """
+
+    def __init__(self, profiler: Profiler, name: str, thread_id: int):
+        self.profiler = profiler
+        self.name = name
+        self.thread_id = thread_id
+        self._cprofile: Optional[cProfile.Profile] = None
+
+    def start(self) -> None:
+        if self.profiler.mode == COLLAPSED:
+            self.profiler.sampler.start(self.thread_id)
+        else:
+            self._cprofile = cProfile.Profile()
+            self._cprofile.enable()
+
+    def end(self) -> None:
+        """
+        Stop profiling, write the profile and prune old profiles of the same
+        name. Must be called from the thread that started it.
+        """
+        path = os.path.join(
+            self.profiler.directory,
+            f'{self.name}.{int(time.time() * 1000)}.{os.getpid()}.'
+            f'{next(_sequence)}')
+        try:
+            if self._cprofile is not None:
+                self._cprofile.disable()
+                self._cprofile.dump_stats(path + '.prof')
+            else:
+                counts = self.profiler.sampler.stop(self.thread_id)
+                with open(path + '.collapsed', 'w') as file:
+                    for stack, count in counts.items():
+                        file.write(f'{stack} {count}\n')
+            self.profiler.prune(self.name)
+        except OSError as err:
+            logger.error(f'Failed to write profile of {self.name}: {err}')
+        finally:
+            self.profiler._release(self.thread_id)
+
+
+profiler = Profiler()  # make sure to call init_app on this
@@ -0,0 +1,351 @@
+"""
+Encodings of the messages sent from the proxy server to clients.
+
+Clients pick an encoding at registration by listing the ones they support in
+the ``encodings`` field of their registration data, in order of preference.
+Clients that don't, or that support none of ``ENCODINGS``, are sent JSON.
+
+The ``binary`` encoding packs a lighting configuration into a single binary
+websocket frame::
+
+    header      !BBdB   frame type (1), flags, speed, pattern name length
+    pattern     utf-8 pattern name
+    color       3 bytes of RGB, if FLAG_COLOR is set
+    color_list  !H count, then 3 bytes of RGB per color, if FLAG_COLOR_LIST
+                is set
+    id          !I message ID, if FLAG_ID is set
+    trace_id    8 bytes of trace ID, if FLAG_TRACE is set
+
+Lighting configurations with fields the layout has no room for are sent as
+JSON text frames instead, so clients using the binary encoding must accept
+both kinds of frames.
+
+Clients using the binary encoding can also be streamed raw pixel frames (see
+``webcandy.stream``)::
+
+    header      !BIH    frame type (2), sequence number, pixel count
+    pixels      3 bytes of RGB per pixel
+
+Clients that set ``clock_sync`` in their registration data take part in clock
+synchronization (see ``webcandy.clock``). They are sent probes as JSON text
+frames, in either encoding::
+
+    {"type": "clock_sync", "server_time": t0}
+
+and must answer each one straight away with::
+
+    {"type": "clock_sync", "server_time": t0, "received": t1, "sent": t2}
+
+where ``t1`` and ``t2`` are the Unix times by the client's clock at which the
+probe was received and the answer sent. Lighting configurations sent to these
+clients may then have a "start_at" field: the Unix time by the client's clock
+at which to start the pattern.
+
+Clients that set ``acks`` in their registration data are sent lighting
+configurations with an "id" field, and must answer each one once it has been
+applied with::
+
+    {"type": "ack", "id": id}
+
+or, if it could not be applied, with an "error" field describing why.
+
+Lighting configurations of traced requests (see ``webcandy.tracing``) have a
+"trace_id" field: 16 hex digits identifying the trace, which clients can
+include in their logs.
+"""
+import json
+import struct
+import itertools
+
+from typing import Dict, List, Optional, Tuple, Union
+
+from . import util
+
+JSON = 'json'
+BINARY = 'binary'
+ENCODINGS = (JSON, BINARY)
+
+FRAME_LIGHTING = 1
+FRAME_PIXELS = 2
+
+FLAG_STROBE = 0x01
+FLAG_SPEED = 0x02
+FLAG_COLOR = 0x04
+FLAG_COLOR_LIST = 0x08
+FLAG_ID = 0x10
+FLAG_TRACE = 0x20
+FLAG_HAS_STROBE = 0x40
+
+# speed is a double so that it arrives exactly as it was sent
+HEADER = struct.Struct('!BBdB')
+PIXELS_HEADER = struct.Struct('!BIH')
+COUNT = struct.Struct('!H')
+MESSAGE_ID = struct.Struct('!I')
+TRACE_ID = struct.Struct('!8s')
+
+# fields of a lighting configuration the binary layout can hold
+_BINARY_FIELDS = frozenset(('pattern', 'strobe', 'speed', 'color',
+                            'color_list', 'id', 'trace_id'))
+
+Frame = Union[str, bytes]
+
+CLOCK_SYNC = 'clock_sync'
+ACK = 'ack'
+
+# message IDs, which wrap around to fit the binary layout
+_message_ids = itertools.count()
+
+
+def negotiate(requested: Optional[List[str]]) -> str:
+    """
+    Pick the encoding to use for a client.
+
+    :param requested: encodings supported by the client, in order of preference
+    :return: the first requested encoding this server supports; JSON if none
+    """
+    for encoding in requested or ():
+        if encoding in ENCODINGS:
+            return encoding
+    return JSON
+
+
+def _pack_colors(colors: List[str]) -> bytes:
+    parsed = util.parse_colors(colors)
+    if parsed.invalid:
+        raise ValueError(f'Invalid colors at {parsed.invalid}')
+    return parsed.packed
+
+
+def _unpack_color(data: bytes, offset: int) -> str:
+    return '#' + data[offset:offset + 3].hex()
+
+
+def pack_lighting(data: dict) -> Optional[bytes]:
+    """
+    Pack a lighting configuration using the binary layout.
+
+    :param data: the lighting configuration
+    :return: the packed configuration; ``None`` if it doesn't fit the layout
+    """
+    if not _BINARY_FIELDS.issuperset(data) or \
+            not isinstance(data.get('pattern'), str):
+        return None
+
+    flags = 0
+    speed = data.get('speed')
+    strobe = data.get('strobe')
+    if strobe is not None:
+        if not isinstance(strobe, bool):
+            return None
+        # strobe is sent as given, False included
+        flags |= FLAG_HAS_STROBE | (FLAG_STROBE if strobe else 0)
+    if speed is not None:
+        flags |= FLAG_SPEED
+
+    name = data['pattern'].encode()
+    if len(name) > 255:
+        return None
+
+    parts = [name]
+    try:
+        color = data.get('color')
+        if color is not None:
+            flags |= FLAG_COLOR
+            parts.append(_pack_colors([color]))
+        color_list = data.get('color_list')
+        if color_list is not None:
+            flags |= FLAG_COLOR_LIST
+            parts.append(COUNT.pack(len(color_list)))
+            parts.append(_pack_colors(color_list))
+        message_id = data.get('id')
+        if message_id is not None:
+            flags |= FLAG_ID
+            parts.append(MESSAGE_ID.pack(message_id))
+        trace_id = data.get('trace_id')
+        if trace_id is not None:
+            trace_id = bytes.fromhex(trace_id)
+            if len(trace_id) != TRACE_ID.size:
+                return None
+            flags |= FLAG_TRACE
+            parts.append(trace_id)
+        header = HEADER.pack(FRAME_LIGHTING, flags, float(speed or 0),
+                             len(name))
+    except (ValueError, TypeError, OverflowError, struct.error):
+        return None  # e.g. a speed too large for the layout
+
+    return header + b''.join(parts)
+
+
+def unpack_lighting(frame: bytes) -> dict:
+    """
+    Unpack a lighting configuration packed by ``pack_lighting``.
+
+    :param frame: the packed configuration
+    :return: the lighting configuration
+    :raises ValueError: if the frame is not a packed lighting configuration
+    """
+    try:
+        frame_type, flags, speed, length = HEADER.unpack_from(frame)
+        if frame_type != FRAME_LIGHTING:
+            raise ValueError(f'Invalid frame type {frame_type}')
+
+        offset = HEADER.size
+        data = {'pattern': frame[offset:offset + length].decode()}
+        offset += length
+
+        if flags & FLAG_HAS_STROBE:
+            data['strobe'] = bool(flags & FLAG_STROBE)
+        if flags & FLAG_SPEED:
+            data['speed'] = speed
+        if flags & FLAG_COLOR:
+            data['color'] = _unpack_color(frame, offset)
+            offset += 3
+        if flags & FLAG_COLOR_LIST:
+            count, = COUNT.unpack_from(frame, offset)
+            offset += COUNT.size
+            data['color_list'] = [_unpack_color(frame, offset + 3 * i)
+                                  for i in range(count)]
+            offset += 3 * count
+        if flags & FLAG_ID:
+            data['id'], = MESSAGE_ID.unpack_from(frame, offset)
+            offset += MESSAGE_ID.size
+        if flags & FLAG_TRACE:
+            data['trace_id'] = frame[offset:offset + TRACE_ID.size].hex()
+            offset += TRACE_ID.size
+    except (struct.error, UnicodeDecodeError) as err:
+        raise ValueError(f'Invalid frame: {err}')
+
+    if offset != len(frame):
+        raise ValueError(f'Invalid frame length {len(frame)}, '
+                         f'expected {offset}')
+    return data
+
+
+def unpack_pixels(frame: bytes) -> Tuple[int, bytes]:
+    """
+    Unpack a pixel frame.
+
+    :param frame: the pixel frame
+    :return: the sequence number of the frame and its RGB pixel data
+    :raises ValueError: if the frame is not a pixel frame
+    """
+    try:
+        frame_type, sequence, count = PIXELS_HEADER.unpack_from(frame)
+    except struct.error as err:
+        raise ValueError(f'Invalid frame: {err}')
+    if frame_type != FRAME_PIXELS:
+        raise ValueError(f'Invalid frame type {frame_type}')
+
+    expected = PIXELS_HEADER.size + 3 * count
+    if len(frame) != expected:
+        raise ValueError(f'Invalid frame length {len(frame)}, '
+                         f'expected {expected}')
+    return sequence, bytes(frame[PIXELS_HEADER.size:])
+
+
+def decode(frame: Frame) -> dict:
+    """
+    Decode a message sent by the proxy server, in either encoding. Pixel
+    frames are given as a dictionary with "sequence" and "pixels" keys.
+    """
+    if isinstance(frame, str):
+        return json.loads(frame)
+    if frame[:1] == bytes((FRAME_PIXELS,)):
+        sequence, pixels = unpack_pixels(frame)
+        return {'sequence': sequence, 'pixels': pixels}
+    return unpack_lighting(frame)
+
+
+def clock_probe(server_time: float) -> str:
+    """
+    Make a clock synchronization probe.
+
+    :param server_time: Unix time by the server's clock the probe is sent at
+    """
+    return json.dumps({'type': CLOCK_SYNC, 'server_time': server_time})
+
+
+def parse_clock_reply(data: dict) -> Tuple[float, float, float]:
+    """
+    Get the timestamps of a client's answer to a clock synchronization probe.
+
+    :param data: the decoded answer
+    :return: the times the probe was sent, received and answered
+    :raises ValueError: if the answer is invalid
+    """
+    try:
+        times = data['server_time'], data['received'], data['sent']
+    except (KeyError, TypeError):
+        raise ValueError(f'Invalid clock probe answer: {data!r}')
+    if not all(isinstance(t, (int, float)) and not isinstance(t, bool)
+               for t in times):
+        raise ValueError(f'Invalid clock probe answer: {data!r}')
+    return times
+
+
+def parse_ack(data: dict) -> Tuple[int, Optional[str]]:
+    """
+    Get the message ID and error of a client's acknowledgement.
+
+    :param data: the decoded acknowledgement
+    :return: the ID of the acknowledged message, and why it could not be
+        applied; ``None`` if it was
+    :raises ValueError: if the acknowledgement is invalid
+    """
+    message_id = data.get('id') if isinstance(data, dict) else None
+    error = data.get('error') if isinstance(data, dict) else None
+    if not isinstance(message_id, int) or isinstance(message_id, bool) or \
+            not (error is None or isinstance(error, str)):
+        raise ValueError(f'Invalid acknowledgement: {data!r}')
+    return message_id, error
+
+
+class Message:
+    """
+    A message to send to any number of clients, encoded at most once per
+    encoding. Each message has an ID, included for clients that acknowledge
+    messages.
+    """
+
+    def __init__(self, data: dict = None, text: str = None):
+        """
+        :param data: the message
+        :param text: the message already encoded as JSON; one of ``data`` or
+            ``text`` is required
+        """
+        if data is None and text is None:
+            raise ValueError('data or text is required')
+        self._data = data
+        # map (encoding, whether the ID is included) to frame
+        self._frames: Dict[Tuple[str, bool], Frame] = dict()
+        if text is not None:
+            self._frames[JSON, False] = text
+        self.message_id = next(_message_ids) & 0xFFFFFFFF
+
+    @property
+    def data(self) -> dict:
+        if self._data is None:
+            self._data = json.loads(self._frames[JSON, False])
+        return self._data
+
+    def encode(self, encoding: str = JSON, with_id: bool = False) -> Frame:
+        """
+        Get the message in an encoding. Messages that cannot be represented in
+        the binary encoding are given as JSON.
+
+        :param encoding: one of ``ENCODINGS``
+        :param with_id: whether to include the message ID as "id"
+        :return: a text frame for JSON, a binary frame otherwise
+        """
+        frame = self._frames.get((encoding, with_id))
+        if frame is None:
+            data = dict(self.data, id=self.message_id) if with_id \
+                else self.data
+            if encoding == BINARY:
+                frame = pack_lighting(data)
+                if frame is None:
+                    frame = self.encode(JSON, with_id)
+            else:
+                frame = json.dumps(data)
+            self._frames[encoding, with_id] = frame
+        return frame
@@ -0,0 +1,254 @@
+import os
+import hmac
+import json
+import signal
+import asyncio
+import logging
+import argparse
+
+from .app import create_app
+from .config import Config, configure_logger
+from .events import event_bus
+from .metrics import metrics, process_labels, CONTENT_TYPE
+from .registry import Registry, IPCRegistry
+from .server import clients, proxy_server
+
+logger = logging.getLogger(__name__)
+configure_logger(logger)
+
+
+async def _handle_command(reader: asyncio.StreamReader,
+                          writer: asyncio.StreamWriter) -> None:
+    """
+    Answer requests from a web app process until it disconnects. See
+    ``IPCRegistry`` for the other end of the connection.
+    """
+    while True:
+        line = await reader.readline()
+        if not line:
+            break
+
+        try:
+            request = json.loads(line)
+            op = request['op']
+            user_id = request['user_id']
+
+            if op == 'subscribe':
+                # the connection is the subscriber's from now on
+                await _stream_events(user_id, request['keepalive'], writer)
+                return
+            elif op == 'publish':
+                names = request['client_names']
+                clients.deliver(user_id, names, request['message'],
+                                request['key'])
+                reply = {'results': {name: clients.is_local(user_id, name)
+                                     for name in names}}
+            elif op == 'clients':
+                reply = {'clients': clients.available_clients(user_id)}
+            elif op == 'patterns':
+                reply = {'patterns': clients.get_patterns(
+                    user_id, request['client_name'])}
+            elif op == 'status':
+                reply = {'status': clients.get_status(
+                    user_id, request['client_name'])}
+            elif op == 'broadcast_synced':
+                start_at, futures = proxy_server.broadcast_synced(
+                    user_id, request['data'], request['client_names'],
+                    request['start_at'])
+                reply = {'start_at': start_at,
+                         'results': {name: future is not None
+                                     for name, future in futures.items()}}
+            elif op == 'schedule':
+                timeline = proxy_server.make_timeline(
+                    user_id, request['cues'], clients.encodings(user_id),
+                    request['start'])
+                try:
+                    proxy_server.scheduler.add(timeline)
+                    reply = {'timeline': timeline.status()}
+                except ValueError as err:  # refused, not invalid
+                    reply = {'error': str(err)}
+            elif op == 'timelines':
+                reply = {'timelines': proxy_server.pending_timelines(user_id)}
+            elif op == 'cancel_timeline':
+                reply = {'success': proxy_server.cancel_pending(
+                    user_id, request['timeline_id'])}
+            else:
+                reply = {'error': f'Invalid operation {op!r}'}
+        except (ValueError, KeyError, TypeError) as err:
+            reply = {'error': f'Invalid request: {err!r}'}
+
+        if 'error' in reply:
+            logger.error(reply['error'])
+        writer.write(json.dumps(reply).encode() + b'\n')
+        await writer.drain()
+
+    writer.close()
+
+
+async def _stream_events(user_id: int, keepalive: float,
+                         writer: asyncio.StreamWriter) -> None:
+    """
+    Send a user's events to a web app process, one serialized event per line
+    as a JSON string, or ``null`` once ``keepalive`` seconds pass without
+    any, until it disconnects. See ``IPCRegistry.subscribe`` for the other
+    end of the connection.
+    """
+    try:
+        subscription = event_bus.subscribe(user_id)
+    except ValueError as err:  # too many subscribers
+        writer.write(json.dumps({'error': str(err)}).encode() + b'\n')
+        writer.close()
+        return
+
+    loop = asyncio.get_event_loop()
+    wakeup = asyncio.Event()
+    subscription.notify = lambda: loop.call_soon_threadsafe(wakeup.set)
+    try:
+        with subscription:
+            writer.write(json.dumps({'subscribed': True}).encode() + b'\n')
+            while True:
+                try:
+                    await asyncio.wait_for(wakeup.wait(), keepalive)
+                except asyncio.TimeoutError:
+                    pass
+                wakeup.clear()
+
+                events = []
+                event = subscription.get(0)
+                while event is not None:
+                    events.append(event)
+                    event = subscription.get(0)
+                for event in events or [None]:
+                    writer.write(json.dumps(event).encode() + b'\n')
+                await writer.drain()
+    except ConnectionError:
+        pass  # the web app process closed the stream
+    finally:
+        writer.close()
+
+
+async def serve_commands(path: str) -> None:
+    """
+    Start serving the command channel on a unix socket.
+
+    :param path: path of the unix socket; replaced if it already exists
+    """
+    if os.path.exists(path):
+        os.remove(path)  # left behind by a previous process
+    await asyncio.start_unix_server(_handle_command, path)
+    logger.info(f'Command channel listening on {path}')
+
+
+async def _handle_scrape(reader: asyncio.StreamReader,
+                         writer: asyncio.StreamWriter) -> None:
+    """
+    Answer an HTTP request for this process's metrics at ``/metrics``, which
+    the web app's ``/metrics`` cannot report since it runs in other
+    processes. Requires the ``METRICS_TOKEN`` like the web app does.
+    """
+    try:
+        request_line = (await reader.readline()).decode('latin-1').split()
+        headers = dict()
+        line = await reader.readline()
+        while line.strip():
+            name, _, value = line.decode('latin-1').partition(':')
+            headers[name.strip().lower()] = value.strip()
+            line = await reader.readline()
+    except ConnectionError:
+        writer.close()
+        return
+
+    path = request_line[1].partition('?')[0] if len(request_line) > 1 else ''
+    token = Config.METRICS_TOKEN
+    if path != '/metrics':
+        status, body = '404 Not Found', 'Not found\n'
+    elif token and not hmac.compare_digest(
+            headers.get('authorization', '').encode(),
+            f'Bearer {token}'.encode()):
+        status, body = '401 Unauthorized', 'Invalid metrics token\n'
+    else:
+        # collectors wait for the loop, so render off it
+        status, body = '200 OK', await asyncio.get_event_loop(). \
+            run_in_executor(None, metrics.render, process_labels())
+
+    body = body.encode()
+    writer.write(f'HTTP/1.0 {status}\r\n'
+                 f'Content-Type: {CONTENT_TYPE}\r\n'
+                 f'Content-Length: {len(body)}\r\n\r\n'.encode() + body)
+    try:
+        await writer.drain()
+    except ConnectionError:
+        pass
+    writer.close()
+
+
+async def serve_metrics(host: str, port: int) -> asyncio.AbstractServer:
+    """
+    Start serving this process's metrics over HTTP.
+
+    :param port: the port to serve on; any free port if 0
+    :return: the server
+    """
+    server = await asyncio.start_server(_handle_scrape, host, port)
+    logger.info(f'Metrics listening on http://{host}:{port}/metrics')
+    return server
+
+
+def main() -> None:
+    """
+    Run the proxy server as its own process, separate from the web app. Web
+    app processes configured with ``CLIENT_REGISTRY=ipc`` do not start a
+    proxy server of their own; instead they look up clients and send data to
+    them through the command channel this process serves on a unix socket.
+    """
+    parser = argparse.ArgumentParser(
+        description='Run the Webcandy proxy server as its own process.')
+    parser.add_argument('--host', default='127.0.0.1',
+                        help='the host to serve on (default: %(default)s)')
+    parser.add_argument('--port', type=int, default=6543,
+                        help='the port to serve on (default: %(default)s)')
+    parser.add_argument('--ipc', default=Config.PROXY_IPC_PATH,
+                        help='path of the command channel unix socket '
+                             '(default: %(default)s)')
+    parser.add_argument('--metrics-port', type=int,
+                        help='port to export metrics of this process on in '
+                             'the Prometheus text format, at /metrics; not '
+                             'exported if not given')
+    parser.add_argument('--metrics-host', default='127.0.0.1',
+                        help='the host to export metrics on '
+                             '(default: %(default)s)')
+    parser.add_argument('--uvloop', action='store_true',
+                        help='run on uvloop instead of the default event loop')
+    args = parser.parse_args()
+
+    if args.uvloop:
+        try:
+            import uvloop
+        except ImportError:
+            parser.error('uvloop is not installed')
+        asyncio.set_event_loop_policy(uvloop.EventLoopPolicy())
+
+    create_app(start_proxy=False)
+    if isinstance(clients.registry, IPCRegistry):
+        clients.registry = Registry()  # this process is the one being queried
+
+    loop = asyncio.new_event_loop()
+    asyncio.set_event_loop(loop)
+    loop.run_until_complete(proxy_server.serve(args.host, args.port))
+    loop.run_until_complete(serve_commands(args.ipc))
+    if args.metrics_port is not None:
+        loop.run_until_complete(
+            serve_metrics(args.metrics_host, args.metrics_port))
+
+    for sig in (signal.SIGINT, signal.SIGTERM):
+        loop.add_signal_handler(sig, loop.stop)
+    try:
+        loop.run_forever()
+    finally:
+        if os.path.exists(args.ipc):
+            os.remove(args.ipc)
+        loop.close()
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,589 @@
+import os
+import json
+import select
+import socket
+import sqlite3
+import asyncio
+import logging
+import threading
+
+from concurrent.futures import ThreadPoolExecutor
+from typing import BinaryIO, Callable, Dict, List, Optional, Tuple, Union
+
+from .config import configure_logger
+from .events import Subscription, event_bus
+
+logger = logging.getLogger(__name__)
+configure_logger(logger)
+
+# called with (user_id, client names, serialized message, coalescing key)
+CommandHandler = Callable[[int, List[str], str, Optional[str]], None]
+# a change to the registry database, made with the given connection
+Write = Callable[[sqlite3.Connection], None]
+
+
+class Registry:
+    """
+    Record of which clients are connected across all processes of the app.
+
+    The proxy server process that holds a client's connection is its owner.
+    Other processes (e.g. other gunicorn workers) use the registry to look up
+    clients and to publish data to them through their owner. The base class
+    only knows about the current process, which is all that is needed when
+    the app runs as a single process.
+    """
+
+    def add(self, user_id: int, client_name: str, patterns: List[Dict]) -> None:
+        """
+        Record that this process owns a newly registered client.
+        """
+
+    def remove(self, user_id: int, client_name: str) -> None:
+        """
+        Record that a client owned by this process has disconnected.
+        """
+
+    def available_clients(self, user_id: int) -> List[str]:
+        """
+        Get the names of a user's clients connected to any process.
+        """
+        return []
+
+    def get_patterns(self, user_id: int,
+                     client_name: str) -> Optional[List[Dict]]:
+        """
+        Get the patterns of a client connected to any process.
+
+        :return: the client's patterns; ``None`` if the client is not connected
+        """
+        return None
+
+    def update_status(self, user_id: int, client_name: str,
+                      status: Dict) -> None:
+        """
+        Record the connection state of a client owned by this process.
+        """
+
+    def get_status(self, user_id: int, client_name: str) -> Optional[Dict]:
+        """
+        Get the connection state of a client connected to any process.
+
+        :return: the client's state; ``None`` if the client is not connected or
+            its state is unknown
+        """
+        return None
+
+    def publish(self, user_id: int, client_names: List[str], message: str,
+                key: Optional[str] = None) -> Dict[str, bool]:
+        """
+        Send a serialized message to clients owned by other processes.
+
+        :param user_id: the user who owns the clients
+        :param client_names: names of the clients to send to
+        :param message: the serialized message
+        :param key: coalescing key for the clients' outboxes
+        :return: map of client name to whether the message was handed to the
+            client's owner
+        """
+        return dict.fromkeys(client_names, False)
+
+    def forward(self, request: Dict) -> Dict:
+        """
+        Have the proxy server carry out a command that must run on its loop,
+        such as scheduling a timeline, from a process that does not run it.
+        Only possible when the proxy server runs as its own process (see
+        ``IPCRegistry``); other processes never see each other's loops.
+
+        :param request: the command, named by its "op" field (see
+            ``webcandy.proxy``)
+        :return: the reply of the proxy server
+        :raises NotImplementedError: if commands cannot be forwarded
+        :raises ConnectionError: if the proxy server could not be reached
+        :raises ValueError: if the proxy server refused the command
+        """
+        raise _unavailable(repr(request['op']))
+
+    def subscribe(self, user_id: int, keepalive: float) \
+            -> Union[Subscription, 'RemoteSubscription']:
+        """
+        Subscribe to a user's events (see ``webcandy.events``) from a process
+        that does not run the proxy server, which is where they are published.
+        The base class only knows about the current process, so its events
+        are the only ones there are.
+
+        :param user_id: the user whose events to subscribe to
+        :param keepalive: most seconds a remote subscription goes without
+            returning from ``get``; ``None`` is returned if there was no event
+        :raises ValueError: if the user has too many subscribers
+        :raises NotImplementedError: if the events are published in a process
+            this registry cannot subscribe to
+        :raises ConnectionError: if the proxy server could not be reached
+        """
+        return event_bus.subscribe(user_id)
+
+    async def serve(self, handler: CommandHandler) -> None:
+        """
+        Receive messages published to clients owned by this process and pass
+        them to ``handler``. Runs on the proxy server loop for as long as the
+        server does.
+        """
+
+
+class SQLiteRegistry(Registry):
+    """
+    Registry kept in a SQLite database shared by all processes on the host.
+
+    Messages for clients owned by another process are queued in the database,
+    and each proxy server process polls for the messages addressed to it.
+
+    So that the proxy server loop never waits on the database, changes to
+    this process' clients are queued and written by a writer thread, which
+    writes everything queued since its last transaction in one transaction,
+    keeping only the latest status of each client. Polling runs on a thread
+    of its own.
+    """
+
+    def __init__(self, path: str, poll_interval: float = 0.01,
+                 owner: int = None):
+        """
+        :param path: path of the database file
+        :param poll_interval: seconds between checks for published messages
+        :param owner: ID of this process; its PID by default
+        """
+        self.path = path
+        self.poll_interval = poll_interval
+        self.owner = os.getpid() if owner is None else owner
+        self._local = threading.local()
+
+        # writes waiting for the writer thread, in order, and the latest
+        # status of each client waiting to be written after them
+        self._writes: List[Write] = []
+        self._statuses: Dict[Tuple[int, str], Dict] = dict()
+        self._writing = False  # whether the writer is mid-transaction
+        self._pending = threading.Condition()
+        self._writer: Optional[threading.Thread] = None
+        self._poller = ThreadPoolExecutor(1)
+
+        with self._connection() as conn:
+            conn.executescript('''
+                CREATE TABLE IF NOT EXISTS clients (
+                    user_id INTEGER NOT NULL,
+                    client_name TEXT NOT NULL,
+                    patterns TEXT NOT NULL,
+                    owner INTEGER NOT NULL,
+                    status TEXT,
+                    PRIMARY KEY (user_id, client_name)
+                );
+                CREATE TABLE IF NOT EXISTS commands (
+                    command_id INTEGER PRIMARY KEY AUTOINCREMENT,
+                    owner INTEGER NOT NULL,
+                    user_id INTEGER NOT NULL,
+                    client_names TEXT NOT NULL,
+                    message TEXT NOT NULL,
+                    key TEXT
+                );
+                CREATE INDEX IF NOT EXISTS ix_commands_owner
+                    ON commands (owner, command_id);
+            ''')
+
+    def _connection(self) -> sqlite3.Connection:
+        """
+        Get this thread's connection to the database.
+        """
+        conn = getattr(self._local, 'conn', None)
+        if conn is None:
+            conn = sqlite3.connect(self.path, timeout=5)
+            conn.execute('PRAGMA journal_mode=WAL')
+            self._local.conn = conn
+        return conn
+
+    def _queue(self, write: Write) -> None:
+        """
+        Queue a write for the writer thread.
+        """
+        with self._pending:
+            self._writes.append(write)
+            self._wake()
+
+    def _wake(self) -> None:
+        """
+        Start the writer thread, or wake it up. Must be called with
+        ``_pending`` held.
+        """
+        if self._writer is None:
+            self._writer = threading.Thread(target=self._write, daemon=True)
+            self._writer.start()
+        self._pending.notify_all()
+
+    def _write(self) -> None:
+        """
+        Make the queued writes as they come, off the proxy server loop.
+        """
+        while True:
+            with self._pending:
+                self._pending.wait_for(lambda: self._writes or self._statuses)
+                writes, self._writes = self._writes, []
+                statuses, self._statuses = self._statuses, dict()
+                self._writing = True
+
+            try:
+                with self._connection() as conn:
+                    for write in writes:
+                        write(conn)
+                    # clients removed by now are left alone
+                    conn.executemany(
+                        'UPDATE clients SET status = ? WHERE user_id = ? AND '
+                        'client_name = ? AND owner = ?',
+                        [(json.dumps(status), user_id, client_name,
+                          self.owner)
+                         for (user_id, client_name), status
+                         in statuses.items()])
+            except sqlite3.Error as err:
+                logger.error(f'Could not update the client registry: {err}')
+            finally:
+                with self._pending:
+                    self._writing = False
+                    self._pending.notify_all()
+
+    def flush(self, timeout: Optional[float] = None) -> bool:
+        """
+        Wait until the changes queued so far are written.
+
+        :param timeout: maximum number of seconds to wait
+        :return: whether the changes were written in time
+        """
+        with self._pending:
+            return self._pending.wait_for(
+                lambda: not (self._writes or self._statuses or
+                             self._writing), timeout)
+
+    def add(self, user_id: int, client_name: str, patterns: List[Dict]) -> None:
+        self._queue(lambda conn: conn.execute(
+            'INSERT OR REPLACE INTO clients (user_id, client_name, patterns, '
+            'owner) VALUES (?, ?, ?, ?)',
+            (user_id, client_name, json.dumps(patterns), self.owner)))
+
+    def remove(self, user_id: int, client_name: str) -> None:
+        self._queue(lambda conn: conn.execute(
+            'DELETE FROM clients WHERE user_id = ? AND client_name = ? AND '
+            'owner = ?', (user_id, client_name, self.owner)))
+
+    def available_clients(self, user_id: int) -> List[str]:
+        rows = self._connection().execute(
+            'SELECT client_name FROM clients WHERE user_id = ?', (user_id,))
+        return [row[0] for row in rows]
+
+    def get_patterns(self, user_id: int,
+                     client_name: str) -> Optional[List[Dict]]:
+        row = self._connection().execute(
+            'SELECT patterns FROM clients WHERE user_id = ? AND '
+            'client_name = ?', (user_id, client_name)).fetchone()
+        return json.loads(row[0]) if row else None
+
+    def update_status(self, user_id: int, client_name: str,
+                      status: Dict) -> None:
+        with self._pending:
+            self._statuses[user_id, client_name] = status
+            self._wake()
+
+    def get_status(self, user_id: int, client_name: str) -> Optional[Dict]:
+        row = self._connection().execute(
+            'SELECT status FROM clients WHERE user_id = ? AND '
+            'client_name = ?', (user_id, client_name)).fetchone()
+        return json.loads(row[0]) if row and row[0] else None
+
+    def publish(self, user_id: int, client_names: List[str], message: str,
+                key: Optional[str] = None) -> Dict[str, bool]:
+        results = dict.fromkeys(client_names, False)
+        conn = self._connection()
+
+        # group clients by owner so each owner gets a single command
+        owners: Dict[int, List[str]] = dict()
+        for name in client_names:
+            row = conn.execute(
+                'SELECT owner FROM clients WHERE user_id = ? AND '
+                'client_name = ?', (user_id, name)).fetchone()
+            if row:
+                owners.setdefault(row[0], []).append(name)
+                results[name] = True
+
+        with conn:
+            conn.executemany(
+                'INSERT INTO commands (owner, user_id, client_names, message, '
+                'key) VALUES (?, ?, ?, ?, ?)',
+                [(owner, user_id, json.dumps(names), message, key)
+                 for owner, names in owners.items()])
+        return results
+
+    def subscribe(self, user_id: int, keepalive: float) -> Subscription:
+        raise _unavailable('Streaming events')
+
+    def _take_commands(self) -> List[tuple]:
+        """
+        Remove and return the commands addressed to this process.
+        """
+        with self._connection() as conn:
+            rows = conn.execute(
+                'SELECT command_id, user_id, client_names, message, key '
+                'FROM commands WHERE owner = ? ORDER BY command_id',
+                (self.owner,)).fetchall()
+            if rows:
+                conn.execute('DELETE FROM commands WHERE owner = ? AND '
+                             'command_id <= ?', (self.owner, rows[-1][0]))
+        return rows
+
+    def _clear_stale(self, conn: sqlite3.Connection) -> None:
+        """
+        Remove clients and commands left behind by processes that no longer
+        exist, including a previous process with this process' ID.
+        """
+        owners = {row[0] for row in conn.execute(
+            'SELECT owner FROM clients UNION SELECT owner FROM commands')}
+        for owner in owners:
+            if owner == self.owner or not _alive(owner):
+                conn.execute('DELETE FROM clients WHERE owner = ?', (owner,))
+                conn.execute('DELETE FROM commands WHERE owner = ?', (owner,))
+
+    async def serve(self, handler: CommandHandler) -> None:
+        # queued first, so before any client of this process is added
+        self._queue(self._clear_stale)
+        loop = asyncio.get_event_loop()
+        while True:
+            try:
+                commands = await loop.run_in_executor(self._poller,
+                                                      self._take_commands)
+                for _, user_id, client_names, message, key in commands:
+                    handler(user_id, json.loads(client_names), message, key)
+            except sqlite3.Error as err:
+                logger.error(f'Could not read published commands: {err}')
+            await asyncio.sleep(self.poll_interval)
+
+
+class IPCRegistry(Registry):
+    """
+    Registry backed by a proxy server running as its own process (see
+    ``webcandy.proxy``), queried over the proxy's unix socket command channel.
+
+    Requests and replies are single lines of JSON. Each thread keeps its own
+    connection, which is reopened if it fails.
+    """
+
+    def __init__(self, path: str, timeout: float = 5):
+        """
+        :param path: path of the proxy's unix socket
+        :param timeout: seconds to wait for a reply from the proxy
+        """
+        self.path = path
+        self.timeout = timeout
+        self._local = threading.local()
+
+    def _connection(self) -> BinaryIO:
+        """
+        Get this thread's connection to the proxy, opening a new one if there
+        is none or the proxy closed it (e.g. because it restarted).
+        """
+        file = getattr(self._local, 'file', None)
+        # the proxy never sends anything unasked, so a connection with
+        # something to read has been closed
+        if file is not None and \
+                select.select([self._local.sock], [], [], 0)[0]:
+            self._disconnect()
+            file = None
+
+        if file is None:
+            sock = socket.socket(socket.AF_UNIX, socket.SOCK_STREAM)
+            sock.settimeout(self.timeout)
+            try:
+                sock.connect(self.path)
+            except OSError:
+                sock.close()
+                raise
+            file = sock.makefile('rwb')
+            self._local.sock, self._local.file = sock, file
+        return file
+
+    def _disconnect(self) -> None:
+        file = getattr(self._local, 'file', None)
+        if file is not None:
+            file.close()
+            self._local.sock.close()
+        self._local.sock = self._local.file = None
+
+    def _request(self, request: dict) -> Optional[dict]:
+        """
+        Send a request to the proxy and wait for its reply. Requests are only
+        sent again on a fresh connection if sending them failed; once one was
+        sent, the proxy may have acted on it, and requests such as publishing
+        a message must not be acted on twice.
+
+        :return: the reply; ``None`` if the proxy could not be reached or its
+            reply was lost
+        """
+        for attempt in range(2):
+            sent = False
+            try:
+                file = self._connection()
+                file.write(json.dumps(request).encode() + b'\n')
+                file.flush()
+                sent = True
+                line = file.readline()
+                if not line:
+                    raise ConnectionError('connection closed by proxy')
+                return json.loads(line)
+            except (OSError, ValueError) as err:  # including JSONDecodeError
+                # the connection is out of step with the proxy's replies
+                self._disconnect()
+                if sent or attempt:
+                    logger.error(f'Could not reach proxy at {self.path!r}: '
+                                 f'{err}')
+                    return None
+        return None
+
+    def available_clients(self, user_id: int) -> List[str]:
+        reply = self._request({'op': 'clients', 'user_id': user_id})
+        return reply['clients'] if reply else []
+
+    def get_patterns(self, user_id: int,
+                     client_name: str) -> Optional[List[Dict]]:
+        reply = self._request({'op': 'patterns', 'user_id': user_id,
+                               'client_name': client_name})
+        return reply['patterns'] if reply else None
+
+    def get_status(self, user_id: int, client_name: str) -> Optional[Dict]:
+        reply = self._request({'op': 'status', 'user_id': user_id,
+                               'client_name': client_name})
+        return reply['status'] if reply else None
+
+    def publish(self, user_id: int, client_names: List[str], message: str,
+                key: Optional[str] = None) -> Dict[str, bool]:
+        reply = self._request({'op': 'publish', 'user_id': user_id,
+                               'client_names': client_names,
+                               'message': message, 'key': key})
+        return reply['results'] if reply else super().publish(
+            user_id, client_names, message, key)
+
+    def forward(self, request: Dict) -> Dict:
+        reply = self._request(request)
+        if reply is None:
+            raise ConnectionError(f'Could not reach proxy at {self.path!r}')
+        if 'error' in reply:
+            raise ValueError(reply['error'])
+        return reply
+
+    def subscribe(self, user_id: int,
+                  keepalive: float) -> 'RemoteSubscription':
+        sock = socket.socket(socket.AF_UNIX, socket.SOCK_STREAM)
+        # the proxy sends something at least every `keepalive` seconds
+        sock.settimeout(keepalive + self.timeout)
+        try:
+            sock.connect(self.path)
+            subscription = RemoteSubscription(sock)
+            subscription.send({'op': 'subscribe', 'user_id': user_id,
+                               'keepalive': keepalive})
+            reply = subscription.receive()
+        except OSError as err:  # including ConnectionError
+            sock.close()
+            raise ConnectionError(f'Could not reach proxy at {self.path!r}: '
+                                  f'{err}') from err
+
+        if 'error' in reply:
+            subscription.close()
+            raise ValueError(reply['error'])
+        return subscription
+
+
+class RemoteSubscription:
+    """
+    A subscription to a user's events on the proxy server process, over a
+    connection to its command channel of its own. Used like
+    ``webcandy.events.Subscription``.
+    """
+
+    def __init__(self, sock: socket.socket):
+        self.sock = sock
+        self.file = sock.makefile('rwb')
+
+    def send(self, request: Dict) -> None:
+        self.file.write(json.dumps(request).encode() + b'\n')
+        self.file.flush()
+
+    def receive(self):
+        """
+        Read the next line sent by the proxy.
+
+        :raises ConnectionError: if the connection was closed or timed out
+        """
+        try:
+            line = self.file.readline()
+        except OSError as err:
+            raise ConnectionError(f'Lost connection to proxy: {err}') from err
+        if not line:
+            raise ConnectionError('connection closed by proxy')
+        return json.loads(line)
+
+    def get(self, timeout: Optional[float] = None) -> Optional[str]:
+        """
+        Get the next serialized event.
+
+        :param timeout: unused; the proxy sends ``None`` in place of an event
+            once its keepalive passes
+        :return: the event; ``None`` if none arrived in time
+        :raises ConnectionError: if the connection to the proxy was lost
+        """
+        return self.receive()
+
+    def close(self) -> None:
+        self.file.close()
+        self.sock.close()
+
+    def __enter__(self) -> 'RemoteSubscription':
+        return self
+
+    def __exit__(self, *_) -> None:
+        self.close()
+
+
+def _unavailable(feature: str) -> NotImplementedError:
+    """
+    Make the error for something that only works in the process running the
+    proxy server, unless that runs on its own.
+    """
+    return NotImplementedError(
+        f'{feature} is only available in the process running the proxy '
+        f'server; run it on its own with CLIENT_REGISTRY=ipc to use it from '
+        f'every process')
+
+
+def _alive(pid: int) -> bool:
+    """
+    Check if a process with the given PID exists on this host.
+    """
+    if pid <= 0:
+        return False
+    try:
+        os.kill(pid, 0)
+    except ProcessLookupError:
+        return False
+    except PermissionError:
+        return True  # exists, but owned by another user
+    return True
+
+
+def create_registry(config: dict) -> Registry:
+    """
+    Create the registry described by an app's configuration.
+
+    :param config: the app configuration
+    :return: the registry
+    :raises ValueError: if ``CLIENT_REGISTRY`` is invalid
+    """
+    name = config.get('CLIENT_REGISTRY', 'local')
+    if name == 'local':
+        return Registry()
+    elif name == 'sqlite':
+        return SQLiteRegistry(config['CLIENT_REGISTRY_PATH'],
+                              config.get('CLIENT_REGISTRY_POLL', 0.01))
+    elif name == 'ipc':
+        return IPCRegistry(config['PROXY_IPC_PATH'])
+    raise ValueError(f'Invalid client registry {name!r}; expected '
+                     f"'local', 'sqlite' or 'ipc'")
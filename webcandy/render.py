@@ -0,0 +1,243 @@
+"""
+Server-side rendering of lighting patterns into pixel frames, for clients that
+are streamed frames instead of running patterns themselves (see
+``webcandy.stream``).
+
+Rendering needs NumPy, which is an optional dependency; install it with
+``pip install webcandy[render]``.
+"""
+import math
+import itertools
+
+from typing import Callable, Dict, Hashable, List
+
+try:
+    import numpy as np
+except ImportError:
+    np = None
+
+from . import util
+from .cache import TTLCache
+from .config import Config
+
+# strobe flashes per second
+STROBE_RATE = 10
+
+STATIC_PATTERNS = ('Off', 'SolidColor', 'Stripes')
+DYNAMIC_PATTERNS = ('Fade', 'Rainbow')
+PATTERNS = STATIC_PATTERNS + DYNAMIC_PATTERNS
+
+
+def _speed(config: dict) -> float:
+    """
+    Get the speed of a configuration; 1 if not given. A speed of 0 holds
+    dynamic patterns still.
+    """
+    speed = config.get('speed')
+    return 1.0 if speed is None else float(speed)
+
+
+def _colors(config: dict, required: int = 1) -> 'np.ndarray':
+    """
+    Get the colors of a lighting configuration as an array of float RGB rows.
+
+    :raises ValueError: if there are fewer than ``required`` colors, or a color
+        is invalid
+    """
+    colors = config.get('color_list')
+    if colors is None:
+        colors = [config['color']] if config.get('color') else []
+    if len(colors) < required:
+        raise ValueError(f'Pattern {config.get("pattern")!r} needs at least '
+                         f'{required} color(s)')
+
+    parsed = util.parse_colors(colors)
+    if parsed.invalid:
+        raise ValueError(f'Invalid colors at {parsed.invalid} in {colors!r}')
+    return np.frombuffer(parsed.packed, dtype=np.uint8).reshape(-1, 3) \
+        .astype(np.float32)
+
+
+def _hsv_to_rgb(hue: 'np.ndarray') -> 'np.ndarray':
+    """
+    Convert an array of hues in [0, 1) at full saturation and value to RGB
+    rows in [0, 255].
+    """
+    # distance of each channel's hue sector from the hue, as in colorsys
+    k = (hue[:, None] * 6 + np.array([5, 3, 1], dtype=np.float32)) % 6
+    return 255 * (1 - np.clip(np.minimum(k, 4 - k), 0, 1))
+
+
+class Renderer:
+    """
+    Render lighting configurations into frames of RGB pixels with vectorized
+    math over the whole strip.
+
+    Dynamic patterns repeat, so frames are cached by configuration, strip
+    length, frame rate and position within the pattern's cycle; streaming a
+    pattern only computes each distinct frame once.
+    """
+
+    def __init__(self, cache_size: int = Config.RENDER_CACHE_SIZE):
+        """
+        :param cache_size: number of frames to keep; if not positive, nothing
+            is cached
+        :raises RuntimeError: if NumPy is not installed
+        """
+        if np is None:
+            raise RuntimeError('Rendering needs NumPy; install it with '
+                               '"pip install webcandy[render]"')
+        # frames don't go stale, so entries only leave the cache when evicted
+        self.cache = TTLCache(cache_size, math.inf)
+
+    @staticmethod
+    def period(config: dict, fps: float) -> int:
+        """
+        Get the number of frames after which a configuration repeats, not
+        counting strobe.
+
+        :return: the number of frames; 1 for static patterns and a speed of
+            0, 0 if the pattern does not repeat after a whole number of frames
+        """
+        pattern = config.get('pattern')
+        speed = _speed(config)
+        if speed == 0:
+            return 1
+        if pattern == 'Fade':
+            seconds = len(config.get('color_list') or ()) / speed
+        elif pattern == 'Rainbow':
+            seconds = 1 / speed
+        else:
+            return 1
+
+        frames = seconds * fps
+        return round(frames) if abs(frames - round(frames)) < 1e-6 else 0
+
+    @staticmethod
+    def _draw(config: dict, pixels: int, t: float) -> 'np.ndarray':
+        """
+        Compute the frame of a configuration at a time, without strobe.
+        """
+        pattern = config.get('pattern')
+        speed = _speed(config)
+
+        if pattern == 'Off':
+            frame = np.zeros((pixels, 3), dtype=np.float32)
+        elif pattern == 'SolidColor':
+            frame = np.broadcast_to(_colors(config)[0], (pixels, 3))
+        elif pattern == 'Stripes':
+            colors = _colors(config)
+            frame = colors[np.arange(pixels) % len(colors)]
+        elif pattern == 'Fade':
+            # cross-fade from each color to the next, one per 1/speed seconds
+            colors = _colors(config, 2)
+            phase = t * speed
+            i = int(phase) % len(colors)
+            f = phase - math.floor(phase)
+            color = (1 - f) * colors[i] + f * colors[(i + 1) % len(colors)]
+            frame = np.broadcast_to(color, (pixels, 3))
+        elif pattern == 'Rainbow':
+            # one rainbow along the strip, cycling speed times per second
+            hue = (np.arange(pixels, dtype=np.float32) / pixels + t * speed) % 1
+            frame = _hsv_to_rgb(hue)
+        else:
+            raise ValueError(f'Pattern {pattern!r} cannot be rendered; '
+                             f'expected one of {", ".join(PATTERNS)}')
+
+        return np.ascontiguousarray(np.rint(frame), dtype=np.uint8)
+
+    def frame(self, config: dict, pixels: int, index: int = 0,
+              fps: float = 60) -> 'np.ndarray':
+        """
+        Render one frame of a configuration.
+
+        :param config: the lighting configuration, as sent to clients
+        :param pixels: number of pixels in the strip
+        :param index: number of the frame since the pattern started
+        :param fps: frame rate the pattern is rendered at
+        :return: read-only ``(pixels, 3)`` array of RGB values
+        :raises ValueError: if the configuration cannot be rendered
+        """
+        if pixels <= 0 or fps <= 0:
+            raise ValueError('pixels and fps must be positive')
+
+        period = self.period(config, fps)
+        key: Hashable = None
+        if period:
+            index_in_period = index % period
+            key = (config.get('pattern'), config.get('color'),
+                   tuple(config.get('color_list') or ()),
+                   config.get('speed'), pixels, fps, index_in_period)
+            frame = self.cache.get(key)
+        else:
+            frame = None
+
+        if frame is None:
+            frame = self._draw(config, pixels, index / fps)
+            frame.flags.writeable = False
+            if key is not None:
+                self.cache.set(key, frame)
+
+        if config.get('strobe') and int(index / fps * STROBE_RATE * 2) % 2:
+            return _dark(pixels)
+        return frame
+
+    def frames(self, config: dict, pixels: int, count: int,
+               fps: float = 60) -> List['np.ndarray']:
+        """
+        Render the first frames of a configuration. See ``Renderer.frame``.
+        """
+        return [self.frame(config, pixels, i, fps) for i in range(count)]
+
+    def source(self, config: dict, pixels: int,
+               fps: float = 60) -> Callable[[], memoryview]:
+        """
+        Get a function returning the pixel data of successive frames of a
+        configuration, for use as a ``PixelStream`` source.
+
+        :raises ValueError: if the configuration cannot be rendered
+        """
+        self.frame(config, pixels, 0, fps)  # fail now rather than mid-stream
+        indices = itertools.count()
+
+        def next_frame() -> memoryview:
+            # a flat view of the frame, so no copy is made until it is pushed
+            return self.frame(config, pixels, next(indices), fps) \
+                .reshape(-1).data
+
+        return next_frame
+
+
+# shared all-dark frames for strobe, by strip length
+_dark_frames: Dict[int, 'np.ndarray'] = dict()
+
+
+def _dark(pixels: int) -> 'np.ndarray':
+    frame = _dark_frames.get(pixels)
+    if frame is None:
+        frame = np.zeros((pixels, 3), dtype=np.uint8)
+        frame.flags.writeable = False
+        _dark_frames[pixels] = frame
+    return frame
+
+
+def to_hex(frame: 'np.ndarray') -> List[str]:
+    """
+    Convert a frame to a list of hex color strings.
+    """
+    return ['#%02x%02x%02x' % tuple(pixel) for pixel in frame.tolist()]
+
+
+_renderer = None
+
+
+def get_renderer() -> Renderer:
+    """
+    Get the renderer shared by the app, creating it on first use.
+
+    :raises RuntimeError: if NumPy is not installed
+    """
+    global _renderer
+    if _renderer is None:
+        _renderer = Renderer()
+    return _renderer
@@ -1,19 +1,33 @@
 import os
+import hmac
 import json
+import time
+import codecs
+import hashlib
 
-from collections import defaultdict
+from concurrent.futures import TimeoutError as FutureTimeoutError
 from flask import (
-    g, Blueprint, render_template, jsonify, request, url_for,
+    g, Blueprint, Response, render_template, jsonify, request, url_for,
     send_from_directory, current_app as app
 )
 from flask_restful import Resource
+from marshmallow import ValidationError
 from werkzeug.exceptions import NotFound
 
-from . import util
+from . import util, palettes, render, tracing
+from .acks import Ack
 from .models import User
 from .extensions import auth, db
+from .events import format_event, stream_slots
+from .metrics import metrics, process_labels, CONTENT_TYPE
 from .server import clients, proxy_server
-from .definitions import USERS_DIR, STATIC_DIR
+from .schemas import (
+    submit_schema, broadcast_schema, user_data_schema,
+    user_data_deletion_schema, timeline_schema, render_preview_schema,
+    render_stream_schema, error_response
+)
+from .storage import user_data, summarize_changes
+from .definitions import STATIC_DIR
 
 views = Blueprint('views', __name__,
                   static_folder=f'{STATIC_DIR}/dist',
@@ -34,7 +48,8 @@ def verify_auth_token(token: str) -> bool:
     :param token: the token to verify
     :return: ``True`` if a valid token was provided; ``False`` otherwise
     """
-    user = User.get_user(token)
+    with tracing.span('auth'):
+        user = User.get_user(token)
     if user:
         g.user = user
         return True
@@ -70,6 +85,20 @@ def well_known(name: str):
         name, mimetype='text/plain')
 
 
+@views.route('/metrics', methods=['GET'])
+def metrics_text():
+    # scraped by Prometheus; see webcandy.metrics
+    if not app.config['METRICS_ENABLED']:
+        raise NotFound()
+    token = app.config['METRICS_TOKEN']
+    if token and not hmac.compare_digest(
+            request.headers.get('Authorization', '').encode(),
+            f'Bearer {token}'.encode()):
+        return jsonify(util.format_error(401, 'Invalid metrics token')), 401
+    return Response(metrics.render(process_labels()),
+                    content_type=CONTENT_TYPE)
+
+
 @views.route('/', defaults={'path': ''}, methods=['GET'])
 @views.route('/<path:path>')
 def index(path: str):
@@ -162,8 +191,7 @@ class NewUser(Resource):
         app.logger.debug(f'Created new user {user.username} <{user.email}>')
 
         # create data file
-        with open(f'{USERS_DIR}/{user.user_id}.json', 'w+') as file:
-            json.dump({'colors': dict(), 'color_lists': dict()}, file)
+        user_data.create(user.user_id)
 
         return (
             jsonify({'username': user.username}),
@@ -197,14 +225,36 @@ class UserData(Resource):
     authentication.
     """
 
-    # TODO: Allow user to specify exact data to retrieve (thinking like GraphQL)
     @staticmethod
     @auth.login_required
     def get():
         """
-        Retrieve all user data: colors, color_lists.
+        Retrieve user data: colors, color_lists, client_groups.
+
+        Query parameters:
+        - "fields": comma-separated sections and items to retrieve, e.g.
+          "color_lists" or "colors.blue,colors.pink" (optional; all data is
+          retrieved if not specified)
+
+        The response carries an ETag; if it matches the If-None-Match header
+        of the request, 304 Not Modified is returned without a body.
         """
-        return util.load_user_data(g.user.user_id)
+        fields = request.args.get('fields')
+
+        if fields is None:
+            data = user_data.load(g.user.user_id)
+        else:
+            selection = util.parse_fields(fields)
+            invalid = set(selection) - set(user_data.SECTIONS)
+            if invalid:
+                description = f'Invalid sections: {", ".join(sorted(invalid))}'
+                return util.format_error(400, description), 400
+            data = user_data.select(g.user.user_id, selection)
+
+        body = json.dumps(data)
+        response = app.response_class(body, mimetype='application/json')
+        response.set_etag(hashlib.md5(body.encode()).hexdigest())
+        return response.make_conditional(request)
 
     @staticmethod
     @auth.login_required
@@ -254,46 +304,18 @@ class UserData(Resource):
 
             Since no color lists were modified, there is no 'modified' field in
             the 'color_lists' section.
-        """
-        retval = defaultdict(lambda: defaultdict(dict))
-
-        json_data = util.load_user_data(g.user.user_id)
-
-        # section: str, data: List[str]
-        for section, data in request.get_json().items():
-
-            # ensure section is valid
-            if section == 'colors':
-
-                for name, color in data.items():
-                    if util.is_color(color):
-                        if name in json_data['colors']:
-                            retval['colors']['modified'][name] = {
-                                'old': json_data['colors'][name],
-                                'new': color
-                            }
-                        else:
-                            retval['colors']['added'][name] = color
-                        json_data['colors'][name] = color
 
-            elif section == 'color_lists':
-
-                for name, color_list in data.items():
-                    if all([util.is_color(color) for color in color_list]):
-                        if name in json_data['color_lists']:
-                            retval['color_lists']['modified'][name] = {
-                                'old': json_data['color_lists'][name],
-                                'new': color_list
-                            }
-                        else:
-                            retval['color_lists']['added'][name] = color_list
-                        json_data['color_lists'][name] = color_list
-
-        # re-open to overwrite rather than append to using r+
-        with open(f'{USERS_DIR}/{g.user.user_id}.json', 'w') as data_file:
-            json.dump(json_data, data_file, indent=4)
+            If any section, color or client name is invalid, nothing is changed
+            and 400 is returned with the offending fields under 'messages'.
+        """
+        try:
+            changes = user_data_schema.load(request.get_json() or dict())
+        except ValidationError as err:
+            app.logger.error(err.messages)
+            return error_response(err)
 
-        return retval
+        old = user_data.put(g.user.user_id, changes)
+        return summarize_changes(changes, old)
 
     @staticmethod
     @auth.login_required
@@ -325,25 +347,108 @@ class UserData(Resource):
             Note that there is no mention of 'red' or 'warm' because no action
             was taken regarding that data. There is also no 'color_lists'
             section at all, as there was no data to return within that section.
+
+            If any section is invalid or not a list of names, nothing is
+            deleted and 400 is returned with the offending fields under
+            'messages'.
         """
-        retval = defaultdict(lambda: defaultdict(dict))
+        try:
+            names = user_data_deletion_schema.load(request.get_json() or dict())
+        except ValidationError as err:
+            app.logger.error(err.messages)
+            return error_response(err)
 
-        json_data = util.load_user_data(g.user.user_id)
+        deleted = user_data.delete(g.user.user_id, names)
 
-        # section: str, data: List[str]
-        for section, data in request.get_json().items():
+        return {section: {'deleted': items}
+                for section, items in deleted.items()}
 
-            for name in data:
-                if name in json_data[section]:
-                    retval[section]['deleted'][name] = \
-                        json_data[section][name]
-                    del json_data[section][name]
 
-        # re-open to overwrite rather than append to using r+
-        with open(f'{USERS_DIR}/{g.user.user_id}.json', 'w') as data_file:
-            json.dump(json_data, data_file, indent=4)
+class Palette(Resource):
+    """
+    Import and export a user's colors and color lists in bulk. See
+    ``webcandy.palettes`` for the formats.
+    """
 
-        return retval
+    @staticmethod
+    def _format() -> str:
+        """
+        Get the palette format requested with the "format" query parameter.
+
+        :raises ValueError: if the format is invalid
+        """
+        fmt = request.args.get('format', 'jsonl').lower()
+        if fmt not in palettes.FORMATS:
+            raise ValueError(f'Invalid format {fmt!r}; expected one of '
+                             f'{", ".join(palettes.FORMATS)}')
+        return fmt
+
+    @staticmethod
+    @auth.login_required
+    def get():
+        """
+        Export colors and color lists.
+
+        Query parameters:
+        - "format": "jsonl", "csv" or "gpl" (default: jsonl)
+        - "list": for gpl, the color list to export as the palette; the
+          user's colors are exported if not specified (optional)
+        """
+        try:
+            fmt = Palette._format()
+        except ValueError as err:
+            return util.format_error(400, str(err)), 400
+
+        data = user_data.load(g.user.user_id)
+        if fmt == 'gpl':
+            list_name = request.args.get('list')
+            if list_name is None:
+                body = palettes.export_gpl(
+                    g.user.username, data.get('colors', dict()).items())
+            elif list_name in data.get('color_lists', dict()):
+                colors = data['color_lists'][list_name]
+                body = palettes.export_gpl(
+                    list_name, ((f'{list_name} {i}', color)
+                                for i, color in enumerate(colors, 1)))
+            else:
+                message = f'Color list {list_name!r} not found for user ' \
+                          f'{g.user.username!r}'
+                return util.format_error(400, message), 400
+        else:
+            body = getattr(palettes, f'export_{fmt}')(data)
+
+        response = app.response_class(body, mimetype=palettes.MIMETYPES[fmt])
+        response.headers['Content-Disposition'] = \
+            f'attachment; filename=palette.{fmt}'
+        return response
+
+    @staticmethod
+    @auth.login_required
+    def post():
+        """
+        Import colors and color lists from the request body, adding or
+        modifying items of the same names. Lines that cannot be imported are
+        skipped.
+
+        Query parameters:
+        - "format": "jsonl", "csv" or "gpl" (default: jsonl)
+
+        :return: the added and modified items in the form returned by
+            ``UserData.put``, with the line and message of each skipped line
+            under "errors" if there were any
+        """
+        try:
+            fmt = Palette._format()
+            lines = codecs.iterdecode(request.stream, 'utf-8')
+            summary, errors = palettes.import_palette(
+                g.user.user_id, palettes.PARSERS[fmt](lines),
+                app.config['PALETTE_BATCH_SIZE'])
+        except (ValueError, UnicodeDecodeError) as err:
+            return util.format_error(400, str(err)), 400
+
+        if errors:
+            summary['errors'] = errors
+        return summary
 
 
 class UserClients(Resource):
@@ -354,14 +459,30 @@ class UserClients(Resource):
     @staticmethod
     @auth.login_required
     def get():
+        """
+        Query parameters:
+        - "client_id": name of a client to get the patterns and connection
+          state of (optional)
+        - "details": if "true" and no client_id is specified, map each client
+          name to its connection state instead of listing names (optional)
+
+        Connection state contains "connected_at" and "last_seen" timestamps
+        and the round trip "latency" in seconds of the client's last
+        heartbeat.
+        """
         client_id = request.args.get('client_id')
 
         # if client_id not specified, return a dictionary of available clients
         if not client_id:
-            return clients.available_clients(g.user.user_id)
+            names = clients.available_clients(g.user.user_id)
+            if request.args.get('details', '').lower() == 'true':
+                return {name: clients.get_status(g.user.user_id, name)
+                        for name in names}
+            return names
 
         # if client_id is specified, return info about that client
-        if not clients.contains(g.user.user_id, client_id):
+        patterns = clients.get_patterns(g.user.user_id, client_id)
+        if patterns is None:
             return (
                 util.format_error(400,
                                   f'Client {client_id!r} not found for user '
@@ -369,9 +490,114 @@ class UserClients(Resource):
                 400
             )
 
-        return {
-            'patterns': clients.get_client(g.user.user_id, client_id).patterns
-        }
+        return {'patterns': patterns,
+                'status': clients.get_status(g.user.user_id, client_id)}
+
+
+class UserEvents(Resource):
+    """
+    Stream events about the user's clients as server-sent events, so the web
+    UI is told about changes instead of polling ``UserClients``. See
+    ``webcandy.events`` for the events.
+    """
+
+    @staticmethod
+    def get():
+        """
+        Query parameters:
+        - "token": an event stream token from ``EventToken``, since browsers
+          cannot set headers on event streams (optional if an Authorization
+          header is sent)
+
+        The stream starts with a "clients" event mapping the name of each
+        connected client to its connection state, as returned by
+        ``UserClients`` with "details".
+        """
+        token = request.args.get('token')
+        if token is not None:
+            with tracing.span('auth'):
+                user = User.verify_stream_token(token)
+            if user is None:
+                return util.format_error(401, 'Invalid event stream token'), \
+                    401
+            g.user = user
+        else:
+            token = request.headers.get('Authorization', '').partition(' ')[2]
+            if not token or not verify_auth_token(token):
+                return util.format_error(
+                    401, 'Invalid authentication token'), 401
+
+        # each open stream holds a worker thread of this process
+        if not stream_slots.acquire(app.config['EVENTS_MAX_STREAMS']):
+            return util.format_error(
+                503, 'Too many event streams are open, try again later'), 503
+
+        user_id = g.user.user_id
+        keepalive = app.config['EVENTS_KEEPALIVE']
+        try:
+            subscription = proxy_server.subscribe(user_id, keepalive)
+        except ValueError as err:
+            stream_slots.release()
+            return util.format_error(429, str(err)), 429
+        except (NotImplementedError, ConnectionError) as err:
+            stream_slots.release()
+            return _proxy_error(err)
+
+        # subscribe before taking the snapshot, so no change is missed
+        snapshot = {name: clients.get_status(user_id, name)
+                    for name in clients.available_clients(user_id)}
+
+        def stream():
+            yield format_event('clients', snapshot)
+            while True:
+                try:
+                    event = subscription.get(keepalive)
+                except ConnectionError:
+                    return  # lost the proxy server; browsers reconnect
+                # a comment when idle, so a closed stream is noticed
+                yield event or ': keepalive\n\n'
+
+        def close():
+            subscription.close()
+            stream_slots.release()
+
+        response = app.response_class(stream(), mimetype='text/event-stream')
+        # also unsubscribes if the stream is closed before it starts
+        response.call_on_close(close)
+        response.headers['Cache-Control'] = 'no-cache'
+        response.headers['X-Accel-Buffering'] = 'no'  # don't buffer in nginx
+        return response
+
+
+class EventToken(Resource):
+    """
+    Provide a short-lived token for opening the user's event streams, to pass
+    to ``UserEvents`` in the URL instead of the user's access token.
+    """
+
+    @staticmethod
+    @auth.login_required
+    def post():
+        """
+        :return: JSON with the token under "token", and the number of seconds
+            it is valid for under "expires_in"
+        """
+        expiration = app.config['EVENTS_TOKEN_SECONDS']
+        token = g.user.generate_stream_token(expiration)
+        return {'token': token.decode('ascii'), 'expires_in': expiration}
+
+
+def _proxy_error(err: Exception):
+    """
+    Respond to a request that had to be forwarded to the proxy server running
+    in another process, but could not be.
+
+    :param err: the ``NotImplementedError`` raised if this process cannot
+        forward requests, or ``ConnectionError`` if the proxy server could not
+        be reached
+    """
+    status = 501 if isinstance(err, NotImplementedError) else 503
+    return util.format_error(status, str(err)), status
 
 
 class Submit(Resource):
@@ -380,6 +606,7 @@ class Submit(Resource):
     """
 
     @staticmethod
+    @tracing.traced('submit')
     @auth.login_required
     def post():
         """
@@ -388,25 +615,438 @@ class Submit(Resource):
         - "strobe": whether to add a strobe effect
         - "color": the color to use, if applicable
         - "color_list": the color list to use, if applicable
+        - "ack": whether to wait for the client to acknowledge that it applied
+          the configuration; only for clients that acknowledge messages
+          (optional)
+        - "ack_timeout": seconds to wait for the acknowledgement; implies
+          "ack" (optional; defaults to the ACK_TIMEOUT setting)
+
+        If tracing is enabled, the trace ID is returned in the X-Trace-Id
+        header and sent to the client with the configuration.
+
+        :return: JSON indicating if running was successful; with "ack", also
+            whether the client "acked" the configuration, the "latency" in
+            seconds from sending it to the acknowledgement and any "error"
+        """
+        with tracing.span('validation'):
+            data = request.get_json()
+            app.logger.debug(f'Received submission data from '
+                             f'{g.user.username}: {data}')
+
+            try:
+                data = submit_schema.load(data or dict())
+            except ValidationError as err:
+                app.logger.error(err.messages)
+                return error_response(err)
+
+        client_id = data.pop('client_id')
+        ack_timeout = data.pop('ack_timeout', None)
+        trace = tracing.current_trace()
+        if trace:
+            data['trace_id'] = trace.trace_id
+            trace.attributes.update(user_id=g.user.user_id, client=client_id)
+
+        start = time.perf_counter()
+        if data.pop('ack', False) or ack_timeout is not None:
+            try:
+                with tracing.span('dispatch'):
+                    future = proxy_server.request(g.user.user_id, client_id,
+                                                  data, ack_timeout)
+            except ValueError as err:
+                return util.format_error(400, str(err)), 400
+            if trace:
+                trace.follow(future, 'ack', start, Ack.status)
+
+            timeout = ack_timeout or app.config['ACK_TIMEOUT']
+            try:
+                # resolved by the timeout at the latest; allow for a busy loop
+                result = future.result(timeout + 1)
+            except FutureTimeoutError:
+                result = Ack(False, error='timed out')
+            return dict(result.status(), success=result.acked)
+
+        # TODO: If standalone, send directly to controller (might end up
+        #   being done within proxy_server.send conditionally)
+        with tracing.span('dispatch'):
+            future = proxy_server.dispatch(g.user.user_id, client_id, data)
+        if trace and future:
+            trace.follow(future, 'write', start,
+                         lambda written: {'written': written})
+        return dict(success=future is not None)
+
+
+class Broadcast(Resource):
+    """
+    Handle the submission of a lighting configuration to run on several
+    clients at once.
+    """
 
-        :return: JSON indicating if running was successful
+    @staticmethod
+    @auth.login_required
+    def post():
+        """
+        JSON body fields:
+        - "client_ids": names of the clients to send to (optional)
+        - "group": name of a saved client group to send to (optional)
+        - "sync": whether the clients should start the configuration at the
+          same instant (optional)
+        - "start_at": Unix time for the clients to start the configuration
+          at; implies "sync" (optional)
+        - the lighting configuration fields accepted by ``Submit``
+
+        If neither "client_ids" nor "group" is specified, the configuration is
+        sent to all of the user's connected clients.
+
+        :return: JSON indicating under "success" if the configuration was
+            written to every client, along with whether it was for each
+            client under "results". Synchronized configurations are written
+            at the start time, so for those, whether the configuration was
+            queued for each client is under "queued" instead, and the time
+            the clients start at under "start_at".
         """
         data = request.get_json()
-        app.logger.debug(f'Received submission data from {g.user.username}: '
+        app.logger.debug(f'Received broadcast data from {g.user.username}: '
                          f'{data}')
 
+        try:
+            data = broadcast_schema.load(data or dict())
+        except ValidationError as err:
+            app.logger.error(err.messages)
+            return error_response(err)
+
+        client_ids = data.pop('client_ids', None)
+        group = data.pop('group', None)
+        start_at = data.pop('start_at', None)
+        sync = data.pop('sync', False) or start_at is not None
+
+        if group is not None:
+            groups = user_data.load(g.user.user_id).get('client_groups',
+                                                        dict())
+            if group not in groups:
+                message = f'Client group {group!r} not found for user ' \
+                          f'{g.user.username!r}'
+                app.logger.error(message)
+                return util.format_error(400, message), 400
+            client_ids = groups[group]
+
+        if sync:
+            try:
+                start_at, futures = proxy_server.broadcast_synced(
+                    g.user.user_id, data, client_ids, start_at)
+            except ValueError as err:  # refused by the proxy server process
+                return util.format_error(400, str(err)), 400
+            except (NotImplementedError, ConnectionError) as err:
+                return _proxy_error(err)
+            queued = {name: future is not None
+                      for name, future in futures.items()}
+            return dict(success=bool(queued) and all(queued.values()),
+                        queued=queued, start_at=start_at)
+
+        futures = proxy_server.broadcast(g.user.user_id, data, client_ids)
+        # clients that take longer to write to are about to be evicted
+        deadline = time.time() + app.config['HEARTBEAT_TIMEOUT']
+        results = dict()
+        for name, future in futures.items():
+            try:
+                results[name] = future is not None and bool(
+                    future.result(max(deadline - time.time(), 0)))
+            except FutureTimeoutError:
+                results[name] = False
+        return dict(success=bool(results) and all(results.values()),
+                    results=results)
+
+
+class Schedule(Resource):
+    """
+    Schedule timelines of lighting configurations to be sent to a user's
+    clients at set times, without a request per change.
+    """
+
+    @staticmethod
+    @auth.login_required
+    def get():
+        """
+        :return: JSON with the state of each of the user's pending timelines
+            under "timelines"
+        """
+        try:
+            return dict(timelines=proxy_server.timelines(g.user.user_id))
+        except (NotImplementedError, ConnectionError) as err:
+            return _proxy_error(err)
+
+    @staticmethod
+    @auth.login_required
+    def post():
+        """
+        JSON body fields:
+        - "start": Unix time the timeline starts at (optional; defaults to
+          now)
+        - "cues": list of cues, each with:
+          - "at": seconds after the start to send the cue at (required)
+          - "scene": name of a saved scene to send, or
+          - "lighting": a scene given in full: the lighting configuration
+            fields accepted by ``Submit``, and optionally "client_ids" or
+            "group" as accepted by ``Broadcast``
+
+        Saved scenes and client groups are looked up when the timeline is
+        scheduled; changing them later does not change scheduled cues.
+
+        :return: JSON with the state of the scheduled timeline
+        """
+        try:
+            data = timeline_schema.load(request.get_json() or dict())
+        except ValidationError as err:
+            app.logger.error(err.messages)
+            return error_response(err)
+
+        saved = user_data.select(g.user.user_id,
+                                 {'scenes': None, 'client_groups': None})
+        scenes = saved.get('scenes', dict())
+        groups = saved.get('client_groups', dict())
+
+        cues = []
+        for cue in data['cues']:
+            if 'scene' in cue:
+                if cue['scene'] not in scenes:
+                    message = f'Scene {cue["scene"]!r} not found for user ' \
+                              f'{g.user.username!r}'
+                    return util.format_error(400, message), 400
+                lighting = dict(scenes[cue['scene']])
+            else:
+                lighting = cue['lighting']
+
+            client_ids = lighting.pop('client_ids', None)
+            group = lighting.pop('group', None)
+            if group is not None:
+                if group not in groups:
+                    message = f'Client group {group!r} not found for user ' \
+                              f'{g.user.username!r}'
+                    return util.format_error(400, message), 400
+                client_ids = groups[group]
+            cues.append((cue['at'], lighting, client_ids))
+
+        try:
+            return proxy_server.schedule(g.user.user_id, cues,
+                                         data.get('start'))
+        except ValueError as err:
+            return util.format_error(400, str(err)), 400
+        except (NotImplementedError, ConnectionError) as err:
+            return _proxy_error(err)
+
+    @staticmethod
+    @auth.login_required
+    def delete():
+        """
+        Cancel the remaining cues of a timeline.
+
+        Query parameters:
+        - "timeline_id": ID of the timeline to cancel (required)
+
+        :return: JSON indicating if a pending timeline was cancelled
+        """
+        timeline_id = request.args.get('timeline_id')
+        if timeline_id is None:
+            return util.format_error(400, 'timeline_id is required'), 400
+        try:
+            return dict(success=proxy_server.cancel_timeline(g.user.user_id,
+                                                             timeline_id))
+        except (NotImplementedError, ConnectionError) as err:
+            return _proxy_error(err)
+
+
+class Stream(Resource):
+    """
+    Stream raw pixel frames to a client. Only clients that registered with the
+    binary encoding and are connected to this process can be streamed to.
+    """
+
+    @staticmethod
+    @auth.login_required
+    def post():
+        """
+        Start a stream, replacing any the client already has.
+
+        JSON body fields:
+        - "client_id": name of the client to stream to (required)
+        - "pixels": number of pixels in every frame (required)
+        - "fps": maximum number of frames to send per second (default: 60)
+        """
+        data = request.get_json()
+
         try:
             client_id = data['client_id']
-            del data['client_id']
-
-            # TODO: If standalone, send directly to controller (might end up
-            #   being done within proxy_server.send conditionally)
-            return dict(
-                success=proxy_server.send(g.user.user_id, client_id, data))
-        except KeyError:
-            message = 'client_id not specified'
+            pixels = int(data['pixels'])
+            fps = float(data.get('fps', 60))
+            proxy_server.start_stream(g.user.user_id, client_id, pixels, fps)
+        except KeyError as err:
+            message = f'{err.args[0]} not specified'
             app.logger.error(message)
-            return dict(success=False, message=message)
+            return util.format_error(400, message), 400
+        except (ValueError, TypeError) as err:
+            app.logger.error(err)
+            return util.format_error(400, str(err)), 400
+
+        return dict(success=True)
+
+    @staticmethod
+    @auth.login_required
+    def put():
+        """
+        Push a frame to a running stream. The body is the frame's pixel data,
+        3 bytes of RGB per pixel.
+
+        Query parameters:
+        - "client_id": name of the client to stream to (required)
+        """
+        client_id = request.args.get('client_id')
+        try:
+            success = proxy_server.push_frame(g.user.user_id, client_id,
+                                              request.get_data())
+        except ValueError as err:
+            return util.format_error(400, str(err)), 400
+
+        if not success:
+            message = f'No stream running for client {client_id!r}'
+            return util.format_error(400, message), 400
+        return dict(success=True)
+
+    @staticmethod
+    @auth.login_required
+    def delete():
+        """
+        Stop a stream.
+
+        Query parameters:
+        - "client_id": name of the client to stop streaming to (required)
+        """
+        return dict(success=proxy_server.stop_stream(
+            g.user.user_id, request.args.get('client_id')))
+
+
+def _render_args(data: dict) -> tuple:
+    """
+    Split the validated body of a render request into the lighting
+    configuration and the strip length and frame rate to render at.
+    """
+    config = dict(data)
+    pixels = config.pop('pixels', 60)
+    fps = config.pop('fps', 60.0)
+    return config, pixels, fps
+
+
+class RenderPreview(Resource):
+    """
+    Render the first frames of a lighting configuration on the server.
+    """
+
+    @staticmethod
+    @auth.login_required
+    def post():
+        """
+        JSON body fields:
+        - the lighting configuration fields accepted by ``Submit``, other than
+          "client_id"
+        - "pixels": number of pixels in the strip (default: 60)
+        - "fps": frame rate to render at (default: 60)
+        - "frames": number of frames to render (default: 1)
+
+        :return: JSON with the frame rate and the frames, each a list of hex
+            color strings
+        """
+        try:
+            data = render_preview_schema.load(request.get_json() or dict())
+        except ValidationError as err:
+            app.logger.error(err.messages)
+            return error_response(err)
+
+        count = data.pop('frames', 1)
+        config, pixels, fps = _render_args(data)
+        try:
+            frames = render.get_renderer().frames(config, pixels, count, fps)
+        except RuntimeError as err:
+            app.logger.error(err)
+            return util.format_error(501, str(err)), 501
+        except (ValueError, TypeError) as err:
+            return util.format_error(400, str(err)), 400
+
+        return dict(fps=fps, frames=[render.to_hex(frame) for frame in frames])
+
+
+class RenderStream(Resource):
+    """
+    Render a lighting configuration on the server and stream it to a client,
+    which only has to display the frames it is sent (see ``Stream``).
+    """
+
+    @staticmethod
+    @auth.login_required
+    def post():
+        """
+        JSON body fields:
+        - "client_id": name of the client to stream to (required)
+        - the lighting configuration fields accepted by ``Submit``
+        - "pixels": number of pixels in the client's strip (default: 60)
+        - "fps": frame rate to render at (default: 60)
+        """
+        try:
+            data = render_stream_schema.load(request.get_json() or dict())
+        except ValidationError as err:
+            app.logger.error(err.messages)
+            return error_response(err)
+
+        client_id = data.pop('client_id')
+        config, pixels, fps = _render_args(data)
+        try:
+            source = render.get_renderer().source(config, pixels, fps)
+            proxy_server.start_stream(g.user.user_id, client_id, pixels, fps,
+                                      source)
+        except RuntimeError as err:
+            app.logger.error(err)
+            return util.format_error(501, str(err)), 501
+        except (ValueError, TypeError) as err:
+            return util.format_error(400, str(err)), 400
+
+        return dict(success=True)
+
+
+# ========== Admin ==========
+
+class Traces(Resource):
+    """
+    View recent traces of lighting submissions, if tracing is enabled. See
+    ``webcandy.tracing``. Only available to the users named by the
+    ADMIN_USERNAMES setting.
+    """
+
+    @staticmethod
+    @auth.login_required
+    def get():
+        """
+        Query parameters:
+        - "trace_id": ID of the trace to get (optional)
+        - "limit": number of recent traces to get (optional; default: 50)
+
+        :return: JSON of the trace with "trace_id"; otherwise, whether tracing
+            is "enabled" and the most recent "traces", newest first
+        """
+        if g.user.username not in app.config['ADMIN_USERNAMES']:
+            return util.format_error(403, 'Admin access required'), 403
+
+        trace_id = request.args.get('trace_id')
+        if trace_id is not None:
+            trace = tracing.tracer.get(trace_id)
+            if trace is None:
+                return util.format_error(
+                    404, f'No recent trace with ID {trace_id!r}'), 404
+            return trace.status()
+
+        try:
+            limit = int(request.args.get('limit', 50))
+        except ValueError:
+            return util.format_error(400, 'limit must be an integer'), 400
+        return {'enabled': tracing.tracer.enabled,
+                'traces': [trace.status()
+                           for trace in tracing.tracer.recent(max(limit, 0))]}
 
 
 # -------------------------------
@@ -0,0 +1,191 @@
+"""
+Timelines of lighting changes fired by the proxy server at set times.
+
+All pending cues, of every timeline, are kept in a single heap ordered by the
+time they are due, and a single timer on the proxy server loop is armed for
+the earliest one. Firing a cue hands its pre-encoded message straight to the
+clients' outboxes, so there is no thread or HTTP request per cue and cues are
+delivered as close to their time as the loop allows.
+"""
+import time
+import heapq
+import asyncio
+import logging
+import itertools
+import uuid
+
+from typing import Callable, Dict, List, NamedTuple, Optional, Tuple
+
+from . import protocol as wire
+from .config import Config, configure_logger
+
+logger = logging.getLogger(__name__)
+configure_logger(logger)
+
+# cues due within this many seconds of each other fire in the same iteration
+TOLERANCE = 0.001
+
+
+class Cue(NamedTuple):
+    """
+    A lighting change in a timeline.
+    """
+    at: float  # seconds after the start of the timeline
+    message: wire.Message
+    client_names: Optional[List[str]] = None  # all connected clients if None
+
+
+class Timeline:
+    """
+    Cues to fire for a user's clients, relative to a start time.
+    """
+
+    def __init__(self, user_id: int, cues: List[Cue],
+                 start: Optional[float] = None):
+        """
+        :param user_id: ID of the user whose clients the cues are sent to
+        :param cues: the cues
+        :param start: Unix time the timeline starts at; now if ``None``
+        """
+        self.timeline_id = uuid.uuid4().hex
+        self.user_id = user_id
+        self.cues = cues
+        self.start = time.time() if start is None else start
+        self.remaining = len(cues)
+        self.cancelled = False
+
+    def status(self) -> Dict:
+        """
+        Get a JSON serializable description of the timeline.
+        """
+        return {'timeline_id': self.timeline_id,
+                'start': self.start,
+                'end': self.start + max(cue.at for cue in self.cues),
+                'cues': len(self.cues),
+                'remaining': self.remaining}
+
+
+class Scheduler:
+    """
+    Fire the cues of timelines when they are due. Every method must be called
+    from the proxy server loop.
+    """
+
+    def __init__(self, fire: Callable[[Timeline, Cue], None],
+                 max_timelines: int = Config.SCHEDULE_MAX_TIMELINES):
+        """
+        :param fire: function called with a timeline and a cue of it when the
+            cue is due
+        :param max_timelines: number of pending timelines a user can have
+        """
+        self.fire = fire
+        self.max_timelines = max_timelines
+        # map timeline ID to pending timeline
+        self.timelines: Dict[str, Timeline] = dict()
+        # (loop time due, sequence number, timeline, cue)
+        self._heap: List[Tuple[float, int, Timeline, Cue]] = []
+        self._sequence = itertools.count()
+        self._timer: Optional[asyncio.TimerHandle] = None
+        # number of heap entries belonging to cancelled timelines
+        self._stale = 0
+        # cues fired, and how late they fired, in seconds
+        self.stats = {'fired': 0, 'late_total': 0.0, 'late_max': 0.0}
+
+    def add(self, timeline: Timeline) -> None:
+        """
+        Schedule the cues of a timeline. Cues that are already due fire in the
+        next loop iteration.
+
+        :raises ValueError: if the user has too many pending timelines
+        """
+        if len(self.pending(timeline.user_id)) >= self.max_timelines:
+            raise ValueError(f'At most {self.max_timelines} timelines can be '
+                             f'scheduled at once')
+
+        # loop time is monotonic, so convert from wall time once, up front
+        loop = asyncio.get_event_loop()
+        base = timeline.start - time.time() + loop.time()
+        for cue in timeline.cues:
+            heapq.heappush(self._heap, (base + cue.at, next(self._sequence),
+                                        timeline, cue))
+        self.timelines[timeline.timeline_id] = timeline
+        self._arm()
+
+    def cancel(self, timeline_id: str) -> Optional[Timeline]:
+        """
+        Cancel the remaining cues of a timeline.
+
+        :return: the cancelled timeline; ``None`` if no timeline with the ID
+            is pending
+        """
+        timeline = self.timelines.pop(timeline_id, None)
+        if timeline is None:
+            return None
+
+        # leave the cues in the heap to be skipped, unless they make up most
+        # of it, so that cancelling doesn't cost a rebuild every time
+        timeline.cancelled = True
+        self._stale += timeline.remaining
+        if self._stale > len(self._heap) // 2:
+            self._heap = [e for e in self._heap if not e[2].cancelled]
+            heapq.heapify(self._heap)
+            self._stale = 0
+        self._arm()
+        return timeline
+
+    def pending(self, user_id: int) -> List[Timeline]:
+        """
+        Get the pending timelines of a user.
+        """
+        return [t for t in self.timelines.values() if t.user_id == user_id]
+
+    def _arm(self) -> None:
+        """
+        Set the timer for the earliest pending cue.
+        """
+        while self._heap and self._heap[0][2].cancelled:
+            heapq.heappop(self._heap)
+            self._stale -= 1
+
+        if not self._heap:
+            if self._timer:
+                self._timer.cancel()
+                self._timer = None
+            return
+
+        when = self._heap[0][0]
+        if self._timer:
+            if self._timer.when() == when:
+                return
+            self._timer.cancel()
+        self._timer = asyncio.get_event_loop().call_at(when, self._run)
+
+    def _run(self) -> None:
+        """
+        Fire every cue that is due.
+        """
+        self._timer = None
+        loop = asyncio.get_event_loop()
+        now = loop.time()
+
+        while self._heap and self._heap[0][0] <= now + TOLERANCE:
+            when, _, timeline, cue = heapq.heappop(self._heap)
+            if timeline.cancelled:
+                self._stale -= 1
+                continue
+
+            timeline.remaining -= 1
+            if not timeline.remaining:
+                del self.timelines[timeline.timeline_id]
+
+            late = max(loop.time() - when, 0)
+            self.stats['fired'] += 1
+            self.stats['late_total'] += late
+            self.stats['late_max'] = max(self.stats['late_max'], late)
+            try:
+                self.fire(timeline, cue)
+            except Exception:
+                logger.exception(f'Failed to fire cue at {cue.at}s of '
+                                 f'timeline {timeline.timeline_id}')
+
+        self._arm()
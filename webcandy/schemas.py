@@ -0,0 +1,302 @@
+"""
+Validation of data sent by clients and API callers.
+
+Schemas are instantiated once, here, and shared; marshmallow schemas are
+stateless once built, and building one is much more expensive than using it.
+"""
+from typing import Dict, List, Tuple
+from marshmallow import (
+    Schema, fields, validates_schema, ValidationError, INCLUDE
+)
+
+from . import util
+from .catalogue import PatternSchema
+from .config import Config
+
+
+INVALID_COLOR = 'Not a valid color.'
+
+# longest a submission may wait for a client's acknowledgement, in seconds
+MAX_ACK_TIMEOUT = 30
+# largest pattern speed accepted in a lighting configuration
+MAX_SPEED = 1000
+# largest number of frames rendered for a single preview
+MAX_PREVIEW_FRAMES = 600
+
+
+class Color(fields.Str):
+    """
+    A color, given in any form accepted by ``util.normalize_color`` and
+    loaded as #rrggbb.
+    """
+    default_error_messages = {'invalid_color': INVALID_COLOR}
+
+    def _deserialize(self, value, attr, data, **kwargs):
+        color = util.normalize_color(value)
+        if color is None:
+            raise self.make_error('invalid_color')
+        return color
+
+
+def _parse_colors(colors: list) -> List[str]:
+    """
+    Normalize a list of colors.
+
+    :raises ValidationError: with a message for each invalid color, by index
+    """
+    parsed = util.parse_colors(colors)
+    if parsed.invalid:
+        raise ValidationError({i: [INVALID_COLOR] for i in parsed.invalid})
+    return parsed.colors
+
+
+class ColorList(fields.Field):
+    """
+    A list of colors, loaded like ``Color``. Validated in a single pass
+    rather than with a field per color, which costs several times more for
+    long lists.
+    """
+    default_error_messages = {'invalid': 'Not a valid list.'}
+
+    def _deserialize(self, value, attr, data, **kwargs):
+        if not isinstance(value, list):
+            raise self.make_error('invalid')
+        return _parse_colors(value)
+
+
+class ColorMapping(fields.Field):
+    """
+    A mapping of names to colors, or to lists of colors. Validated in a single
+    pass like ``ColorList``.
+    """
+    default_error_messages = {'invalid': 'Not a valid mapping.'}
+
+    def __init__(self, lists: bool = False, **kwargs):
+        """
+        :param lists: whether names map to lists of colors rather than colors
+        """
+        super().__init__(**kwargs)
+        self.lists = lists
+
+    def _deserialize(self, value, attr, data, **kwargs):
+        if not isinstance(value, dict):
+            raise self.make_error('invalid')
+
+        errors = {name: ['Not a valid name.'] for name in value
+                  if not isinstance(name, str)}
+
+        if not self.lists:
+            parsed = util.parse_colors(value.values())
+            names = list(value)
+            for i in parsed.invalid:
+                errors.setdefault(names[i], [INVALID_COLOR])
+            result = dict(zip(names, parsed.colors))
+        else:
+            result = dict()
+            for name, item in value.items():
+                try:
+                    if not isinstance(item, list):
+                        raise ValidationError(['Not a valid list.'])
+                    result[name] = _parse_colors(item)
+                except ValidationError as err:
+                    errors.setdefault(name, err.messages)
+
+        if errors:
+            raise ValidationError(errors)
+        return result
+
+
+class ClientDataSchema(Schema):
+    """
+    Schema for data that a client must send to get registered. Patterns are
+    validated by the pattern catalogue, and only if it has not seen them
+    before (see ``Catalogue.resolve``).
+    """
+
+    class DiffSchema(Schema):
+        """
+        Schema for changes to a pattern list in the pattern catalogue.
+        """
+        add = fields.List(fields.Dict())
+        remove = fields.List(fields.Str())
+
+    PatternSchema = PatternSchema
+
+    token = fields.Str(required=True)
+    client_name = fields.Str(required=True)
+    # each pattern is validated by the pattern catalogue, and only if it
+    # doesn't hold the list yet
+    patterns = fields.Raw(validate=lambda v: isinstance(v, list))
+    patterns_hash = fields.Str()
+    patterns_base = fields.Str()
+    patterns_diff = fields.Nested(DiffSchema())
+    # encodings the client accepts, in order of preference
+    encodings = fields.List(fields.Str())
+    # whether the client answers clock synchronization probes
+    clock_sync = fields.Bool()
+    # whether the client acknowledges lighting configurations
+    acks = fields.Bool()
+
+    @validates_schema
+    def validate_patterns(self, data, **_):
+        given = [name for name in ('patterns', 'patterns_hash', 'patterns_base')
+                 if name in data]
+        if len(given) != 1:
+            raise ValidationError('Exactly one of patterns, patterns_hash and '
+                                  'patterns_base is required', 'patterns')
+        if ('patterns_base' in data) != ('patterns_diff' in data):
+            raise ValidationError('patterns_base and patterns_diff must be '
+                                  'given together', 'patterns_diff')
+
+
+class LightingSchema(Schema):
+    """
+    Schema for a lighting configuration. Fields other than the common ones
+    are passed on to the client as they are, for patterns with arguments of
+    their own.
+    """
+
+    class Meta:
+        unknown = INCLUDE
+
+    pattern = fields.Str(required=True)
+    strobe = fields.Bool()
+    speed = fields.Float(validate=lambda v: 0 <= v <= MAX_SPEED)
+    color = Color()
+    color_list = ColorList()
+
+
+class SubmitSchema(LightingSchema):
+    """
+    Schema for the body of a submission to a single client.
+    """
+    client_id = fields.Str(required=True)
+    # whether to wait for the client to acknowledge the configuration
+    ack = fields.Bool()
+    # seconds to wait for the acknowledgement; implies ack
+    ack_timeout = fields.Float(validate=lambda v: 0 < v <= MAX_ACK_TIMEOUT)
+
+
+class SceneSchema(LightingSchema):
+    """
+    Schema for a lighting configuration and the clients to send it to, as
+    saved in a scene.
+    """
+    client_ids = fields.List(fields.Str())
+    group = fields.Str()
+
+    @validates_schema
+    def validate_targets(self, data, **_):
+        if 'client_ids' in data and 'group' in data:
+            raise ValidationError('Only one of client_ids and group may be '
+                                  'specified', 'group')
+
+
+class BroadcastSchema(SceneSchema):
+    """
+    Schema for the body of a submission to several clients.
+    """
+    # whether the clients should start the configuration at the same instant
+    sync = fields.Bool()
+    # Unix time to start at; implies sync
+    start_at = fields.Float()
+
+
+class RenderSchema(LightingSchema):
+    """
+    Schema for the body of a request to render a lighting configuration on
+    the server.
+    """
+    pixels = fields.Int(
+        validate=lambda v: 0 < v <= Config.STREAM_MAX_PIXELS)
+    fps = fields.Float(validate=lambda v: 0 < v <= Config.STREAM_MAX_FPS)
+
+
+class RenderPreviewSchema(RenderSchema):
+    """
+    Schema for the body of a request to preview a lighting configuration.
+    """
+    frames = fields.Int(validate=lambda v: 0 < v <= MAX_PREVIEW_FRAMES)
+
+
+class RenderStreamSchema(RenderSchema):
+    """
+    Schema for the body of a request to render a lighting configuration and
+    stream it to a client.
+    """
+    client_id = fields.Str(required=True)
+
+
+class CueSchema(Schema):
+    """
+    Schema for a cue of a scheduled timeline: either the name of a saved
+    scene, or a scene given in full as "lighting".
+    """
+    at = fields.Float(required=True, validate=lambda v: v >= 0)
+    scene = fields.Str()
+    lighting = fields.Nested(SceneSchema)
+
+    @validates_schema
+    def validate_scene(self, data, **_):
+        if ('scene' in data) == ('lighting' in data):
+            raise ValidationError('Exactly one of scene and lighting is '
+                                  'required', 'scene')
+
+
+class TimelineSchema(Schema):
+    """
+    Schema for a timeline of cues to schedule.
+    """
+    # Unix time the timeline starts at; now if not given
+    start = fields.Float()
+    cues = fields.List(
+        fields.Nested(CueSchema), required=True,
+        validate=lambda v: 0 < len(v) <= Config.SCHEDULE_MAX_CUES)
+
+
+class UserDataSchema(Schema):
+    """
+    Schema for changes to a user's saved data.
+    """
+    colors = ColorMapping()
+    color_lists = ColorMapping(lists=True)
+    client_groups = fields.Dict(keys=fields.Str(),
+                                values=fields.List(fields.Str()))
+    scenes = fields.Dict(keys=fields.Str(), values=fields.Nested(SceneSchema))
+
+
+class UserDataDeletionSchema(Schema):
+    """
+    Schema for the names of items to delete from a user's saved data, by
+    section.
+    """
+    colors = fields.List(fields.Str())
+    color_lists = fields.List(fields.Str())
+    client_groups = fields.List(fields.Str())
+    scenes = fields.List(fields.Str())
+
+
+client_data_schema = ClientDataSchema()
+submit_schema = SubmitSchema()
+broadcast_schema = BroadcastSchema()
+user_data_schema = UserDataSchema()
+user_data_deletion_schema = UserDataDeletionSchema()
+timeline_schema = TimelineSchema()
+render_preview_schema = RenderPreviewSchema()
+render_stream_schema = RenderStreamSchema()
+
+
+def error_response(err: ValidationError) -> Tuple[Dict, int]:
+    """
+    Uniform API response for data that failed validation.
+
+    :param err: the validation error
+    :return: the response body, with the messages of each invalid field under
+        "messages", and status code
+    """
+    fields_ = err.messages if isinstance(err.messages, dict) else dict()
+    description = 'Invalid fields: ' + ', '.join(sorted(fields_)) \
+        if fields_ else 'Invalid data'
+    body = util.format_error(400, description)
+    body['messages'] = err.messages
+    return body, 400
@@ -1,3 +1,4 @@
+import time
 import asyncio
 import socket
 import threading
@@ -5,14 +6,28 @@ import json
 import logging
 import websockets
 
-from collections import defaultdict
-from typing import Dict, List, Optional
+from collections import defaultdict, deque
+from concurrent.futures import (
+    Future, ThreadPoolExecutor, TimeoutError as FutureTimeoutError
+)
+from typing import Callable, Deque, Dict, List, Optional, Set, Tuple
 from flask import Flask
-from marshmallow import Schema, fields, INCLUDE, ValidationError
+from marshmallow import ValidationError
 
-from . import util
-from .config import configure_logger
-from .models import User
+from . import util, protocol as wire
+from .acks import Ack, AckTracker
+from .catalogue import catalogue
+from .clock import ClockEstimate, PROBE_INTERVAL
+from .config import Config, configure_logger
+from .events import event_bus
+from .metrics import Histogram, Metric, metrics, pseudonym
+from .models import User, token_cache, user_cache
+from .outbox import Outbox, LIGHTING
+from .profiling import profiler, WS_HANDLER
+from .registry import Registry, create_registry
+from .scheduler import Cue, Scheduler, Timeline
+from .schemas import client_data_schema
+from .stream import PixelStream
 
 # define module logger since app isn't initialized when this is run
 logger = logging.getLogger(__name__)
@@ -30,28 +45,144 @@ class ClientManager:
         """
 
         def __init__(self, user_id: int, client_name: str, patterns: List[Dict],
-                     protocol: websockets.WebSocketServerProtocol):
+                     protocol: websockets.WebSocketServerProtocol,
+                     encoding: str = wire.JSON, clock_sync: bool = False,
+                     acks: bool = False, username: Optional[str] = None):
             # store user_id and client_name as backward reference
             self.user_id = user_id
             self.client_name = client_name
+            # for logging, without querying the database on the server loop
+            self.username = username
             self.patterns = patterns
             self.protocol = protocol
+            self.encoding = encoding  # see webcandy.protocol
+            self.outbox = Outbox(protocol, Config.OUTBOX_SIZE,
+                                 Config.OUTBOX_DROP_POLICY)
+            self.stream: Optional[PixelStream] = None
+
+            # liveness, updated by heartbeats
+            self.connected_at = time.time()
+            self.last_seen = self.connected_at
+            self.latency: Optional[float] = None  # round trip, in seconds
+            # offset of the client's clock, if it answers clock probes
+            self.clock: Optional[ClockEstimate] = \
+                ClockEstimate() if clock_sync else None
+            # messages awaiting acknowledgement, if it acknowledges them
+            self.acks: Optional[AckTracker] = AckTracker() if acks else None
+
+        def status(self) -> Dict:
+            """
+            Get the connection state of this client.
+            """
+            return {'connected_at': self.connected_at,
+                    'last_seen': self.last_seen,
+                    'latency': self.latency,
+                    'encoding': self.encoding,
+                    'stream': self.stream.stats() if self.stream else None,
+                    'clock': self.clock.status() if self.clock else None,
+                    'acks': self.acks.status() if self.acks else None}
+
+        def close(self) -> None:
+            """
+            Stop sending to this client and close its connection. Must be
+            called from the proxy server loop.
+            """
+            self.outbox.close()
+            if self.stream:
+                self.stream.close()
+            if self.acks:
+                self.acks.close()
+            asyncio.ensure_future(self.protocol.close())
 
     # map user_id to map of client_name to Client instance
     clients: Dict[int, Dict[str, Client]] = defaultdict(dict)
 
     def __init__(self, app: Flask = None):
         self.app = app
+        # view of the clients connected to other processes
+        self.registry: Registry = Registry()
+        # thread pool for token verification, created on first registration
+        self.executor: Optional[ThreadPoolExecutor] = None
+        if app:
+            self.init_app(app)
 
     def init_app(self, app: Flask) -> None:
         self.app = app
+        self.registry = create_registry(app.config)
+
+    def authenticate(self, token: str) -> Optional[User]:
+        """
+        Get the user associated with a client's token. Performs signature
+        verification and a database query on cache misses, so call this from
+        an executor rather than the proxy server loop (see
+        ``ClientManager.authenticate_async``).
+        :param token: authorization token provided by the client
+        :return: the user the token is associated with; None if invalid
+        :raises RuntimeError: if called before app is initialized
+        """
+        if not self.app:
+            raise RuntimeError('app must be initialized to register client')
+
+        with self.app.app_context():
+            return User.get_user(token)
+
+    async def authenticate_async(self, token: str) -> Optional[User]:
+        """
+        Get the user associated with a client's token without blocking the
+        proxy server loop. The token is verified on a bounded thread pool, so
+        a burst of registrations cannot stall traffic to clients that are
+        already connected.
+        :param token: authorization token provided by the client
+        :return: the user the token is associated with; None if invalid
+        """
+        if self.executor is None:
+            self.executor = ThreadPoolExecutor(
+                max_workers=Config.REGISTER_WORKERS,
+                thread_name_prefix='register')
+
+        return await asyncio.get_event_loop().run_in_executor(
+            self.executor, self.authenticate, token)
+
+    def add(self, user: User, client_name: str, patterns: List[Dict],
+            protocol: websockets.WebSocketServerProtocol,
+            encoding: str = wire.JSON, clock_sync: bool = False,
+            acks: bool = False) -> Client:
+        """
+        Add a client of an authenticated user. Must be called from the proxy
+        server loop.
+        :param user: the user the client belongs to
+        :param client_name: the client name to use; must be unique for this user
+        :param patterns: available patterns provided by the client
+        :param protocol: ``WebcandyServerProtocol`` instance for the client
+        :param encoding: the encoding to send messages to the client in
+        :param clock_sync: whether the client answers clock probes
+        :param acks: whether the client acknowledges lighting configurations
+        :return: the new client
+        """
+        client = self.Client(user.user_id, client_name, patterns, protocol,
+                             encoding, clock_sync, acks, user.username)
+        replaced = self.clients[user.user_id].get(client_name)
+        self.clients[user.user_id][client_name] = client
+        if replaced is not None:
+            # a reconnection under the same name; its handler's unregister
+            # will find the new client and leave it alone
+            replaced.close()
+        self.registry.add(user.user_id, client_name, patterns)
+        self.registry.update_status(user.user_id, client_name,
+                                    client.status())
+        event_bus.publish(user.user_id, 'connected',
+                          {'client_name': client_name,
+                           'status': client.status()})
+        logger.info(f'Registered client {client_name!r} '
+                    f'with user {user.username!r} '
+                    f'({util.format_addr(protocol.remote_address)})')
+        return client
 
     def register(self, token: str, client_name: str, patterns: List[Dict],
                  protocol: websockets.WebSocketServerProtocol) \
             -> Optional[User]:
         """
-        Register a new client. This method is async in order to be able to send
-        messages to `protocol`.
+        Register a new client, authenticating it on the calling thread.
         :param token: authorization token provided by the client
         :param client_name: the client name to use; must be unique for this user
         :param patterns: available patterns provided by the client
@@ -59,50 +190,231 @@ class ClientManager:
         :return: the user the token is associated with; None if invalid
         :raises RuntimeError: if called before app is initialized
         """
-        if not self.app:
-            raise RuntimeError('app must be initialized to register client')
+        user = self.authenticate(token)
+        if user:
+            self.add(user, client_name, patterns, protocol)
+        else:
+            logger.error(f'No user could be associated with token {token!r} '
+                         f'from {util.format_addr(protocol.remote_address)}')
+        return user
 
-        with self.app.app_context():
-            user: User = User.get_user(token)
-            if user:
-                self.clients[user.user_id][client_name] = self.Client(
-                    user.user_id, client_name, patterns, protocol)
-                logger.info(
-                    f'Registered client {client_name!r} '
-                    f'with user {user.username!r} '
-                    f'({util.format_addr(protocol.remote_address)})')
-                return user
-            else:
-                logger.error(
-                    f'No user could be associated with token {token!r}'
-                    f'from {util.format_addr(protocol.remote_address)}')
-                protocol.close()
+    async def register_async(self, token: str, client_name: str,
+                             patterns: List[Dict],
+                             protocol: websockets.WebSocketServerProtocol,
+                             encoding: str = wire.JSON,
+                             clock_sync: bool = False,
+                             acks: bool = False) -> Optional[User]:
+        """
+        Register a new client without blocking the proxy server loop. See
+        ``ClientManager.authenticate_async``, ``ClientManager.register`` and
+        ``ClientManager.add`` for parameters.
+        """
+        user = await self.authenticate_async(token)
+        if user:
+            self.add(user, client_name, patterns, protocol, encoding,
+                     clock_sync, acks)
+        else:
+            logger.error(f'No user could be associated with token {token!r} '
+                         f'from {util.format_addr(protocol.remote_address)}')
+        return user
 
-    def unregister(self, user_id: int, client_name: str) -> None:
+    def unregister(self, user_id: int, client_name: str,
+                   protocol: websockets.WebSocketServerProtocol = None) -> None:
         """
         Close a client's transport and unregister it from the client manager.
         :param user_id: the user who owns the client
         :param client_name: the name of the client to unregister
+        :param protocol: if specified, only unregister the client if it is
+            still connected through this protocol, i.e. it has not been
+            replaced by a newer connection with the same name
         :raises ValueError: if user has no associated clients
         """
-        with self.app.app_context():
-            user: User = User.query.get(user_id)
+        if not self.is_local(user_id, client_name):
+            raise ValueError(f'User {user_id} has no associated client named '
+                             f'{client_name!r}')
 
-        if not self.contains(user_id, client_name):
-            raise ValueError(f'User {user.username!r} has no associated client '
-                             f'named {client_name!r}')
+        client = self.clients[user_id][client_name]
+        if protocol is not None and client.protocol is not protocol:
+            return
 
-        remote_addr = self.clients[user_id][client_name].protocol.remote_address
-        self.clients[user_id][client_name].protocol.close()
+        remote_addr = client.protocol.remote_address
+        client.close()
         del self.clients[user_id][client_name]
+        self.registry.remove(user_id, client_name)
+        event_bus.publish(user_id, 'disconnected',
+                          {'client_name': client_name})
         logger.info(f'Unregistered client {client_name!r} of user '
-                    f'{user.username!r} ({util.format_addr(remote_addr)})')
+                    f'{client.username!r} ({util.format_addr(remote_addr)})')
+
+    def broadcast(self, user_id: int, message: wire.Message,
+                  futures: Dict[str, Optional[Future]],
+                  key: str = LIGHTING) -> None:
+        """
+        Queue one message for several of a user's clients at once, encoded
+        once for each encoding in use. Must be called from the proxy server
+        loop so that every outbox is filled in the same loop iteration.
+        :param user_id: the user who owns the clients
+        :param message: the message to send
+        :param futures: map of client name to the future to resolve with the
+            result of sending to that client, if any; clients that are no
+            longer connected resolve to ``False``
+        :param key: coalescing key passed to each client's outbox
+        """
+        if event_bus.has_subscribers(user_id):
+            futures = self._track(user_id, message, futures)
+
+        for client_name, future in futures.items():
+            client = self.clients[user_id].get(client_name)
+            if client and client.acks:
+                client.outbox.put(message.encode(client.encoding, True),
+                                  self._expect_ack(client, message, future),
+                                  key)
+            elif client:
+                client.outbox.put(message.encode(client.encoding), future, key)
+            elif future:
+                future.set_result(False)
+
+    @staticmethod
+    def _expect_ack(client: Client, message: wire.Message,
+                    future: Optional[Future]) -> Future:
+        """
+        Start waiting for a client to acknowledge a message, unless it is
+        already awaited, and stop if the message is not written after all.
+        :param future: future to resolve with the result of writing the
+            message, if any
+        :return: the future for the outbox to resolve instead
+        """
+        client.acks.expect(message.message_id, time.perf_counter())
+        written = Future()
+
+        def done(_):
+            success = not written.cancelled() and written.result()
+            if success:
+                client.acks.written(message.message_id)
+            else:
+                client.acks.fail(message.message_id, 'not delivered')
+            if future:
+                future.set_result(success)
+
+        written.add_done_callback(done)
+        return written
+
+    def request(self, user_id: int, client_name: str, message: wire.Message,
+                future: Future, timeout: Optional[float] = None) -> None:
+        """
+        Send a message to a client that acknowledges messages. Must be called
+        from the proxy server loop.
+        :param user_id: the user who owns the client
+        :param client_name: the name of the client
+        :param message: the message to send
+        :param future: future to resolve with the ``Ack`` of the message
+        :param timeout: seconds to wait for the acknowledgement; by default,
+            ``Config.ACK_TIMEOUT``
+        """
+        client = self.clients[user_id].get(client_name)
+        if client is None or client.acks is None:
+            future.set_result(Ack(False, error='disconnected'))
+            return
+        client.acks.expect(message.message_id, time.perf_counter(), future,
+                           timeout)
+        self.broadcast(user_id, message, {client_name: None})
+
+    @staticmethod
+    def _track(user_id: int, message: wire.Message,
+               futures: Dict[str, Optional[Future]]) \
+            -> Dict[str, Optional[Future]]:
+        """
+        Publish a message queued for a user's clients to the user's event
+        subscribers, and have the result of sending it published once known.
+        :return: the futures to resolve with the results, created for clients
+            that had none
+        """
+        event_bus.publish(user_id, 'lighting',
+                          {'client_names': list(futures),
+                           'config': message.data})
+
+        tracked = dict()
+        for client_name, future in futures.items():
+            future = future or Future()
+            future.add_done_callback(
+                lambda f, name=client_name: event_bus.publish(
+                    user_id, 'delivered',
+                    {'client_name': name,
+                     'success': not f.cancelled() and bool(f.result())}))
+            tracked[client_name] = future
+        return tracked
+
+    def deliver(self, user_id: int, client_names: List[str], message: str,
+                key: Optional[str]) -> None:
+        """
+        Queue a message published to this process through the registry. Must
+        be called from the proxy server loop.
+        """
+        self.broadcast(user_id, wire.Message(text=message),
+                       dict.fromkeys(client_names), key)
+
+    def start_stream(self, user_id: int, client_name: str, pixels: int,
+                     fps: float, source: Callable[[], bytes] = None) -> None:
+        """
+        Start streaming pixel frames to a client, replacing any stream it
+        already has. Must be called from the proxy server loop.
+        :param user_id: the user who owns the client
+        :param client_name: the name of the client to stream to
+        :param pixels: number of pixels in every frame
+        :param fps: maximum number of frames to send per second
+        :param source: function returning the pixel data of the next frame,
+            if frames are pulled rather than pushed (see ``PixelStream``)
+        :raises ValueError: if the client is not connected to this process or
+            does not use the binary encoding, or the stream settings are
+            invalid
+        """
+        if not self.is_local(user_id, client_name):
+            raise ValueError(f'Client {client_name!r} not found')
+
+        client = self.clients[user_id][client_name]
+        if client.encoding != wire.BINARY:
+            raise ValueError(f'Client {client_name!r} does not use the binary '
+                             f'encoding needed for streaming')
+
+        self.stop_stream(user_id, client_name)
+        client.stream = PixelStream(client.protocol, pixels, fps,
+                                    Config.STREAM_BUFFER, source)
+
+    def push_frame(self, user_id: int, client_name: str,
+                   pixels: bytes) -> bool:
+        """
+        Queue a pixel frame for a client's stream. Must be called from the
+        proxy server loop.
+        :return: whether the frame was queued
+        :raises ValueError: if the frame has the wrong number of pixels
+        """
+        client = self.clients[user_id].get(client_name)
+        if client is None or client.stream is None:
+            return False
+        return client.stream.push(pixels)
+
+    def stop_stream(self, user_id: int, client_name: str) -> bool:
+        """
+        Stop streaming to a client. Must be called from the proxy server loop.
+        :return: whether the client had a stream
+        """
+        client = self.clients[user_id].get(client_name)
+        if client is None or client.stream is None:
+            return False
+        client.stream.close()
+        client.stream = None
+        return True
 
     def available_clients(self, user_id: int) -> List[str]:
         """
-        Get a list of names of currently connected clients.
+        Get a list of names of currently connected clients, including those
+        connected to other processes.
         """
-        return list(self.clients[user_id])
+        names = list(self.clients[user_id])
+        for name in self.registry.available_clients(user_id):
+            if name not in self.clients[user_id]:
+                names.append(name)
+        return names
 
     def get_client(self, user_id: int, client_name: str) -> Client:
         """
@@ -110,9 +422,49 @@ class ClientManager:
         """
         return self.clients[user_id][client_name]
 
+    def get_patterns(self, user_id: int,
+                     client_name: str) -> Optional[List[Dict]]:
+        """
+        Get the patterns of a client connected to any process.
+
+        :return: the client's patterns; ``None`` if the client is not connected
+        """
+        if self.is_local(user_id, client_name):
+            return self.clients[user_id][client_name].patterns
+        return self.registry.get_patterns(user_id, client_name)
+
+    def get_status(self, user_id: int, client_name: str) -> Optional[Dict]:
+        """
+        Get the connection state of a client connected to any process (see
+        ``Client.status``).
+
+        :return: the client's state; ``None`` if the client is not connected or
+            its state is unknown
+        """
+        if self.is_local(user_id, client_name):
+            return self.clients[user_id][client_name].status()
+        return self.registry.get_status(user_id, client_name)
+
     def contains(self, user_id: int, client_name: str) -> bool:
         """
-        Check if a user has a client with the specified name.
+        Check if a user has a client with the specified name connected to any
+        process.
+        """
+        return self.get_patterns(user_id, client_name) is not None
+
+    def encodings(self, user_id: int) -> Set[Tuple[str, bool]]:
+        """
+        Get the encodings a user's clients connected to this process take
+        messages in, and whether with message IDs. Must be called from the
+        proxy server loop.
+        """
+        return {(client.encoding, client.acks is not None)
+                for client in self.clients[user_id].values()}
+
+    def is_local(self, user_id: int, client_name: str) -> bool:
+        """
+        Check if a user has a client with the specified name connected to this
+        process.
         """
         return client_name in self.clients[user_id]
 
@@ -120,31 +472,65 @@ class ClientManager:
 clients = ClientManager()  # make sure to call init_app on this
 
 
-class ClientDataSchema(Schema):
+class FailureLimiter:
     """
-    Schema for data that a client must send to get registered.
+    Track failed attempts per remote host within a sliding time window.
     """
 
-    class PatternSchema(Schema):
+    def __init__(self, limit: int, window: float):
         """
-        Schema for necessary information about a lighting pattern.
+        :param limit: number of failures within the window after which a host
+            is blocked
+        :param window: length of the window in seconds
         """
+        self.limit = limit
+        self.window = window
+        # map host to times of its recent failures, oldest first; only the
+        # last `limit` failures matter
+        self._failures: Dict[str, Deque[float]] = dict()
+        # when to next forget hosts whose failures have all expired
+        self._next_prune = time.monotonic() + window
 
-        class Meta:
-            unknown = INCLUDE
+    def _recent(self, host: str) -> Optional[Deque[float]]:
+        failures = self._failures.get(host)
+        if failures is not None:
+            cutoff = time.monotonic() - self.window
+            while failures and failures[0] < cutoff:
+                failures.popleft()
+            if not failures:
+                del self._failures[host]
+                return None
+        return failures
 
-        def one_of(*args):
-            return lambda v: v in set(args)
+    def add(self, host: str) -> None:
+        """
+        Record a failed attempt from a host.
+        """
+        now = time.monotonic()
+        if now >= self._next_prune:
+            self._prune(now)
+        self._recent(host)
+        self._failures.setdefault(
+            host, deque(maxlen=self.limit)).append(now)
 
-        name = fields.Str(required=True)
-        type = fields.Str(required=True,
-                          validate=one_of('static', 'dynamic'))
-        args = fields.List(fields.Str(), required=True)
-        default_speed = fields.Float(validate=lambda v: v >= 0)
+    def _prune(self, now: float) -> None:
+        """
+        Forget the hosts whose failures have all expired, which would
+        otherwise only be forgotten when they fail again. At most once per
+        window, so the cost is spread over the failures recorded meanwhile.
+        """
+        cutoff = now - self.window
+        self._failures = {host: failures
+                          for host, failures in self._failures.items()
+                          if failures[-1] >= cutoff}
+        self._next_prune = now + self.window
 
-    token = fields.Str(required=True)
-    client_name = fields.Str(required=True)
-    patterns = fields.List(fields.Nested(PatternSchema()), required=True)
+    def blocked(self, host: str) -> bool:
+        """
+        Check if a host has reached the failure limit.
+        """
+        failures = self._recent(host)
+        return failures is not None and len(failures) >= self.limit
 
 
 class ProxyServer:
@@ -152,13 +538,91 @@ class ProxyServer:
     Manager for the proxy server allowing data to be sent to specific clients.
     """
     running: bool = False
+    # event loop the server runs on; set once the server thread is listening
+    loop: Optional[asyncio.AbstractEventLoop] = None
 
-    @staticmethod
-    async def _ws_handler(client: websockets.WebSocketServerProtocol, _):
+    def __init__(self):
+        self.failures = FailureLimiter(Config.HANDSHAKE_FAILURE_LIMIT,
+                                       Config.HANDSHAKE_FAILURE_WINDOW)
+        # registration counts, and handshake latency in seconds
+        self.handshakes = {'registered': 0, 'rejected': 0, 'timed_out': 0}
+        self.handshake_latency = Histogram()
+        self.scheduler = Scheduler(self._fire)
+
+    async def _ws_handler(self, client: websockets.WebSocketServerProtocol, _):
         addr = util.format_addr(client.remote_address)
+        host = client.remote_address[0]
         logger.debug(f'Connected client {addr}')
 
-        schema = ClientDataSchema()
+        if self.failures.blocked(host):
+            logger.warning(f'Too many failed registrations from {host}, '
+                           f'refusing {addr}')
+            await client.close(1008, 'Too many failed registrations')
+            return
+
+        start = time.perf_counter()
+        try:
+            # the registration is what this handler spends its time on; after
+            # it, the connection only waits for messages
+            with profiler.profile(WS_HANDLER):
+                registered = await asyncio.wait_for(
+                    self._handshake(client, addr), Config.HANDSHAKE_TIMEOUT)
+        except asyncio.TimeoutError:
+            self.handshakes['timed_out'] += 1
+            self.failures.add(host)
+            logger.error(f'Registration of {addr} timed out')
+            await client.close(1008, 'Registration timed out')
+            return
+        except websockets.ConnectionClosed:
+            logger.debug(f'Disconnected client {addr} before registration')
+            return
+
+        if not registered:
+            self.handshakes['rejected'] += 1
+            self.failures.add(host)
+            await client.send('[Error] Invalid authentication token\n')
+            await client.close(1008, 'Invalid authentication token')
+            return
+
+        user, client_name, patterns_hash = registered
+        latency = time.perf_counter() - start
+        self.handshakes['registered'] += 1
+        self.handshake_latency.observe(latency)
+        logger.debug(f'Registered {addr} in {latency * 1000:.1f}ms')
+
+        encoding = clients.get_client(user.user_id, client_name).encoding
+        await client.send(f'Registered client {client_name!r} '
+                          f'with user {user.username!r} '
+                          f'using {encoding} encoding '
+                          f'and pattern catalogue {patterns_hash!r}.')
+
+        registered_client = clients.get_client(user.user_id, client_name)
+        tasks = [asyncio.ensure_future(
+            ProxyServer._heartbeat(registered_client))]
+        if registered_client.clock:
+            tasks.append(asyncio.ensure_future(
+                ProxyServer._probe_clock(registered_client)))
+        try:
+            while True:
+                ProxyServer._receive(registered_client, await client.recv())
+        except websockets.ConnectionClosed:
+            logger.debug(f'Disconnected client {addr}')
+        finally:
+            for task in tasks:
+                task.cancel()
+            if clients.is_local(user.user_id, client_name):
+                clients.unregister(user.user_id, client_name, client)
+
+    async def _handshake(self, client: websockets.WebSocketServerProtocol,
+                         addr: str) -> Optional[Tuple[User, str, str]]:
+        """
+        Read registration data from a newly connected client until it is
+        valid, then register the client. Its token is verified before its
+        patterns are looked up in or stored to the pattern catalogue.
+        :return: the user and name of the registered client, and the hash of
+            its patterns in the pattern catalogue; ``None`` if its token was
+            invalid
+        """
         await client.send(
             '[Webcandy] To register a client, please send serialized JSON data '
             'fitting the schema described in the documentation.')
@@ -176,86 +640,753 @@ class ProxyServer:
                 continue
 
             try:
-                result = schema.load(parsed)
+                result = client_data_schema.load(parsed)
             except ValidationError as err:
                 logger.error(f'{err.messages} (from {addr})')
                 await client.send(f'[Error] {err.messages}')
                 continue
 
-        token = result['token']
+            # the pattern catalogue is shared by all users, so don't let
+            # unauthenticated clients fill it or probe what it holds
+            user = await clients.authenticate_async(result['token'])
+            if not user:
+                logger.error(f'No user could be associated with token '
+                             f'{result["token"]!r} from {addr}')
+                return None
+
+            try:
+                patterns_hash, patterns = catalogue.resolve(result)
+            except ValidationError as err:
+                logger.error(f'{err.messages} (from {addr})')
+                await client.send(f'[Error] {err.messages}')
+                result = None
+            except KeyError as err:
+                logger.debug(f'Unknown pattern catalogue {err.args[0]!r} '
+                             f'(from {addr})')
+                await client.send(f'[Error] Unknown pattern catalogue '
+                                  f'{err.args[0]!r}, please send patterns')
+                result = None
+
         client_name = result['client_name']
-        patterns = result['patterns']
+        clients.add(user, client_name, patterns, client,
+                    wire.negotiate(result.get('encodings')),
+                    result.get('clock_sync', False), result.get('acks', False))
+        return user, client_name, patterns_hash
 
-        user = clients.register(token, client_name, patterns, client)
-        if user:
-            await clients.get_client(user.user_id, client_name).protocol.send(
-                f'Registered client {client_name!r} '
-                f'with user {user.username!r}.')
-        else:
-            await clients.get_client(user.user_id, client_name).protocol.send(
-                '[Error] Invalid authentication token\n')
+    @staticmethod
+    async def _heartbeat(client: ClientManager.Client) -> None:
+        """
+        Ping a client periodically to track its latency, and evict it if it
+        stops answering so that nothing is dispatched to a dead connection.
+        """
+        protocol = client.protocol
+        while True:
+            await asyncio.sleep(Config.HEARTBEAT_INTERVAL)
+
+            start = time.perf_counter()
+            try:
+                pong = await protocol.ping()
+                await asyncio.wait_for(pong, Config.HEARTBEAT_TIMEOUT)
+            except asyncio.TimeoutError:
+                logger.warning(
+                    f'Client {client.client_name!r} of user {client.user_id} '
+                    f'did not answer within {Config.HEARTBEAT_TIMEOUT}s '
+                    f'({util.format_addr(protocol.remote_address)}), evicting')
+                clients.unregister(client.user_id, client.client_name,
+                                   protocol)
+                # don't wait for a closing handshake from a dead peer
+                protocol.transport.abort()
+                return
+            except websockets.ConnectionClosed:
+                return
+
+            client.latency = time.perf_counter() - start
+            client.last_seen = time.time()
+            clients.registry.update_status(client.user_id, client.client_name,
+                                           client.status())
+            if client.clock:
+                try:
+                    await protocol.send(wire.clock_probe(time.time()))
+                except websockets.ConnectionClosed:
+                    return
 
+    @staticmethod
+    async def _probe_clock(client: ClientManager.Client) -> None:
+        """
+        Send a client a few clock probes in quick succession, so that its
+        clock offset is known soon after it registers rather than only after
+        several heartbeats.
+        """
+        for _ in range(Config.CLOCK_PROBES):
+            try:
+                await client.protocol.send(wire.clock_probe(time.time()))
+            except websockets.ConnectionClosed:
+                return
+            await asyncio.sleep(PROBE_INTERVAL)
+
+    @staticmethod
+    def _receive(client: ClientManager.Client, message: wire.Frame) -> None:
+        """
+        Handle a message sent by a registered client. The only messages
+        clients send after registering are acknowledgements and answers to
+        clock probes.
+        """
+        received = time.time()
         try:
-            await client.wait_closed()
-            logger.debug(f'Disconnected client {addr}')
-        finally:
-            clients.unregister(user.user_id, client_name)
+            data = json.loads(message)
+            kind = data.get('type') if isinstance(data, dict) else None
+            if kind == wire.ACK and client.acks:
+                message_id, error = wire.parse_ack(data)
+                result = client.acks.ack(message_id, error)
+                if result:
+                    event_bus.publish(client.user_id, 'acked',
+                                      dict(result.status(), id=message_id,
+                                           client_name=client.client_name))
+            elif kind == wire.CLOCK_SYNC and client.clock:
+                client.clock.add(*wire.parse_clock_reply(data), received)
+            else:
+                raise ValueError(f'Unexpected message {message!r}')
+        except ValueError as err:  # includes JSONDecodeError
+            logger.debug(f'{err} from client {client.client_name!r} of user '
+                         f'{client.user_id}')
+
+    async def serve(self, host: str = '127.0.0.1', port: int = 6543) -> None:
+        """
+        Start serving on the running event loop, which then becomes the
+        server loop. Returns once the server is listening.
+        :param host: the host to serve on
+        :param port: the port to serve on
+        """
+        # keepalive pings are handled by ProxyServer._heartbeat instead
+        await websockets.serve(self._ws_handler, host, port,
+                               ping_interval=None,
+                               close_timeout=Config.HEARTBEAT_TIMEOUT)
+        self.loop = asyncio.get_event_loop()
+        self.loop.create_task(clients.registry.serve(clients.deliver))
+
+        logger.info(f'Proxy server running on ws://{host}:{port}/')
+        self.running = True
 
     def start(self, host: str = '127.0.0.1', port: int = 6543) -> None:
         """
-        Start the proxy server.
+        Start the proxy server on a background thread. Blocks until the server
+        is listening so that data can be dispatched to it as soon as this
+        returns.
         :param host: the host to serve on
         :param port: the port to serve on
         """
+        if self.running:
+            return
 
-        def _go(handler):
+        ready = threading.Event()
+
+        def _go():
             loop = asyncio.new_event_loop()
             asyncio.set_event_loop(loop)
 
-            start_server = websockets.serve(handler, host, port)
-
-            asyncio.get_event_loop().run_until_complete(start_server)
-            asyncio.get_event_loop().run_forever()
+            try:
+                loop.run_until_complete(self.serve(host, port))
+            finally:
+                ready.set()
+            loop.run_forever()
 
-        if not self.running:
-            # test if other instance is already running
-            with socket.socket(socket.AF_INET, socket.SOCK_STREAM) as test_sock:
-                status = test_sock.connect_ex((host, port))
+        # test if other instance is already running
+        with socket.socket(socket.AF_INET, socket.SOCK_STREAM) as test_sock:
+            status = test_sock.connect_ex((host, port))
 
         # check for both Windows and Linux status codes
         if status in {10061, 111}:  # nothing running
-            server_thread = threading.Thread(
-                target=_go, args=(ProxyServer._ws_handler,))
+            server_thread = threading.Thread(target=_go, daemon=True)
             server_thread.start()
+            ready.wait()
 
-            logger.info(f'Proxy server running on ws://{host}:{port}/')
-            self.running = True
+            if not self.running:
+                logger.error(f'Proxy server failed to start on {host}:{port}')
         else:
             logger.warning(
                 f'Connection test to {host}:{port} returned status {status}, '
                 'proxy server not started')
 
-    def send(self, user_id: int, client_name: str, data: dict) -> bool:
+    def dispatch(self, user_id: int, client_name: str, data: dict,
+                 coalesce: bool = True) -> Optional[Future]:
+        """
+        Hand dictionary data off to be sent to a client associated with the
+        specified user. Safe to call from any thread; the data is serialized
+        on the calling thread and queued in the client's outbox by the server
+        loop, so no event loop is created per call. Clients connected to other
+        processes are sent the data through the client registry.
+        :param user_id: ID of the user whose client to send data to
+        :param client_name: name of client to send to
+        :param data: the data to send
+        :param coalesce: whether the data is a lighting configuration that
+            supersedes any other one still waiting to be sent to the client
+        :return: a future resolving to ``True`` once the data is written, or
+            ``False`` if it was superseded, dropped or could not be written;
+            for clients of other processes, an already resolved future is
+            returned once the data is handed off. ``None`` if the data could
+            not be dispatched
+        """
+        return self.broadcast(user_id, data, [client_name],
+                              coalesce)[client_name]
+
+    def broadcast(self, user_id: int, data: dict,
+                  client_names: Optional[List[str]] = None,
+                  coalesce: bool = True) -> Dict[str, Optional[Future]]:
+        """
+        Send dictionary data to several clients of the specified user. Safe to
+        call from any thread; the data is serialized once per encoding in use
+        and handed to every local client's outbox in a single step on the
+        server loop, and to the owners of other clients through the client
+        registry.
+        :param user_id: ID of the user whose clients to send data to
+        :param data: the data to send
+        :param client_names: names of the clients to send to; all currently
+            connected clients of the user if ``None``
+        :param coalesce: see ``ProxyServer.dispatch``
+        :return: map of client name to a future resolving to the result of
+            sending to that client (see ``ProxyServer.dispatch``); ``None``
+            for clients that are not connected
+        """
+        if client_names is None:
+            client_names = clients.available_clients(user_id)
+
+        message = wire.Message(data)
+        key = LIGHTING if coalesce else None
+
+        futures: Dict[str, Optional[Future]] = dict()
+        remote = []
+        for name in client_names:
+            client = clients.clients[user_id].get(name)
+            if client is None:
+                remote.append(name)
+            elif self.running:
+                futures[name] = Future()
+                # on this thread, not the loop
+                message.encode(client.encoding, client.acks is not None)
+
+        if futures:
+            self.loop.call_soon_threadsafe(
+                clients.broadcast, user_id, message, dict(futures), key)
+
+        if remote:
+            published = clients.registry.publish(
+                user_id, remote, message.encode(wire.JSON), key)
+            for name, success in published.items():
+                if success:
+                    futures[name] = Future()
+                    futures[name].set_result(True)
+
+        for name in client_names:
+            if name not in futures:
+                if self.running or name in remote:
+                    logger.error(f'user {user_id} has no associated client '
+                                 f'named {name!r}')
+                else:
+                    logger.error('Proxy server is not running')
+                futures[name] = None
+
+        return {name: futures[name] for name in client_names}
+
+    def broadcast_synced(self, user_id: int, data: dict,
+                         client_names: Optional[List[str]] = None,
+                         start_at: Optional[float] = None) \
+            -> Tuple[float, Dict[str, Optional[Future]]]:
+        """
+        Send a lighting configuration to several clients of the specified user
+        so that they all start it at the same instant. Safe to call from any
+        thread.
+
+        Clients with a clock offset estimate (see ``webcandy.clock``) are sent
+        the configuration straight away, with "start_at" set to the start time
+        by their own clock. Other clients, including those connected to other
+        processes, are sent the configuration at the start time, less half
+        their round trip latency if it is known. If the proxy server runs in
+        another process, the configuration is sent from there through the
+        client registry.
+        :param user_id: ID of the user whose clients to send data to
+        :param data: the lighting configuration
+        :param client_names: names of the clients to send to; all currently
+            connected clients of the user if ``None``
+        :param start_at: Unix time to start at; if ``None``, as soon as every
+            client can be reached (see ``ProxyServer.sync_lead``)
+        :return: the start time, and map of client name to a future resolving
+            to the result of sending to that client (see
+            ``ProxyServer.dispatch``), or of handing the configuration to the
+            proxy server process; ``None`` for clients that are not connected
+        :raises ValueError: if the proxy server process refused the request
+        :raises NotImplementedError: see ``ProxyServer.schedule``
+        :raises ConnectionError: see ``ProxyServer.schedule``
+        """
+        if not self.running:
+            reply = clients.registry.forward({
+                'op': 'broadcast_synced', 'user_id': user_id, 'data': data,
+                'client_names': client_names, 'start_at': start_at})
+            futures = dict()
+            for name, success in reply['results'].items():
+                futures[name] = Future() if success else None
+                if success:
+                    futures[name].set_result(True)
+            return reply['start_at'], futures
+
+        if client_names is None:
+            client_names = clients.available_clients(user_id)
+        local = {name: clients.clients[user_id][name] for name in client_names
+                 if clients.is_local(user_id, name)}
+        if start_at is None:
+            start_at = time.time() + self.sync_lead(local.values())
+
+        futures: Dict[str, Optional[Future]] = dict()
+        for name, client in local.items():
+            futures[name] = Future()
+            if client.clock and client.clock.offset is not None:
+                message = wire.Message(
+                    dict(data, start_at=client.clock.to_client(start_at)))
+                send_at = None
+            else:
+                message = wire.Message(data)
+                send_at = start_at - (client.latency or 0) / 2
+            # on this thread, not the loop
+            message.encode(client.encoding, client.acks is not None)
+            self.loop.call_soon_threadsafe(
+                self._call_at, send_at, clients.broadcast, user_id, message,
+                {name: futures[name]}, LIGHTING)
+
+        available = set(clients.registry.available_clients(user_id))
+        remote = {name: Future() for name in client_names
+                  if name not in local and name in available}
+        if remote:
+            self.loop.call_soon_threadsafe(
+                self._call_at, start_at, self._publish, user_id,
+                wire.Message(data).encode(wire.JSON), remote)
+        futures.update(remote)
+
+        for name in client_names:
+            if name not in futures:
+                logger.error(f'user {user_id} has no associated client '
+                             f'named {name!r}')
+                futures[name] = None
+        return start_at, {name: futures[name] for name in client_names}
+
+    @staticmethod
+    def sync_lead(targets) -> float:
+        """
+        Get how many seconds ahead to schedule a synchronized start so that
+        the configuration reaches every client in time: twice the longest
+        round trip of any of the clients, and at least ``Config.SYNC_LEAD``.
+        :param targets: the ``ClientManager.Client`` instances to start
+        """
+        round_trips = [client.clock.delay
+                       if client.clock and client.clock.delay is not None
+                       else client.latency or 0 for client in targets]
+        return max([Config.SYNC_LEAD] + [2 * rtt for rtt in round_trips])
+
+    def _call_at(self, when: Optional[float], func, *args) -> None:
+        """
+        Call a function on the server loop at a Unix time, or straight away
+        if the time is ``None`` or has passed. Must be called from the server
+        loop.
+        """
+        delay = when - time.time() if when is not None else 0
+        if delay > 0:
+            self.loop.call_later(delay, func, *args)
+        else:
+            func(*args)
+
+    def _publish(self, user_id: int, message: str,
+                 futures: Dict[str, Optional[Future]]) -> None:
+        """
+        Publish a lighting configuration to clients connected to other
+        processes, without blocking the server loop on the registry. Must be
+        called from the server loop.
+        :param futures: map of client name to the future to resolve with
+            whether the message was handed to the client's owner, if any
+        """
+        def done(published):
+            results = published.result() if not published.exception() \
+                else dict()
+            for name, future in futures.items():
+                if future:
+                    future.set_result(results.get(name, False))
+
+        self.loop.run_in_executor(
+            None, clients.registry.publish, user_id, list(futures), message,
+            LIGHTING).add_done_callback(done)
+
+    def send(self, user_id: int, client_name: str, data: dict,
+             wait: bool = False, timeout: Optional[float] = None) -> bool:
         """
         Send dictionary data to a client associated with the specified user.
         :param user_id: ID of the user whose client to send data to
         :param client_name: name of client to send to
         :param data: the data to send
+        :param wait: whether to block until the data has been written; if
+            ``False``, return as soon as the data has been dispatched
+        :param timeout: maximum number of seconds to wait if ``wait`` is set
         :return: ``True`` if sending was successful; ``False`` otherwise
         """
-        if not self.running:
-            logger.error('Proxy server is not running')
+        future = self.dispatch(user_id, client_name, data)
+        if future is None:
             return False
+        if not wait:
+            return True
 
-        if not clients.contains(user_id, client_name):
-            logger.error(f'user {user_id} has no associated client named '
-                         f'{client_name!r}')
+        try:
+            return future.result(timeout)
+        except FutureTimeoutError:
+            logger.error(f'Timed out sending data to client {client_name!r} '
+                         f'of user {user_id}')
             return False
 
-        asyncio.run(
-            clients.get_client(user_id, client_name).protocol.send(
-                json.dumps(data)))
+    def _call(self, func, *args):
+        """
+        Call a function on the server loop and wait for its result. The server
+        must be running.
+        """
+        future = Future()
+
+        def call():
+            try:
+                future.set_result(func(*args))
+            except Exception as err:
+                future.set_exception(err)
+
+        self.loop.call_soon_threadsafe(call)
+        return future.result(Config.HEARTBEAT_TIMEOUT)
+
+    def start_stream(self, user_id: int, client_name: str, pixels: int,
+                     fps: float, source: Callable[[], bytes] = None) -> None:
+        """
+        Start streaming pixel frames to a client connected to this process.
+        Safe to call from any thread. See ``ClientManager.start_stream``.
+        :raises ValueError: if the stream could not be started
+        """
+        if fps > Config.STREAM_MAX_FPS:
+            raise ValueError(f'At most {Config.STREAM_MAX_FPS} frames per '
+                             f'second can be streamed')
+        if pixels > Config.STREAM_MAX_PIXELS:
+            raise ValueError(f'At most {Config.STREAM_MAX_PIXELS} pixels can '
+                             f'be streamed')
+        if not self.running:
+            raise ValueError('Proxy server is not running')
+        self._call(clients.start_stream, user_id, client_name, pixels, fps,
+                   source)
+
+    def push_frame(self, user_id: int, client_name: str,
+                   pixels: bytes) -> bool:
+        """
+        Hand a pixel frame off to be streamed to a client. Safe to call from
+        any thread; returns without waiting for the server loop.
+        :param user_id: ID of the user whose client to stream to
+        :param client_name: name of the client to stream to
+        :param pixels: 3 bytes of RGB per pixel; must not be modified after
+            being pushed
+        :return: whether the client has a stream to push the frame to
+        :raises ValueError: if the frame has the wrong number of pixels
+        """
+        client = clients.clients[user_id].get(client_name)
+        stream = client.stream if client else None
+        if stream is None or not self.running:
+            return False
+        if len(pixels) != 3 * stream.pixels:
+            raise ValueError(f'Expected {3 * stream.pixels} bytes of pixel '
+                             f'data, got {len(pixels)}')
+
+        self.loop.call_soon_threadsafe(clients.push_frame, user_id,
+                                       client_name, pixels)
         return True
 
+    def stop_stream(self, user_id: int, client_name: str) -> bool:
+        """
+        Stop streaming to a client. Safe to call from any thread.
+        :return: whether the client had a stream
+        """
+        if not self.running:
+            return False
+        return self._call(clients.stop_stream, user_id, client_name)
+
+    def schedule(self, user_id: int,
+                 cues: List[Tuple[float, dict, Optional[List[str]]]],
+                 start: Optional[float] = None) -> Dict:
+        """
+        Schedule a timeline of lighting configurations to be sent to a user's
+        clients. Safe to call from any thread. The configurations are encoded
+        on the calling thread, so firing a cue only queues ready messages. If
+        the proxy server runs in another process, the timeline is scheduled
+        there through the client registry.
+        :param user_id: ID of the user whose clients to send to
+        :param cues: the seconds after the start of the timeline, lighting
+            configuration and client names of each cue; ``None`` sends to all
+            clients connected when the cue fires
+        :param start: Unix time the timeline starts at; now if ``None``
+        :return: the state of the scheduled timeline (see ``Timeline.status``)
+        :raises ValueError: if the timeline could not be scheduled
+        :raises NotImplementedError: if the proxy server does not run in this
+            process and the registry cannot reach it (see
+            ``Registry.forward``)
+        :raises ConnectionError: if the proxy server process could not be
+            reached
+        """
+        if not self.running:
+            reply = clients.registry.forward({
+                'op': 'schedule', 'user_id': user_id, 'cues': cues,
+                'start': start})
+            return reply['timeline']
+
+        encodings = self._call(clients.encodings, user_id)
+        timeline = self.make_timeline(user_id, cues, encodings, start)
+        self._call(self.scheduler.add, timeline)
+        return timeline.status()
+
+    @staticmethod
+    def make_timeline(user_id: int,
+                      cues: List[Tuple[float, dict, Optional[List[str]]]],
+                      encodings: Set[Tuple[str, bool]],
+                      start: Optional[float] = None) -> Timeline:
+        """
+        Make a timeline to schedule, with the messages of its cues encoded for
+        every encoding the user's clients use. See ``ProxyServer.schedule``.
+        :param encodings: the encodings of the user's clients, taken on the
+            server loop (see ``ClientManager.encodings``)
+        """
+        timeline_cues = []
+        for at, data, client_names in cues:
+            message = wire.Message(data)
+            for encoding, with_id in encodings:
+                message.encode(encoding, with_id)
+            timeline_cues.append(Cue(at, message, client_names))
+        return Timeline(user_id, timeline_cues, start)
+
+    def request(self, user_id: int, client_name: str, data: dict,
+                timeout: Optional[float] = None) -> Future:
+        """
+        Send a lighting configuration to a client that acknowledges messages,
+        to learn whether and how fast it applied it. Safe to call from any
+        thread.
+        :param user_id: ID of the user whose client to send data to
+        :param client_name: name of client to send to
+        :param data: the lighting configuration
+        :param timeout: seconds to wait for the acknowledgement; by default,
+            ``Config.ACK_TIMEOUT``
+        :return: a future resolving to the ``Ack`` of the configuration, at
+            the latest once the timeout passes
+        :raises ValueError: if the client is not connected to this process or
+            does not acknowledge messages
+        """
+        client = clients.clients[user_id].get(client_name)
+        if client is None or not self.running:
+            raise ValueError(f'Client {client_name!r} is not connected to '
+                             f'this server')
+        if client.acks is None:
+            raise ValueError(f'Client {client_name!r} does not acknowledge '
+                             f'messages')
+
+        message = wire.Message(data)
+        message.encode(client.encoding, True)  # on this thread, not the loop
+        future = Future()
+        self.loop.call_soon_threadsafe(clients.request, user_id, client_name,
+                                       message, future, timeout)
+        return future
+
+    def cancel_timeline(self, user_id: int, timeline_id: str) -> bool:
+        """
+        Cancel the remaining cues of a scheduled timeline. Safe to call from
+        any thread; forwarded like ``ProxyServer.schedule``.
+        :return: whether a pending timeline of the user was cancelled
+        :raises NotImplementedError: see ``ProxyServer.schedule``
+        :raises ConnectionError: see ``ProxyServer.schedule``
+        """
+        if not self.running:
+            reply = clients.registry.forward({
+                'op': 'cancel_timeline', 'user_id': user_id,
+                'timeline_id': timeline_id})
+            return reply['success']
+        return self._call(self.cancel_pending, user_id, timeline_id)
+
+    def cancel_pending(self, user_id: int, timeline_id: str) -> bool:
+        """
+        Cancel a pending timeline of a user. Must be called from the server
+        loop.
+        :return: whether a pending timeline of the user was cancelled
+        """
+        timeline = self.scheduler.timelines.get(timeline_id)
+        if timeline is None or timeline.user_id != user_id:
+            return False
+        return self.scheduler.cancel(timeline_id) is not None
+
+    def timelines(self, user_id: int) -> List[Dict]:
+        """
+        Get the state of a user's pending timelines (see ``Timeline.status``).
+        Safe to call from any thread; forwarded like
+        ``ProxyServer.schedule``.
+        :raises NotImplementedError: see ``ProxyServer.schedule``
+        :raises ConnectionError: see ``ProxyServer.schedule``
+        """
+        if not self.running:
+            reply = clients.registry.forward({'op': 'timelines',
+                                              'user_id': user_id})
+            return reply['timelines']
+        return self._call(self.pending_timelines, user_id)
+
+    def pending_timelines(self, user_id: int) -> List[Dict]:
+        """
+        Get the state of a user's pending timelines. Must be called from the
+        server loop.
+        """
+        return [t.status() for t in self.scheduler.pending(user_id)]
+
+    def subscribe(self, user_id: int, keepalive: float):
+        """
+        Subscribe to a user's events (see ``webcandy.events``), which the
+        proxy server publishes; through the client registry if the proxy
+        server runs in another process. See ``Registry.subscribe``.
+        :raises ValueError: if the user has too many subscribers
+        :raises NotImplementedError: see ``Registry.subscribe``
+        :raises ConnectionError: see ``Registry.subscribe``
+        """
+        if self.running:
+            return event_bus.subscribe(user_id)
+        return clients.registry.subscribe(user_id, keepalive)
+
+    def _fire(self, timeline: Timeline, cue: Cue) -> None:
+        """
+        Send the message of a scheduled cue. Called by the scheduler on the
+        server loop.
+        """
+        user_id = timeline.user_id
+        client_names = cue.client_names
+        if client_names is None:
+            # the clients connected here are known on the loop; those
+            # connected to other processes are looked up in the registry,
+            # which may query a database, off the loop
+            local = dict.fromkeys(clients.clients[user_id])
+            clients.broadcast(user_id, cue.message, local, LIGHTING)
+            self.loop.run_in_executor(
+                None, self._publish_elsewhere, user_id,
+                cue.message.encode(wire.JSON), set(local))
+            return
+
+        local = {name: None for name in client_names
+                 if clients.is_local(user_id, name)}
+        clients.broadcast(user_id, cue.message, local, LIGHTING)
+
+        remote = [name for name in client_names if name not in local]
+        if remote:
+            self._publish(user_id, cue.message.encode(wire.JSON),
+                          dict.fromkeys(remote))
+
+    @staticmethod
+    def _publish_elsewhere(user_id: int, message: str, local: Set[str]) \
+            -> None:
+        """
+        Publish a lighting configuration to every client of a user connected
+        to another process. Queries the registry, so call this from an
+        executor rather than the server loop.
+        :param local: names of the clients connected to this process
+        """
+        remote = [name for name in clients.registry.available_clients(user_id)
+                  if name not in local]
+        if remote:
+            clients.registry.publish(user_id, remote, message, LIGHTING)
+
+    def collect_metrics(self) -> List[Metric]:
+        """
+        Read the state of the connected clients, handshakes and scheduler as
+        metrics. Called when the metrics are scraped; must be called from the
+        server loop while the server is running. Users are labelled by a
+        pseudonym rather than their ID (see ``webcandy.metrics.pseudonym``).
+        """
+        connected = Metric('webcandy_clients', 'gauge',
+                           'Clients connected to this process, by user',
+                           ('user',))
+        depth = Metric('webcandy_outbox_depth', 'gauge',
+                       'Messages waiting to be written to a client',
+                       ('user', 'client'))
+        outbox = Metric('webcandy_outbox_messages_total', 'counter',
+                        'Messages sent, coalesced or dropped by the outbox '
+                        'of a client since it connected',
+                        ('user', 'client', 'outcome'))
+        latency = Metric('webcandy_client_latency_seconds', 'gauge',
+                         'Round trip time of the last heartbeat of a client',
+                         ('user', 'client'))
+        frames = Metric('webcandy_stream_frames_total', 'counter',
+                        'Pixel frames streamed to a client, or dropped, '
+                        'since its stream started',
+                        ('user', 'client', 'outcome'))
+        acks = Metric('webcandy_acks_total', 'counter',
+                      'Outcomes of messages sent to clients that acknowledge '
+                      'them', ('user', 'client', 'outcome'))
+        ack_latency = Metric('webcandy_ack_latency_seconds', 'histogram',
+                             'Seconds from sending a message to its '
+                             'acknowledgement by a client',
+                             ('user', 'client'))
+
+        for user_id, named in list(clients.clients.items()):
+            user = pseudonym(user_id, Config.SECRET_KEY)
+            if named:
+                connected.labels(user).set(len(named))
+            for name, client in named.items():
+                depth.labels(user, name).set(len(client.outbox))
+                for outcome in ('sent', 'coalesced', 'dropped'):
+                    outbox.labels(user, name, outcome).set(
+                        getattr(client.outbox, outcome))
+                if client.latency is not None:
+                    latency.labels(user, name).set(client.latency)
+                if client.stream:
+                    stats = client.stream.stats()
+                    for outcome in ('sent', 'dropped'):
+                        frames.labels(user, name, outcome).set(
+                            stats[outcome])
+                if client.acks:
+                    for outcome, count in client.acks.counts.items():
+                        acks.labels(user, name, outcome).set(count)
+                    ack_latency.labels(user, name).value = \
+                        client.acks.latency.copy()
+
+        handshakes = Metric('webcandy_handshakes_total', 'counter',
+                            'Client registrations, by outcome', ('outcome',))
+        for outcome, count in self.handshakes.items():
+            handshakes.labels(outcome).set(count)
+        handshake_latency = Metric('webcandy_handshake_seconds', 'histogram',
+                                   'Seconds from connecting to registering '
+                                   'a client')
+        handshake_latency.labels().value = self.handshake_latency.copy()
+
+        timelines = Metric('webcandy_scheduled_timelines', 'gauge',
+                           'Timelines with cues yet to fire')
+        timelines.labels().set(len(self.scheduler.timelines))
+        fired = Metric('webcandy_cues_fired_total', 'counter',
+                       'Scheduled cues fired')
+        fired.labels().set(self.scheduler.stats['fired'])
+        late = Metric('webcandy_cues_late_seconds_total', 'counter',
+                      'Sum of the seconds scheduled cues fired late by')
+        late.labels().set(self.scheduler.stats['late_total'])
+
+        return [connected, depth, outbox, latency, frames, acks, ack_latency,
+                handshakes, handshake_latency, timelines, fired, late]
+
+
+proxy_server = ProxyServer()
+
+
+@metrics.collector
+def _collect_proxy_metrics() -> List[Metric]:
+    if proxy_server.running and proxy_server.loop and \
+            not proxy_server.loop.is_closed():
+        return proxy_server._call(proxy_server.collect_metrics)
+    return proxy_server.collect_metrics()
+
 
-proxy_server = ProxyServer()
\ No newline at end of file
+@metrics.collector
+def _collect_cache_metrics() -> List[Metric]:
+    entries = Metric('webcandy_cache_entries', 'gauge',
+                     'Entries held by each cache', ('cache',))
+    lookups = Metric('webcandy_cache_lookups_total', 'counter',
+                     'Cache lookups, by cache and result',
+                     ('cache', 'result'))
+    for name, cache in (('token', token_cache), ('user', user_cache),
+                        ('catalogue', catalogue.cache)):
+        stats = cache.stats()
+        entries.labels(name).set(stats['size'])
+        lookups.labels(name, 'hit').set(stats['hits'])
+        lookups.labels(name, 'miss').set(stats['misses'])
+    return [entries, lookups]
@@ -0,0 +1,546 @@
+import os
+import json
+import atexit
+import tempfile
+import threading
+
+from collections import defaultdict
+from contextlib import contextmanager
+from typing import Any, Dict, Iterable, List, Optional, Tuple
+from flask import Flask
+
+try:
+    import fcntl
+except ImportError:  # not on Windows; writes are only locked per process
+    fcntl = None
+
+from .definitions import USERS_DIR
+from .extensions import db
+from .metrics import metrics
+from .models import Color, ColorList, ClientGroup, Scene
+
+# map section name to map of item name to value
+Document = Dict[str, Dict[str, Any]]
+# map section name to selected item names; None selects the whole section
+Selection = Dict[str, Optional[List[str]]]
+
+SECTIONS = ('colors', 'color_lists')
+
+# permissions new user data files get, as if created with open()
+_UMASK = os.umask(0)
+os.umask(_UMASK)
+FILE_MODE = 0o666 & ~_UMASK
+
+USER_DATA_SECONDS = metrics.histogram(
+    'webcandy_user_data_seconds',
+    'Seconds spent loading and saving user data, by operation and backend',
+    ('operation', 'backend'))
+
+
+class Backend:
+    """
+    Interface for the storage of user data, i.e. colors and color lists.
+
+    Documents map section names to maps of item names to values. Only the
+    sections listed in ``SECTIONS`` are guaranteed to exist; others (such as
+    client_groups and scenes) are created as they are written to.
+    """
+
+    def load(self, user_id: int) -> Document:
+        """
+        Retrieve all data of a user. The returned document must not be
+        modified.
+
+        :param user_id: ID of the user to get data of
+        :return: the user's data
+        :raises ValueError: if no data exists for the user
+        """
+        raise NotImplementedError
+
+    def select(self, user_id: int, selection: Selection) -> Document:
+        """
+        Retrieve part of the data of a user. Sections and items that do not
+        exist are left out of the result.
+
+        :param user_id: ID of the user to get data of
+        :param selection: the sections and items to retrieve
+        :return: the selected data
+        :raises ValueError: if no data exists for the user
+        """
+        document = self.load(user_id)
+        selected = dict()
+        for section, names in selection.items():
+            if section not in document:
+                continue
+            data = document[section]
+            if names is None:
+                selected[section] = data
+            else:
+                selected[section] = {name: data[name] for name in names
+                                     if name in data}
+        return selected
+
+    def create(self, user_id: int) -> None:
+        """
+        Create an empty document for a new user.
+
+        :param user_id: ID of the new user
+        """
+        raise NotImplementedError
+
+    def put(self, user_id: int, changes: Document) -> Document:
+        """
+        Add or modify items of a user's data.
+
+        :param user_id: ID of the user to modify data of
+        :param changes: the items to add or modify, grouped by section
+        :return: the previous value of each changed item, grouped by section;
+            ``None`` for items that were added
+        :raises ValueError: if no data exists for the user
+        """
+        raise NotImplementedError
+
+    def delete(self, user_id: int,
+               names: Dict[str, Iterable[str]]) -> Document:
+        """
+        Delete items of a user's data. Items that do not exist are ignored.
+
+        :param user_id: ID of the user to delete data of
+        :param names: the names of the items to delete, grouped by section
+        :return: the deleted value of each deleted item, grouped by section
+        :raises ValueError: if no data exists for the user
+        """
+        raise NotImplementedError
+
+    def flush(self) -> None:
+        """
+        Persist any changes that have not been written yet.
+        """
+
+
+class JSONBackend(Backend):
+    """
+    Store user data in one JSON file per user, with an in-memory write-through
+    cache.
+
+    Writes to a user's document are serialized with a per-user lock, and files
+    are replaced atomically by writing to a temporary file and renaming it.
+    Cached documents are reloaded if their file is changed by another process.
+    Processes sharing the directory also lock it around each change (where
+    ``fcntl`` is available), so that their changes don't overwrite each
+    other's. Changes can optionally be batched by delaying
+    writes, in which case rapid successive changes to one user result in a
+    single write; until it happens, changes made by other processes in the
+    meantime are not seen, and are overwritten by it.
+    """
+
+    def __init__(self, directory: str = USERS_DIR, flush_delay: float = 0):
+        """
+        :param directory: the directory holding the user data files
+        :param flush_delay: seconds to wait after a change before writing it
+            to disk; if 0, changes are written immediately
+        """
+        self.directory = directory
+        self.flush_delay = flush_delay
+
+        # map user_id to (file signature, document)
+        self._cache: Dict[int, Tuple[Optional[tuple], Document]] = dict()
+        self._locks: Dict[int, threading.RLock] = defaultdict(threading.RLock)
+        self._locks_lock = threading.Lock()
+        # map user_id to pending flush timer
+        self._timers: Dict[int, threading.Timer] = dict()
+
+        if flush_delay > 0:
+            atexit.register(self.flush)
+
+    def _path(self, user_id: int) -> str:
+        return os.path.join(self.directory, f'{user_id}.json')
+
+    def _lock(self, user_id: int) -> threading.RLock:
+        with self._locks_lock:
+            return self._locks[user_id]
+
+    @contextmanager
+    def _directory_lock(self):
+        """
+        Hold the lock other processes sharing the directory take to change a
+        user's file. Files are replaced rather than changed in place, so the
+        directory is locked, which makes changes to different users' files
+        wait for each other across processes too. Must be entered while
+        holding the user's lock.
+        """
+        if fcntl is None:
+            yield
+            return
+        fd = os.open(self.directory, os.O_RDONLY)
+        try:
+            fcntl.flock(fd, fcntl.LOCK_EX)  # released when closed
+            yield
+        finally:
+            os.close(fd)
+
+    def _signature(self, user_id: int) -> Optional[tuple]:
+        """
+        Get a value that changes whenever a user's file is rewritten.
+        """
+        try:
+            st = os.stat(self._path(user_id))
+        except FileNotFoundError:
+            return None
+        return st.st_mtime_ns, st.st_size, st.st_ino
+
+    def load(self, user_id: int) -> Document:
+        with self._lock(user_id):
+            cached = self._cache.get(user_id)
+            # documents with pending writes are newer than their file
+            if cached and (user_id in self._timers or
+                           cached[0] == self._signature(user_id)):
+                return cached[1]
+
+            signature = self._signature(user_id)
+            if signature is None:
+                raise ValueError(f'Data not found for user {user_id}')
+            with open(self._path(user_id)) as file:
+                document = json.load(file)
+            for section in SECTIONS:
+                document.setdefault(section, dict())
+
+            self._cache[user_id] = (signature, document)
+            return document
+
+    def create(self, user_id: int) -> None:
+        with self._lock(user_id), self._directory_lock():
+            self._cache[user_id] = (None, {s: dict() for s in SECTIONS})
+            self._write(user_id)
+
+    def put(self, user_id: int, changes: Document) -> Document:
+        with self._lock(user_id), self._directory_lock():
+            document = dict(self.load(user_id))
+            old = defaultdict(dict)
+
+            for section, items in changes.items():
+                if not items:
+                    continue
+                # copy on write, so documents handed out by load never change
+                data = dict(document.get(section, ()))
+                for name, value in items.items():
+                    old[section][name] = data.get(name)
+                    data[name] = value
+                document[section] = data
+
+            self._store(user_id, document)
+            return old
+
+    def delete(self, user_id: int,
+               names: Dict[str, Iterable[str]]) -> Document:
+        with self._lock(user_id), self._directory_lock():
+            document = dict(self.load(user_id))
+            deleted = defaultdict(dict)
+
+            for section, section_names in names.items():
+                data = dict(document.get(section, ()))
+                for name in section_names:
+                    if name in data:
+                        deleted[section][name] = data.pop(name)
+                if section in deleted:
+                    document[section] = data
+
+            if deleted:
+                self._store(user_id, document)
+            return deleted
+
+    def _store(self, user_id: int, document: Document) -> None:
+        """
+        Replace a user's cached document and write or schedule writing it.
+        Must be called while holding the user's lock.
+        """
+        self._cache[user_id] = (self._cache[user_id][0], document)
+
+        if self.flush_delay <= 0:
+            self._write(user_id)
+        elif user_id not in self._timers:
+            timer = threading.Timer(self.flush_delay, self._flush_user,
+                                    args=(user_id,))
+            timer.daemon = True
+            self._timers[user_id] = timer
+            timer.start()
+
+    def _flush_user(self, user_id: int) -> None:
+        with self._lock(user_id), self._directory_lock():
+            timer = self._timers.pop(user_id, None)
+            if timer:
+                timer.cancel()
+                self._write(user_id)
+
+    def _write(self, user_id: int) -> None:
+        """
+        Atomically write a user's cached document to disk, keeping the
+        permissions of the file it replaces. Must be called while holding the
+        user's lock and the directory lock.
+        """
+        document = self._cache[user_id][1]
+        try:
+            mode = os.stat(self._path(user_id)).st_mode & 0o7777
+        except FileNotFoundError:
+            mode = FILE_MODE
+        fd, tmp_path = tempfile.mkstemp(dir=self.directory, suffix='.tmp')
+        try:
+            with os.fdopen(fd, 'w') as file:
+                json.dump(document, file, indent=4)
+            # temporary files are only readable by their owner
+            os.chmod(tmp_path, mode)
+            os.replace(tmp_path, self._path(user_id))
+        except BaseException:
+            os.remove(tmp_path)
+            raise
+
+        self._cache[user_id] = (self._signature(user_id), document)
+
+    def flush(self) -> None:
+        for user_id in list(self._timers):
+            self._flush_user(user_id)
+
+
+class SQLBackend(Backend):
+    """
+    Store user data in database tables next to the users table, one row per
+    item. Changes only touch the rows of the items involved, and all app
+    processes share the same data. Must be used from within Flask application
+    context.
+    """
+
+    # map section name to (model, whether values are JSON encoded)
+    models = {
+        'colors': (Color, False),
+        'color_lists': (ColorList, True),
+        'client_groups': (ClientGroup, True),
+        'scenes': (Scene, True)
+    }
+
+    def _model(self, section: str) -> Tuple[db.Model, bool]:
+        try:
+            return self.models[section]
+        except KeyError:
+            raise ValueError(f'Invalid user data section {section!r}')
+
+    @staticmethod
+    def _decode(row: db.Model, encoded: bool) -> Any:
+        return json.loads(row.value) if encoded else row.value
+
+    def load(self, user_id: int) -> Document:
+        document = dict()
+        for section, (model, encoded) in self.models.items():
+            rows = model.query.filter_by(user_id=user_id).all()
+            if rows or section in SECTIONS:
+                document[section] = {row.name: self._decode(row, encoded)
+                                     for row in rows}
+        return document
+
+    def select(self, user_id: int, selection: Selection) -> Document:
+        selected = dict()
+        for section, names in selection.items():
+            if section not in self.models:
+                continue
+            model, encoded = self.models[section]
+            query = model.query.filter(model.user_id == user_id)
+            if names is None:
+                rows = query.all()
+            else:
+                found = {row.name: row for row in
+                         query.filter(model.name.in_(names))}
+                rows = [found[name] for name in names if name in found]
+            if rows or section in SECTIONS:
+                selected[section] = {row.name: self._decode(row, encoded)
+                                     for row in rows}
+        return selected
+
+    def create(self, user_id: int) -> None:
+        pass  # a user without rows already has an empty document
+
+    def put(self, user_id: int, changes: Document) -> Document:
+        old = defaultdict(dict)
+
+        for section, items in changes.items():
+            if not items:
+                continue
+            model, encoded = self._model(section)
+            rows = {row.name: row for row in model.query.filter(
+                model.user_id == user_id, model.name.in_(list(items)))}
+
+            for name, value in items.items():
+                stored = json.dumps(value) if encoded else value
+                row = rows.get(name)
+                if row:
+                    old[section][name] = self._decode(row, encoded)
+                    row.value = stored
+                else:
+                    old[section][name] = None
+                    db.session.add(
+                        model(user_id=user_id, name=name, value=stored))
+
+        db.session.commit()
+        return old
+
+    def delete(self, user_id: int,
+               names: Dict[str, Iterable[str]]) -> Document:
+        deleted = defaultdict(dict)
+
+        for section, section_names in names.items():
+            model, encoded = self._model(section)
+            for row in model.query.filter(model.user_id == user_id,
+                                          model.name.in_(list(section_names))):
+                deleted[section][row.name] = self._decode(row, encoded)
+                db.session.delete(row)
+
+        db.session.commit()
+        return deleted
+
+    def import_document(self, user_id: int, document: Document) -> int:
+        """
+        Copy a whole document, such as one read from a JSON data file, into
+        the database, replacing any items with the same names.
+
+        :param user_id: ID of the user the document belongs to
+        :param document: the document to import
+        :return: the number of items imported
+        """
+        changes = {section: items for section, items in document.items()
+                   if section in self.models}
+        self.put(user_id, changes)
+        return sum(len(items) for items in changes.values())
+
+
+class UserDataStore:
+    """
+    Access point for user data, backed by the storage backend configured for
+    the app.
+    """
+    # every section that can be stored
+    SECTIONS = SECTIONS + ('client_groups', 'scenes')
+
+    def __init__(self, app: Flask = None):
+        self.backend: Optional[Backend] = None
+        self.backend_name: Optional[str] = None
+        if app:
+            self.init_app(app)
+
+    def init_app(self, app: Flask) -> None:
+        """
+        Set up the backend named by the app's ``USER_DATA_BACKEND`` setting.
+
+        :raises ValueError: if the backend name is invalid
+        """
+        name = app.config.get('USER_DATA_BACKEND', 'json')
+        if name == 'json':
+            self.backend = JSONBackend(
+                flush_delay=app.config.get('USER_DATA_FLUSH_DELAY', 0))
+        elif name == 'sql':
+            self.backend = SQLBackend()
+        else:
+            raise ValueError(f'Invalid user data backend {name!r}; expected '
+                             f"'json' or 'sql'")
+        self.backend_name = name
+
+    def _backend(self) -> Backend:
+        if not self.backend:
+            raise RuntimeError('app must be initialized to access user data')
+        return self.backend
+
+    def _timer(self, operation: str):
+        return USER_DATA_SECONDS.labels(operation, self.backend_name).time()
+
+    def load(self, user_id: int) -> Document:
+        """
+        See ``Backend.load``.
+        """
+        with self._timer('load'):
+            return self._backend().load(user_id)
+
+    def select(self, user_id: int, selection: Selection) -> Document:
+        """
+        See ``Backend.select``.
+        """
+        with self._timer('select'):
+            return self._backend().select(user_id, selection)
+
+    def create(self, user_id: int) -> None:
+        """
+        See ``Backend.create``.
+        """
+        self._backend().create(user_id)
+
+    def put(self, user_id: int, changes: Document) -> Document:
+        """
+        See ``Backend.put``.
+        """
+        with self._timer('put'):
+            return self._backend().put(user_id, changes)
+
+    def delete(self, user_id: int,
+               names: Dict[str, Iterable[str]]) -> Document:
+        """
+        See ``Backend.delete``.
+        """
+        with self._timer('delete'):
+            return self._backend().delete(user_id, names)
+
+    def flush(self) -> None:
+        """
+        See ``Backend.flush``.
+        """
+        with self._timer('flush'):
+            self._backend().flush()
+
+
+def summarize_changes(changes: Document, old: Document,
+                      summary: Dict[str, Dict[str, Dict]] = None) \
+        -> Dict[str, Dict[str, Dict]]:
+    """
+    Describe the result of ``Backend.put`` in the form returned by the API:
+    for each section, the "added" items and the "modified" items with their
+    "old" and "new" values. Sections and forms without items are left out.
+
+    :param changes: the changes that were put
+    :param old: the result of putting them
+    :param summary: a summary to add to, e.g. of earlier changes
+    :return: the summary
+    """
+    summary = dict() if summary is None else summary
+    for section, items in changes.items():
+        for name, value in items.items():
+            if old[section][name] is None:
+                summary.setdefault(section, dict()) \
+                    .setdefault('added', dict())[name] = value
+            else:
+                summary.setdefault(section, dict()) \
+                    .setdefault('modified', dict())[name] = {
+                        'old': old[section][name],
+                        'new': value
+                    }
+    return summary
+
+
+def import_json_data(directory: str = USERS_DIR) -> Dict[int, int]:
+    """
+    Import every user's JSON data file into the database tables used by the
+    SQL backend. Must be called from within Flask application context.
+
+    :param directory: the directory holding the user data files
+    :return: map of user_id to the number of items imported for that user
+    """
+    json_backend = JSONBackend(directory)
+    sql_backend = SQLBackend()
+    imported = dict()
+
+    for filename in sorted(os.listdir(directory)):
+        user_id, ext = os.path.splitext(filename)
+        if ext != '.json' or not user_id.isdigit():
+            continue
+        user_id = int(user_id)
+        imported[user_id] = sql_backend.import_document(
+            user_id, json_backend.load(user_id))
+
+    return imported
+
+
+user_data = UserDataStore()  # make sure to call init_app on this
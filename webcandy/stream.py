@@ -0,0 +1,167 @@
+import asyncio
+import logging
+import websockets
+
+from collections import deque
+from typing import Callable, Deque, Dict, List, Optional
+
+from . import util
+from .config import configure_logger
+from .protocol import FRAME_PIXELS, PIXELS_HEADER
+
+logger = logging.getLogger(__name__)
+configure_logger(logger)
+
+
+class PixelStream:
+    """
+    Paced stream of raw pixel frames to a single client.
+
+    Frames are copied into a fixed set of preallocated buffers as they are
+    pushed and written straight from those buffers, so no memory is allocated
+    per frame. A writer task on the proxy server loop sends at most ``fps``
+    frames per second. If frames are pushed faster than they can be sent, the
+    oldest waiting frame is dropped so the client always catches up to the
+    most recent ones. All methods except ``stats`` must be called from the
+    proxy server loop.
+
+    Instead of being pushed frames, a stream can pull them from a source
+    (e.g. ``Renderer.source``), in which case it sends exactly ``fps`` frames
+    per second.
+    """
+
+    def __init__(self, protocol: websockets.WebSocketServerProtocol,
+                 pixels: int, fps: float, buffer: int = 3,
+                 source: Callable[[], bytes] = None):
+        """
+        :param protocol: ``WebcandyServerProtocol`` instance for the client
+        :param pixels: number of pixels in every frame
+        :param fps: maximum number of frames to send per second
+        :param buffer: maximum number of frames waiting to be sent
+        :param source: function returning the pixel data of the next frame;
+            if given, the stream starts sending immediately
+        :raises ValueError: if any of the numbers is not positive, or there
+            are too many pixels to fit a frame
+        """
+        if pixels <= 0 or fps <= 0 or buffer <= 0:
+            raise ValueError('pixels, fps and buffer must be positive')
+        if pixels > 0xffff:
+            raise ValueError(f'At most {0xffff} pixels can be streamed')
+
+        self.protocol = protocol
+        self.pixels = pixels
+        self.fps = fps
+        self.buffer = buffer
+        self.size = PIXELS_HEADER.size + 3 * pixels
+
+        # one more buffer than can be waiting, for the frame being written
+        self._buffers: List[bytearray] = [bytearray(self.size)
+                                          for _ in range(buffer + 1)]
+        self._views = [memoryview(b) for b in self._buffers]
+        self._free: Deque[int] = deque(range(buffer + 1))
+        self._ready: Deque[int] = deque()  # oldest first
+
+        self._closed = False
+        self._writer: Optional[asyncio.Task] = None
+        self._wakeup: Optional[asyncio.Event] = None
+
+        self.sequence = 0
+        self.sent = 0
+        self.dropped = 0
+
+        self.source = source
+        if source is not None:
+            self._wakeup = asyncio.Event()
+            self._writer = asyncio.ensure_future(self._write())
+
+    def push(self, pixels: bytes) -> bool:
+        """
+        Queue a frame to be sent.
+
+        :param pixels: 3 bytes of RGB per pixel
+        :return: whether the frame was queued; ``False`` if the stream is
+            closed
+        :raises ValueError: if the frame has the wrong number of pixels
+        """
+        if len(pixels) != 3 * self.pixels:
+            raise ValueError(f'Expected {3 * self.pixels} bytes of pixel data, '
+                             f'got {len(pixels)}')
+        if self._closed:
+            return False
+
+        if len(self._ready) < self.buffer:
+            index = self._free.popleft()
+        else:
+            index = self._ready.popleft()  # drop the oldest waiting frame
+            self.dropped += 1
+
+        PIXELS_HEADER.pack_into(self._buffers[index], 0, FRAME_PIXELS,
+                                self.sequence, self.pixels)
+        self._views[index][PIXELS_HEADER.size:] = pixels
+        self.sequence = (self.sequence + 1) & 0xffffffff
+        self._ready.append(index)
+
+        if self._writer is None:
+            self._wakeup = asyncio.Event()
+            self._writer = asyncio.ensure_future(self._write())
+        self._wakeup.set()
+        return True
+
+    async def _write(self) -> None:
+        """
+        Write frames to the client at the stream's frame rate until the
+        connection closes.
+        """
+        loop = asyncio.get_event_loop()
+        interval = 1 / self.fps
+        next_time = loop.time()
+
+        while True:
+            while not self._ready:
+                if self.source is not None:
+                    self.push(self.source())
+                    break
+                self._wakeup.clear()
+                await self._wakeup.wait()
+
+            delay = next_time - loop.time()
+            if delay > 0:
+                await asyncio.sleep(delay)
+
+            index = self._ready.popleft()
+            try:
+                await self.protocol.send(self._views[index])
+            except websockets.ConnectionClosed:
+                logger.error(
+                    f'Connection to '
+                    f'{util.format_addr(self.protocol.remote_address)} '
+                    f'closed while streaming')
+                self.close()
+                return
+            finally:
+                self._free.append(index)
+
+            self.sent += 1
+            # don't send a burst of frames to make up for a slow send
+            next_time = max(next_time + interval, loop.time())
+
+    def close(self) -> None:
+        """
+        Stop the writer task and discard any frames still waiting.
+        """
+        self._closed = True
+        if self._writer is not None and \
+                self._writer is not asyncio.current_task():
+            self._writer.cancel()
+        self._writer = None
+
+        self._free.extend(self._ready)
+        self._ready.clear()
+
+    def stats(self) -> Dict[str, float]:
+        """
+        Get the settings and frame counters of this stream.
+        """
+        return {'pixels': self.pixels, 'fps': self.fps,
+                'queued': len(self._ready), 'sent': self.sent,
+                'dropped': self.dropped}
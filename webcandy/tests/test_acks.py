@@ -0,0 +1,72 @@
+import unittest
+import asyncio
+import time
+
+from concurrent.futures import Future
+
+from webcandy.acks import Ack, AckTracker
+
+
+class TestAckTracker(unittest.TestCase):
+    """
+    Tests for AckTracker class.
+    """
+
+    def setUp(self):
+        self.loop = asyncio.new_event_loop()
+        asyncio.set_event_loop(self.loop)
+        self.tracker = AckTracker()
+
+    def tearDown(self):
+        self.loop.close()
+        asyncio.set_event_loop(None)
+
+    def test_ack(self):
+        future = Future()
+        self.tracker.expect(1, time.perf_counter() - 0.02, future)
+        self.tracker.expect(2, time.perf_counter())
+
+        result = self.tracker.ack(1)
+        self.assertIs(future.result(0), result)
+        self.assertTrue(result.acked)
+        self.assertGreaterEqual(result.latency, 0.02)
+        self.assertIsNone(self.tracker.ack(1))
+
+        result = self.tracker.ack(2, 'unknown pattern')
+        self.assertFalse(result.acked)
+        self.assertEqual(result.error, 'unknown pattern')
+
+        status = self.tracker.status()
+        self.assertEqual((status['acked'], status['failed'], status['pending']),
+                         (1, 1, 0))
+        self.assertEqual(status['latency']['count'], 2)
+
+    def test_written(self):
+        # time spent waiting to be written is not the client's latency
+        self.tracker.expect(1, time.perf_counter() - 10)
+        self.tracker.written(1)
+        self.assertLess(self.tracker.ack(1).latency, 1)
+        self.tracker.written(1)  # no longer awaited
+
+    def test_timeout(self):
+        future = Future()
+        self.tracker.expect(1, time.perf_counter(), future, timeout=0.01)
+        self.loop.run_until_complete(asyncio.sleep(0.02))
+        self.assertEqual(future.result(0), Ack(False, error='timed out'))
+        self.assertEqual(self.tracker.counts['timed_out'], 1)
+
+    def test_close(self):
+        futures = [Future(), Future()]
+        for message_id, future in enumerate(futures):
+            self.tracker.expect(message_id, time.perf_counter(), future)
+        self.tracker.fail(0, 'not delivered')
+        self.tracker.close()
+
+        self.assertEqual([f.result(0).error for f in futures],
+                         ['not delivered', 'disconnected'])
+        self.assertEqual(self.tracker.status()['pending'], 0)
+        self.assertEqual(self.tracker.latency.count, 0)
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,42 @@
+import unittest
+import time
+
+from webcandy.cache import TTLCache
+
+
+class TestTTLCache(unittest.TestCase):
+    """
+    Tests for TTLCache class.
+    """
+
+    def test_get_set(self):
+        cache = TTLCache(2, 60)
+        self.assertIsNone(cache.get('a'))
+        cache.set('a', 1)
+        self.assertEqual(cache.get('a'), 1)
+        self.assertDictEqual(cache.stats(), {'size': 1, 'hits': 1,
+                                             'misses': 1})
+
+    def test_lru_eviction(self):
+        cache = TTLCache(2, 60)
+        cache.set('a', 1)
+        cache.set('b', 2)
+        cache.get('a')  # 'b' is now least recently used
+        cache.set('c', 3)
+        self.assertEqual(cache.get('a'), 1)
+        self.assertIsNone(cache.get('b'))
+        self.assertEqual(cache.get('c'), 3)
+
+    def test_expiry(self):
+        cache = TTLCache(2, 60)
+        cache.set('a', 1, ttl=0.01)
+        cache.set('b', 2, ttl=-1)  # already expired, never stored
+        self.assertEqual(len(cache), 1)
+        time.sleep(0.02)
+        self.assertIsNone(cache.get('a'))
+        self.assertEqual(len(cache), 0)
+
+    def test_disabled(self):
+        cache = TTLCache(0, 60)
+        cache.set('a', 1)
+        self.assertIsNone(cache.get('a'))
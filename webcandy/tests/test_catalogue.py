@@ -0,0 +1,56 @@
+import unittest
+
+from marshmallow import ValidationError
+
+from webcandy.catalogue import Catalogue, catalogue_hash
+
+
+class TestCatalogue(unittest.TestCase):
+    """
+    Tests for Catalogue class.
+    """
+
+    patterns = [{'name': 'Off', 'type': 'static', 'args': []},
+                {'name': 'Fade', 'type': 'dynamic', 'args': ['color_list'],
+                 'default_speed': 1}]
+
+    def setUp(self):
+        self.catalogue = Catalogue(8, 60)
+
+    def test_hash(self):
+        reordered = [{'args': [], 'type': 'static', 'name': 'Off'}]
+        self.assertEqual(catalogue_hash(self.patterns[:1]),
+                         catalogue_hash(reordered))
+        self.assertNotEqual(catalogue_hash(self.patterns),
+                            catalogue_hash(self.patterns[::-1]))
+
+    def test_add(self):
+        patterns_hash, patterns = self.catalogue.add(self.patterns)
+        # default_speed is normalized to a float by validation
+        self.assertEqual(patterns[1]['default_speed'], 1.0)
+        self.assertEqual(patterns_hash, catalogue_hash(patterns))
+
+        # the same list is shared, whether sent as is or as validated
+        self.assertIs(self.catalogue.add(self.patterns)[1], patterns)
+        self.assertIs(self.catalogue.add(patterns)[1], patterns)
+        self.assertIs(self.catalogue.resolve(
+            {'patterns_hash': patterns_hash})[1], patterns)
+
+    def test_invalid(self):
+        self.assertRaises(ValidationError, self.catalogue.add,
+                          [{'name': 'Off', 'type': 'other', 'args': []}])
+        self.assertRaises(KeyError, self.catalogue.resolve,
+                          {'patterns_hash': 'unknown'})
+
+    def test_apply(self):
+        base_hash, _ = self.catalogue.add(self.patterns)
+        changed = {'name': 'Fade', 'type': 'dynamic', 'args': []}
+        added = {'name': 'Solid', 'type': 'static', 'args': ['color']}
+
+        patterns_hash, patterns = self.catalogue.resolve({
+            'patterns_base': base_hash,
+            'patterns_diff': {'add': [changed, added], 'remove': ['Off']}})
+        self.assertListEqual(patterns, [changed, added])
+        self.assertEqual(self.catalogue.get(patterns_hash),
+                         (patterns_hash, patterns))
+        self.assertRaises(KeyError, self.catalogue.apply, 'unknown')
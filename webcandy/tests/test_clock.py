@@ -0,0 +1,54 @@
+import unittest
+
+from webcandy.clock import ClockEstimate
+
+
+class TestClockEstimate(unittest.TestCase):
+    """
+    Tests for ClockEstimate class.
+    """
+
+    @staticmethod
+    def probe(clock: ClockEstimate, sent: float, offset: float,
+              there: float, back: float) -> None:
+        """
+        Record a probe sent at a server time to a client whose clock is
+        ``offset`` seconds ahead, taking ``there`` and ``back`` seconds each
+        way and answered straight away.
+        """
+        received = sent + there + offset
+        clock.add(sent, received, received, sent + there + back)
+
+    def test_estimate(self):
+        clock = ClockEstimate(samples=3)
+        self.assertIsNone(clock.offset)
+        self.assertIsNone(clock.error)
+        self.assertRaises(ValueError, clock.to_client, 0)
+
+        self.probe(clock, 100, 5, 0.01, 0.01)
+        self.assertAlmostEqual(clock.offset, 5)
+        self.assertAlmostEqual(clock.delay, 0.02)
+        self.assertAlmostEqual(clock.to_client(200), 205)
+
+        # a probe delayed one way is skewed, but loses to the faster one
+        self.probe(clock, 101, 5, 0.2, 0.01)
+        self.assertAlmostEqual(clock.offset, 5)
+        self.assertAlmostEqual(clock.error, 0.01)
+
+        # until the faster one is no longer among the recent samples
+        self.probe(clock, 102, 5, 0.1, 0.1)
+        self.probe(clock, 103, 5, 0.1, 0.1)
+        self.probe(clock, 104, 5, 0.1, 0.1)
+        self.assertAlmostEqual(clock.offset, 5)
+        self.assertAlmostEqual(clock.delay, 0.2)
+        self.assertEqual(clock.status()['samples'], 3)
+
+    def test_inconsistent(self):
+        clock = ClockEstimate()
+        self.assertRaises(ValueError, clock.add, 100, 50, 50, 99)
+        self.assertRaises(ValueError, clock.add, 100, 50, 49, 101)
+        self.assertIsNone(clock.offset)
+
+
+if __name__ == '__main__':
+    unittest.main()
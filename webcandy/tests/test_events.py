@@ -0,0 +1,53 @@
+import unittest
+import json
+
+from webcandy.events import EventBus, format_event
+
+
+def parse(event: str) -> tuple:
+    """
+    Get the type and data of a serialized event.
+    """
+    lines = dict(line.split(': ', 1) for line in event.strip().split('\n'))
+    return lines['event'], json.loads(lines['data'])
+
+
+class TestEventBus(unittest.TestCase):
+    """
+    Tests for EventBus class.
+    """
+
+    def test_publish(self):
+        bus = EventBus(queue_size=4, max_subscribers=2)
+        with bus.subscribe(1) as first, bus.subscribe(1) as second:
+            self.assertRaises(ValueError, bus.subscribe, 1)
+            other = bus.subscribe(2)
+
+            bus.publish(1, 'connected', {'client_name': 'Left'})
+            for subscription in (first, second):
+                self.assertTupleEqual(
+                    parse(subscription.get(0)),
+                    ('connected', {'client_name': 'Left'}))
+            self.assertIsNone(other.get(0))
+            other.close()
+
+        self.assertFalse(bus.has_subscribers(1))
+        self.assertFalse(bus.has_subscribers(2))
+
+    def test_missed(self):
+        bus = EventBus(queue_size=2)
+        with bus.subscribe(1) as subscription:
+            for i in range(5):
+                bus.publish(1, 'disconnected', {'client_name': str(i)})
+
+            self.assertTupleEqual(parse(subscription.get(0)),
+                                  ('missed', {'count': 3}))
+            self.assertEqual(subscription.get(0),
+                             format_event('disconnected', {'client_name': '0'}))
+            self.assertEqual(subscription.get(0),
+                             format_event('disconnected', {'client_name': '1'}))
+            self.assertIsNone(subscription.get(0))
+
+
+if __name__ == '__main__':
+    unittest.main()
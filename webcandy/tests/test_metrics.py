@@ -0,0 +1,123 @@
+import unittest
+import math
+import threading
+
+from webcandy.metrics import Histogram, Metric, Metrics, pseudonym
+
+
+class TestHistogram(unittest.TestCase):
+    """
+    Tests for Histogram class.
+    """
+
+    def test_observe(self):
+        histogram = Histogram((1, 2, 4))
+        self.assertTrue(math.isnan(histogram.quantile(0.5)))
+
+        for value in (0.5, 1, 1.5, 3, 10):
+            histogram.observe(value)
+        self.assertDictEqual(histogram.cumulative(),
+                             {1: 2, 2: 3, 4: 4, float('inf'): 5})
+        self.assertEqual(histogram.count, 5)
+        self.assertEqual(histogram.sum, 16)
+
+    def test_quantile(self):
+        histogram = Histogram((1, 2))
+        for value in (0.5, 1.5, 1.5, 1.5):
+            histogram.observe(value)
+        # a quarter of the values are at most 1, the rest at most 2
+        self.assertEqual(histogram.quantile(0.25), 1)
+        self.assertAlmostEqual(histogram.quantile(0.625), 1.5)
+        self.assertEqual(histogram.status()['buckets'],
+                         {'1': 1, '2': 4, 'inf': 4})
+
+        # values beyond the last bound are reported as the last bound
+        histogram.observe(100)
+        self.assertEqual(histogram.quantile(1), 2)
+
+
+class TestMetrics(unittest.TestCase):
+    """
+    Tests for Metric and Metrics classes.
+    """
+
+    def test_render(self):
+        metrics = Metrics()
+        requests = metrics.counter('requests_total', 'Requests handled',
+                                   ('method',))
+        requests.labels('GET').inc()
+        requests.labels('GET').inc(2)
+        requests.labels('P"O\\ST').inc()
+        seconds = metrics.histogram('seconds', 'Time taken', buckets=(1, 2))
+        seconds.labels().observe(1.5)
+
+        @metrics.collector
+        def collect():
+            clients = Metric('clients', 'gauge', 'Connected clients')
+            clients.labels().set(4)
+            return [clients]
+
+        self.assertEqual(metrics.render(), '\n'.join([
+            '# HELP requests_total Requests handled',
+            '# TYPE requests_total counter',
+            'requests_total{method="GET"} 3.0',
+            'requests_total{method="P\\"O\\\\ST"} 1.0',
+            '# HELP seconds Time taken',
+            '# TYPE seconds histogram',
+            'seconds_bucket{le="1"} 0',
+            'seconds_bucket{le="2"} 1',
+            'seconds_bucket{le="+Inf"} 1',
+            'seconds_sum 1.5',
+            'seconds_count 1',
+            '# HELP clients Connected clients',
+            '# TYPE clients gauge',
+            'clients 4',
+        ]) + '\n')
+
+        # labels telling processes apart go on every sample
+        self.assertIn('seconds_bucket{pid="1",le="2"} 1',
+                      metrics.render({'pid': '1'}))
+
+    def test_labels(self):
+        metric = Metric('requests_total', 'counter', 'Requests handled',
+                        ('method', 'status'))
+        self.assertIs(metric.labels('GET', 200), metric.labels('GET', '200'))
+        with self.assertRaises(ValueError):
+            metric.labels('GET')
+        with self.assertRaises(ValueError):
+            Metric('requests', 'summary', 'Requests handled')
+
+        metrics = Metrics()
+        metrics.gauge('clients', 'Connected clients')
+        with self.assertRaises(ValueError):
+            metrics.gauge('clients', 'Connected clients')
+
+    def test_threads(self):
+        """
+        Test that updates from several threads are not lost.
+        """
+        counter = Metric('updates_total', 'counter', 'Updates')
+        histogram = Metric('seconds', 'histogram', 'Time taken')
+
+        def update():
+            for _ in range(10000):
+                counter.labels().inc()
+                histogram.labels().observe(0.01)
+
+        threads = [threading.Thread(target=update) for _ in range(4)]
+        for thread in threads:
+            thread.start()
+        for thread in threads:
+            thread.join()
+        self.assertEqual(counter.labels().value, 40000)
+        self.assertEqual(histogram.labels().snapshot().count, 40000)
+
+    def test_pseudonym(self):
+        self.assertRegex(pseudonym(1, 'key'), '^[0-9a-f]{12}$')
+        self.assertEqual(pseudonym(1, 'key'), pseudonym(1, 'key'))
+        self.assertNotEqual(pseudonym(1, 'key'), pseudonym(2, 'key'))
+        self.assertNotEqual(pseudonym(1, 'key'), pseudonym(1, 'other key'))
+
+
+if __name__ == '__main__':
+    unittest.main()
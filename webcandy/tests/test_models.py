@@ -0,0 +1,87 @@
+import unittest
+
+from unittest import mock
+from flask import Flask
+from sqlalchemy import event
+
+from webcandy import models
+from webcandy.extensions import db
+from webcandy.models import User, token_cache, user_cache
+
+
+class TestUser(unittest.TestCase):
+    """
+    Tests for User class and its token and user caches.
+    """
+
+    def setUp(self):
+        app = Flask(__name__)
+        app.config['SQLALCHEMY_DATABASE_URI'] = 'sqlite://'
+        app.config['SQLALCHEMY_TRACK_MODIFICATIONS'] = False
+        db.init_app(app)
+
+        self.context = app.app_context()
+        self.context.push()
+        db.create_all()
+        user = User(user_id=1, username='testuser')
+        user.set_password('old')
+        db.session.add(user)
+        db.session.commit()
+        self.token = user.generate_auth_token().decode()
+
+        token_cache.clear()
+        user_cache.clear()
+        db.session.remove()
+
+        self.queries = 0
+        event.listen(db.engine, 'before_cursor_execute', self.count_query)
+
+    def tearDown(self):
+        event.remove(db.engine, 'before_cursor_execute', self.count_query)
+        # other tests have users of the same ID in other databases
+        token_cache.clear()
+        user_cache.clear()
+        db.session.remove()
+        self.context.pop()
+
+    def count_query(self, *_):
+        self.queries += 1
+
+    def test_cached(self):
+        user = User.get_user(self.token)
+        self.assertEqual(user.username, 'testuser')
+        self.assertEqual(self.queries, 1)
+        db.session.remove()
+
+        # the same token skips both verification and the query
+        with mock.patch.object(models.Serializer, 'loads') as loads:
+            user = User.get_user(self.token)
+        loads.assert_not_called()
+        self.assertEqual(self.queries, 1)
+        self.assertEqual(user.username, 'testuser')
+        # and the cached row is merged into the current session
+        self.assertIn(user, db.session)
+        self.assertTrue(user.check_password('old'))
+
+    def test_invalidate(self):
+        user = User.get_user(self.token)
+        self.assertIsNotNone(user_cache.get(1))
+
+        user.set_password('new')
+        db.session.commit()
+        self.assertIsNone(user_cache.get(1))
+
+        db.session.remove()
+        user = User.get_user(self.token)
+        self.assertTrue(user.check_password('new'))
+        self.assertEqual(self.queries, 3)  # select, update, select
+
+    def test_invalid(self):
+        self.assertIsNone(User.get_user('invalid'))
+        self.assertIsNone(User.get_user(
+            User(user_id=1).generate_stream_token().decode()))
+        self.assertEqual(len(token_cache), 0)
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,93 @@
+import unittest
+import asyncio
+
+from concurrent.futures import Future
+
+from webcandy.outbox import Outbox, LIGHTING
+
+
+class TestOutbox(unittest.TestCase):
+    """
+    Tests for Outbox class.
+    """
+
+    class SlowProtocol:
+        """
+        Protocol that only completes sends once released.
+        """
+        remote_address = ('127.0.0.1', 0)
+
+        def __init__(self):
+            self.sent = []
+            self.released = asyncio.Event()
+
+        async def send(self, message):
+            await self.released.wait()
+            self.sent.append(message)
+
+    def run(self, result=None):
+        self.loop = asyncio.new_event_loop()
+        asyncio.set_event_loop(self.loop)
+        try:
+            return super().run(result)
+        finally:
+            self.loop.close()
+            asyncio.set_event_loop(None)
+
+    def test_invalid_arguments(self):
+        self.assertRaises(ValueError, Outbox, None, 0)
+        self.assertRaises(ValueError, Outbox, None, 4, 'random')
+
+    def test_coalesce(self):
+        async def go():
+            protocol = self.SlowProtocol()
+            outbox = Outbox(protocol)
+            futures = [Future() for _ in range(4)]
+
+            outbox.put('first', futures[0], LIGHTING)
+            await asyncio.sleep(0)  # writer picks up 'first' and blocks
+            for message, future in zip(['a', 'b', 'c'], futures[1:]):
+                outbox.put(message, future, LIGHTING)
+
+            protocol.released.set()
+            while len(outbox):
+                await asyncio.sleep(0)
+            await asyncio.sleep(0)
+
+            self.assertListEqual(protocol.sent, ['first', 'c'])
+            self.assertListEqual([f.result() for f in futures],
+                                 [True, False, False, True])
+            self.assertDictEqual(outbox.stats(), {'queued': 0, 'sent': 2,
+                                                  'coalesced': 2, 'dropped': 0})
+            outbox.close()
+
+        self.loop.run_until_complete(go())
+
+    def test_drop_policies(self):
+        async def go(policy, expected):
+            protocol = self.SlowProtocol()
+            outbox = Outbox(protocol, maxsize=2, drop_policy=policy)
+
+            outbox.put('first')
+            await asyncio.sleep(0)  # writer picks up 'first' and blocks
+            for message in ['a', 'b', 'c']:
+                outbox.put(message)
+            self.assertEqual(outbox.dropped, 1)
+
+            protocol.released.set()
+            while len(outbox):
+                await asyncio.sleep(0)
+            await asyncio.sleep(0)
+
+            self.assertListEqual(protocol.sent, expected)
+            outbox.close()
+
+        self.loop.run_until_complete(go('oldest', ['first', 'b', 'c']))
+        self.loop.run_until_complete(go('newest', ['first', 'a', 'b']))
+
+    def test_closed(self):
+        outbox = Outbox(self.SlowProtocol())
+        outbox.close()
+        future = Future()
+        outbox.put('message', future)
+        self.assertFalse(future.result())
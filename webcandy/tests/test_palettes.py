@@ -0,0 +1,135 @@
+import unittest
+import tempfile
+
+from webcandy import palettes
+from webcandy.storage import user_data, JSONBackend
+
+
+class TestParsers(unittest.TestCase):
+    """
+    Tests for the palette parsers.
+    """
+
+    def test_parse_jsonl(self):
+        lines = ['{"name": "red", "color": "#ff0000"}\n',
+                 '\n',
+                 '{"name": "warm", "color_list": ["#ff0000", "#ffaa00"]}\n',
+                 '{"name": "broken"\n']
+        entries = list(palettes.parse_jsonl(lines))
+        self.assertEqual(entries[0],
+                         palettes.Entry(1, 'colors', 'red', '#ff0000'))
+        self.assertEqual(entries[1], palettes.Entry(
+            3, 'color_lists', 'warm', ['#ff0000', '#ffaa00']))
+        self.assertEqual(entries[2].line, 4)
+        self.assertIsNotNone(entries[2].error)
+
+    def test_parse_csv(self):
+        lines = ['kind,name,colors\n',
+                 'color,red,#ff0000\n',
+                 'color_list,warm,#ff0000,#ffaa00\n',
+                 'color,two,#ff0000,#00ff00\n',
+                 'shade,grey,#888888\n']
+        entries = list(palettes.parse_csv(lines))
+        self.assertEqual(entries[0],
+                         palettes.Entry(2, 'colors', 'red', '#ff0000'))
+        self.assertEqual(entries[1], palettes.Entry(
+            3, 'color_lists', 'warm', ['#ff0000', '#ffaa00']))
+        self.assertEqual([e.line for e in entries[2:]], [4, 5])
+        self.assertTrue(all(e.error for e in entries[2:]))
+
+    def test_parse_gpl(self):
+        lines = ['GIMP Palette\n',
+                 'Name: Sunset\n',
+                 'Columns: 2\n',
+                 '# comment\n',
+                 '255   0   0\tRed\n',
+                 '255 170   0\n',
+                 '300   0   0\tToo bright\n']
+        entries = list(palettes.parse_gpl(lines))
+        self.assertEqual(entries[0],
+                         palettes.Entry(5, 'colors', 'Red', '#ff0000'))
+        self.assertEqual(entries[1],
+                         palettes.Entry(6, 'colors', 'Sunset 2', '#ffaa00'))
+        self.assertEqual(entries[2].line, 7)
+        self.assertIsNotNone(entries[2].error)
+        self.assertEqual(entries[3].section, 'color_lists')
+        self.assertEqual(entries[3].value, ['#ff0000', '#ffaa00'])
+
+        entries = list(palettes.parse_gpl(['not a palette\n']))
+        self.assertEqual(len(entries), 1)
+        self.assertIsNotNone(entries[0].error)
+
+
+class TestExport(unittest.TestCase):
+    """
+    Tests for the palette exporters, round-tripped through the parsers.
+    """
+
+    data = {'colors': {'red': '#ff0000', 'amber': '#ffaa00'},
+            'color_lists': {'warm': ['#ff0000', '#ffaa00']}}
+
+    def round_trip(self, fmt: str) -> dict:
+        text = ''.join(getattr(palettes, f'export_{fmt}')(self.data))
+        result = dict()
+        for entry in palettes.PARSERS[fmt](text.splitlines(True)):
+            self.assertIsNone(entry.error)
+            result.setdefault(entry.section, dict())[entry.name] = entry.value
+        return result
+
+    def test_jsonl(self):
+        self.assertDictEqual(self.round_trip('jsonl'), self.data)
+
+    def test_csv(self):
+        self.assertDictEqual(self.round_trip('csv'), self.data)
+
+    def test_gpl(self):
+        text = ''.join(palettes.export_gpl('Warm', self.data['colors'].items()))
+        entries = list(palettes.parse_gpl(text.splitlines(True)))
+        self.assertEqual([(e.name, e.value) for e in entries[:2]],
+                         list(self.data['colors'].items()))
+        self.assertEqual(entries[2],
+                         palettes.Entry(entries[2].line, 'color_lists', 'Warm',
+                                        ['#ff0000', '#ffaa00']))
+
+
+class TestImportPalette(unittest.TestCase):
+    """
+    Tests for the import_palette function.
+    """
+
+    def setUp(self):
+        self.tmp = tempfile.TemporaryDirectory()
+        self.backend = user_data.backend
+        user_data.backend = JSONBackend(self.tmp.name)
+        user_data.create(1)
+        user_data.put(1, {'colors': {'red': '#aa0000'}})
+
+    def tearDown(self):
+        user_data.backend = self.backend
+        self.tmp.cleanup()
+
+    def test_import_palette(self):
+        entries = [palettes.Entry(1, 'colors', 'red', '#f00'),
+                   palettes.Entry(2, 'colors', 'green', 'rgb(0, 255, 0)'),
+                   palettes.Entry(3, 'colors', 'bad', 'not a color'),
+                   palettes.Entry(4, error='Invalid line'),
+                   palettes.Entry(5, 'color_lists', 'rg', ['#f00', 'nope']),
+                   palettes.Entry(6, 'color_lists', 'gb', ['#0f0', '#00f']),
+                   palettes.Entry(7, 'colors', '', '#000')]
+        summary, errors = palettes.import_palette(1, entries, batch_size=2)
+
+        self.assertDictEqual(summary, {
+            'colors': {'added': {'green': '#00ff00'},
+                       'modified': {'red': {'old': '#aa0000',
+                                            'new': '#ff0000'}}},
+            'color_lists': {'added': {'gb': ['#00ff00', '#0000ff']}}
+        })
+        self.assertEqual([e['line'] for e in errors], [3, 4, 5, 7])
+        self.assertDictEqual(user_data.load(1), {
+            'colors': {'red': '#ff0000', 'green': '#00ff00'},
+            'color_lists': {'gb': ['#00ff00', '#0000ff']}
+        })
+
+
+if __name__ == '__main__':
+    unittest.main()
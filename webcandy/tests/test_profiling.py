@@ -0,0 +1,106 @@
+import unittest
+import os
+import sys
+import pstats
+import tempfile
+import time
+
+from flask import Flask
+
+from webcandy.profiling import Profiler, collapse
+
+
+def busy(seconds: float) -> None:
+    end = time.perf_counter() + seconds
+    while time.perf_counter() < end:
+        pass
+
+
+class TestProfiler(unittest.TestCase):
+    """
+    Tests for Profiler class.
+    """
+
+    def setUp(self):
+        self.directory = tempfile.TemporaryDirectory()
+
+    def tearDown(self):
+        self.directory.cleanup()
+
+    def make_profiler(self, **config) -> Profiler:
+        app = Flask(__name__)
+        app.config.update(PROFILE_DIR=self.directory.name, PROFILE_RATE=1.0)
+        app.config.update(config)
+        return Profiler(app)
+
+    def profiles(self):
+        return sorted(os.listdir(self.directory.name))
+
+    def test_disabled(self):
+        self.assertFalse(Profiler().enabled)
+        self.assertIsNone(Profiler().begin('Submit'))
+        profiler = self.make_profiler(PROFILE_RATE=0.0)
+        self.assertIsNone(profiler.begin('Submit'))
+
+        app = Flask(__name__)
+        app.config['PROFILE_MODE'] = 'perf'
+        self.assertRaises(ValueError, Profiler, app)
+
+    def test_pstats(self):
+        profiler = self.make_profiler(PROFILE_RESOURCES={'Submit'})
+        with profiler.profile('Submit'):
+            busy(0.01)
+            # nested calls on the same thread are not profiled
+            self.assertIsNone(profiler.begin('Submit'))
+        with profiler.profile('UserData'):
+            busy(0.01)
+
+        profiles = self.profiles()
+        self.assertEqual(len(profiles), 1)
+        self.assertRegex(profiles[0], r'^Submit\.\d+\.\d+\.\d+\.prof$')
+        stats = pstats.Stats(os.path.join(self.directory.name, profiles[0]))
+        self.assertIn('busy', {func[2] for func in stats.stats})
+
+    def test_collapsed(self):
+        profiler = self.make_profiler(PROFILE_MODE='collapsed')
+        with profiler.profile('Submit'):
+            busy(0.05)
+
+        profiles = self.profiles()
+        self.assertEqual(len(profiles), 1)
+        self.assertTrue(profiles[0].endswith('.collapsed'))
+        with open(os.path.join(self.directory.name, profiles[0])) as file:
+            lines = file.read().splitlines()
+        self.assertTrue(lines)
+        self.assertTrue(any('busy (test_profiling.py:' in line
+                            for line in lines))
+        for line in lines:
+            self.assertRegex(line, r' \d+$')
+
+    def test_keep(self):
+        profiler = self.make_profiler(PROFILE_KEEP=2)
+        for _ in range(4):
+            with profiler.profile('Submit'):
+                pass
+        with profiler.profile('UserData'):
+            pass
+
+        # the oldest of each name are deleted, by sequence number
+        sequences = {}
+        for profile in self.profiles():
+            name, _, _, sequence, _ = profile.split('.')
+            sequences.setdefault(name, []).append(int(sequence))
+        last, = sequences['UserData']
+        self.assertListEqual(sorted(sequences['Submit']), [last - 2, last - 1])
+
+    def test_collapse(self):
+        def inner():
+            return collapse(sys._getframe())
+
+        stack = inner().split(';')
+        self.assertTrue(stack[-1].startswith('inner (test_profiling.py:'))
+        self.assertTrue(stack[-2].startswith('test_collapse '))
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,116 @@
+import unittest
+import json
+
+from webcandy import protocol
+from webcandy.protocol import Message, BINARY, JSON
+
+
+class TestProtocol(unittest.TestCase):
+    """
+    Tests for message encodings.
+    """
+
+    def test_negotiate(self):
+        self.assertEqual(protocol.negotiate(None), JSON)
+        self.assertEqual(protocol.negotiate(['msgpack', 'binary']), BINARY)
+        self.assertEqual(protocol.negotiate(['msgpack']), JSON)
+
+    def test_pack_lighting(self):
+        data = {'pattern': 'Fade', 'strobe': True, 'speed': 7,
+                'color': '#aa00aa', 'color_list': ['#ff0000', '#00ff00']}
+        frame = protocol.pack_lighting(data)
+        self.assertLess(len(frame), len(json.dumps(data)))
+        self.assertDictEqual(protocol.unpack_lighting(frame), data)
+
+        data = {'pattern': 'Off'}
+        self.assertDictEqual(protocol.decode(protocol.pack_lighting(data)),
+                             data)
+
+    def test_pack_exact(self):
+        # speeds and strobe arrive exactly as they were sent
+        for data in ({'pattern': 'Fade', 'speed': 0.1, 'strobe': False},
+                     {'pattern': 'Fade', 'speed': 1 / 3, 'strobe': True}):
+            frame = protocol.pack_lighting(data)
+            self.assertDictEqual(protocol.unpack_lighting(frame), data)
+
+        # strobe values other than booleans are sent as JSON
+        self.assertIsNone(protocol.pack_lighting({'pattern': 'Fade',
+                                                  'strobe': 1}))
+
+    def test_pack_unsupported(self):
+        self.assertIsNone(protocol.pack_lighting({'pattern': 'Fade',
+                                                  'other': 1}))
+        self.assertIsNone(protocol.pack_lighting({'pattern': 'Solid',
+                                                  'color': 'red'}))
+        self.assertIsNone(protocol.pack_lighting({'strobe': True}))
+
+    def test_pack_overflow(self):
+        # speeds too large for a double are sent as JSON
+        data = {'pattern': 'Fade', 'speed': 10 ** 400}
+        self.assertIsNone(protocol.pack_lighting(data))
+        self.assertEqual(Message(data).encode(BINARY), json.dumps(data))
+
+    def test_unpack_invalid(self):
+        frame = protocol.pack_lighting({'pattern': 'Solid',
+                                        'color': '#123456'})
+        self.assertRaises(ValueError, protocol.unpack_lighting, frame[:-1])
+        self.assertRaises(ValueError, protocol.unpack_lighting, b'\x02' +
+                          frame[1:])
+
+    def test_message(self):
+        message = Message({'pattern': 'Off'})
+        self.assertIsInstance(message.encode(BINARY), bytes)
+        self.assertIs(message.encode(BINARY), message.encode(BINARY))
+
+        # falls back to JSON when the binary layout can't hold the message
+        message = Message(text='{"pattern": "Off", "other": 1}')
+        self.assertEqual(message.encode(BINARY), message.encode(JSON))
+        self.assertDictEqual(message.data, {'pattern': 'Off', 'other': 1})
+
+    def test_clock_sync(self):
+        probe = json.loads(protocol.clock_probe(100.5))
+        self.assertDictEqual(probe, {'type': protocol.CLOCK_SYNC,
+                                     'server_time': 100.5})
+
+        reply = dict(probe, received=105.5, sent=105.6)
+        self.assertTupleEqual(protocol.parse_clock_reply(reply),
+                              (100.5, 105.5, 105.6))
+        self.assertRaises(ValueError, protocol.parse_clock_reply, probe)
+        self.assertRaises(ValueError, protocol.parse_clock_reply,
+                          dict(reply, sent='later'))
+
+    def test_message_id(self):
+        message = Message({'pattern': 'Off'})
+        self.assertDictEqual(protocol.decode(message.encode(JSON)),
+                             {'pattern': 'Off'})
+        for encoding in (JSON, BINARY):
+            self.assertDictEqual(
+                protocol.decode(message.encode(encoding, True)),
+                {'pattern': 'Off', 'id': message.message_id})
+        self.assertIsInstance(message.encode(BINARY, True), bytes)
+        self.assertNotEqual(Message({}).message_id, message.message_id)
+
+    def test_trace_id(self):
+        data = {'pattern': 'Off', 'trace_id': '0123456789abcdef'}
+        frame = protocol.pack_lighting(data)
+        self.assertEqual(len(frame), protocol.HEADER.size + 3 + 8)
+        self.assertDictEqual(protocol.unpack_lighting(frame), data)
+        message = Message(data)
+        self.assertDictEqual(protocol.decode(message.encode(BINARY, True)),
+                             dict(data, id=message.message_id))
+
+        # trace IDs of another length are sent as JSON
+        self.assertIsNone(protocol.pack_lighting(
+            {'pattern': 'Off', 'trace_id': 'abcd'}))
+        self.assertIsInstance(
+            Message({'pattern': 'Off', 'trace_id': 'xyz'}).encode(BINARY), str)
+
+    def test_parse_ack(self):
+        self.assertTupleEqual(protocol.parse_ack({'type': 'ack', 'id': 3}),
+                              (3, None))
+        self.assertTupleEqual(
+            protocol.parse_ack({'type': 'ack', 'id': 3, 'error': 'nope'}),
+            (3, 'nope'))
+        self.assertRaises(ValueError, protocol.parse_ack, {'type': 'ack'})
+        self.assertRaises(ValueError, protocol.parse_ack,
+                          {'type': 'ack', 'id': 3, 'error': 1})
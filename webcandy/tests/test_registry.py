@@ -0,0 +1,310 @@
+import unittest
+import os
+import time
+import asyncio
+import socket
+import tempfile
+import threading
+import urllib.error
+import urllib.request
+
+from unittest.mock import patch
+
+from webcandy.events import event_bus, format_event
+from webcandy.config import Config
+from webcandy.proxy import serve_commands, serve_metrics
+from webcandy.registry import (
+    Registry, SQLiteRegistry, IPCRegistry, create_registry
+)
+from webcandy.server import ClientManager, ProxyServer, clients, proxy_server
+
+
+class TestSQLiteRegistry(unittest.TestCase):
+    """
+    Tests for SQLiteRegistry class.
+    """
+
+    def setUp(self):
+        self.tmp = tempfile.TemporaryDirectory()
+        path = os.path.join(self.tmp.name, 'registry.db')
+        # two registries standing in for two processes
+        self.owner = SQLiteRegistry(path, owner=os.getpid())
+        self.worker = SQLiteRegistry(path, owner=-1)
+
+    def tearDown(self):
+        self.tmp.cleanup()
+
+    def test_lookup(self):
+        patterns = [{'name': 'off', 'type': 'static', 'args': []}]
+        self.owner.add(1, 'MyClient', patterns)
+        self.assertTrue(self.owner.flush(1))
+
+        self.assertListEqual(self.worker.available_clients(1), ['MyClient'])
+        self.assertListEqual(self.worker.get_patterns(1, 'MyClient'), patterns)
+        self.assertIsNone(self.worker.get_patterns(1, 'OtherClient'))
+
+        self.owner.remove(1, 'MyClient')
+        self.assertTrue(self.owner.flush(1))
+        self.assertListEqual(self.worker.available_clients(1), [])
+
+    def test_status(self):
+        self.owner.add(1, 'MyClient', [])
+        for latency in range(10):
+            self.owner.update_status(1, 'MyClient', {'latency': latency})
+        # statuses of clients that are gone are not written
+        self.owner.update_status(1, 'OtherClient', {'latency': 0})
+        self.assertTrue(self.owner.flush(1))
+
+        self.assertDictEqual(self.worker.get_status(1, 'MyClient'),
+                             {'latency': 9})
+        self.assertIsNone(self.worker.get_status(1, 'OtherClient'))
+
+    def test_publish(self):
+        delivered = []
+
+        async def go():
+            task = asyncio.ensure_future(self.owner.serve(
+                lambda *args: delivered.append(args)))
+            await asyncio.sleep(0)  # stale entries are cleared on start
+
+            self.owner.add(1, 'MyClient', [])
+            self.assertTrue(self.owner.flush(1))
+            self.assertDictEqual(
+                self.worker.publish(1, ['MyClient', 'OtherClient'], '{}',
+                                    'key'),
+                {'MyClient': True, 'OtherClient': False})
+
+            while not delivered:
+                await asyncio.sleep(0.01)
+            task.cancel()
+            await asyncio.sleep(0)
+
+        loop = asyncio.new_event_loop()
+        loop.run_until_complete(asyncio.wait_for(go(), 1))
+        loop.close()
+
+        self.assertListEqual(delivered, [(1, ['MyClient'], '{}', 'key')])
+
+
+class TestIPCRegistry(unittest.TestCase):
+    """
+    Tests for IPCRegistry class, against the webcandy-proxy command channel.
+    """
+
+    class FakeProtocol:
+        remote_address = ('127.0.0.1', 0)
+
+        def __init__(self):
+            self.sent = []
+
+        async def send(self, message):
+            self.sent.append(message)
+
+    def setUp(self):
+        self.tmp = tempfile.TemporaryDirectory()
+        path = os.path.join(self.tmp.name, 'proxy.sock')
+
+        self.loop = asyncio.new_event_loop()
+        self.loop.run_until_complete(serve_commands(path))
+        self.thread = threading.Thread(target=self.loop.run_forever,
+                                       daemon=True)
+        self.thread.start()
+
+        self.protocol = self.FakeProtocol()
+        self.client = ClientManager.Client(
+            -1, 'MyClient', [{'name': 'off'}], self.protocol)
+        ClientManager.clients[-1]['MyClient'] = self.client
+
+        self.registry = IPCRegistry(path, timeout=1)
+
+    def tearDown(self):
+        async def close():
+            self.client.outbox.close()
+            await asyncio.sleep(0)  # let the writer task finish
+
+        asyncio.run_coroutine_threadsafe(close(), self.loop).result(1)
+        del ClientManager.clients[-1]
+        self.loop.call_soon_threadsafe(self.loop.stop)
+        self.thread.join()
+        self.tmp.cleanup()
+
+    def test_lookup(self):
+        self.assertListEqual(self.registry.available_clients(-1), ['MyClient'])
+        self.assertListEqual(self.registry.get_patterns(-1, 'MyClient'),
+                             [{'name': 'off'}])
+        self.assertIsNone(self.registry.get_patterns(-1, 'OtherClient'))
+
+    def test_publish(self):
+        self.assertDictEqual(
+            self.registry.publish(-1, ['MyClient', 'OtherClient'], '{}'),
+            {'MyClient': True, 'OtherClient': False})
+        asyncio.run_coroutine_threadsafe(asyncio.sleep(0.01),
+                                         self.loop).result(1)
+        self.assertListEqual(self.protocol.sent, ['{}'])
+
+    def test_metrics(self):
+        server = asyncio.run_coroutine_threadsafe(
+            serve_metrics('127.0.0.1', 0), self.loop).result(1)
+        url = f'http://127.0.0.1:{server.sockets[0].getsockname()[1]}/metrics'
+
+        with patch.object(Config, 'METRICS_TOKEN', 'scrape'):
+            with self.assertRaises(urllib.error.HTTPError) as context:
+                urllib.request.urlopen(url, timeout=1)
+            self.assertEqual(context.exception.code, 401)
+
+            request = urllib.request.Request(
+                url, headers={'Authorization': 'Bearer scrape'})
+            with urllib.request.urlopen(request, timeout=1) as response:
+                text = response.read().decode()
+        self.assertIn('# TYPE webcandy_clients gauge', text)
+        self.assertIn(f'pid="{os.getpid()}"', text)
+        self.loop.call_soon_threadsafe(server.close)
+
+    def test_unreachable(self):
+        registry = IPCRegistry(os.path.join(self.tmp.name, 'missing.sock'))
+        self.assertListEqual(registry.available_clients(-1), [])
+        self.assertDictEqual(registry.publish(-1, ['MyClient'], '{}'),
+                             {'MyClient': False})
+        self.assertRaises(ConnectionError, registry.forward,
+                          {'op': 'timelines', 'user_id': -1})
+
+    def fake_proxy(self, name: str, *replies: bytes) -> list:
+        """
+        Serve a command channel at another path, reading a request from each
+        connection and answering it with the next reply, if any.
+        :return: the requests received, once they are
+        """
+        path = os.path.join(self.tmp.name, f'{name}.sock')
+        server = socket.socket(socket.AF_UNIX, socket.SOCK_STREAM)
+        server.bind(path)
+        server.listen()
+        received = []
+
+        def serve():
+            for reply in replies:
+                conn, _ = server.accept()
+                with conn, conn.makefile('rwb') as file:
+                    received.append(file.readline())
+                    if reply:
+                        file.write(reply)
+                        file.flush()
+                    else:
+                        file.readline()  # wait for the client to give up
+            server.close()
+
+        threading.Thread(target=serve, daemon=True).start()
+        self.fake = IPCRegistry(path, timeout=0.1)
+        return received
+
+    def test_no_resend(self):
+        # a request that was sent is not sent again if its reply is lost,
+        # since it may have been acted on
+        received = self.fake_proxy('lost', b'', b'{}\n')
+        self.assertDictEqual(self.fake.publish(-1, ['MyClient'], '{}'),
+                             {'MyClient': False})
+        self.assertEqual(len(received), 1)
+
+        # and malformed replies count as lost
+        received = self.fake_proxy('malformed', b'not json\n', b'{}\n')
+        self.assertRaises(ConnectionError, self.fake.forward,
+                          {'op': 'timelines', 'user_id': -1})
+        self.assertEqual(len(received), 1)
+
+    def test_reconnect(self):
+        self.assertListEqual(self.registry.available_clients(-1), ['MyClient'])
+        # the proxy closing the connection, e.g. when restarting, is noticed
+        # before a request is sent on it
+        self.registry._local.sock.shutdown(socket.SHUT_RD)
+        self.assertListEqual(self.registry.available_clients(-1), ['MyClient'])
+
+    def test_subscribe(self):
+        subscription = self.registry.subscribe(-1, 0.05)
+        try:
+            self.loop.call_soon_threadsafe(event_bus.publish, -1, 'connected',
+                                           {'client_name': 'MyClient'})
+            self.assertEqual(subscription.get(),
+                             format_event('connected',
+                                          {'client_name': 'MyClient'}))
+            self.assertIsNone(subscription.get())  # keepalive
+        finally:
+            subscription.close()
+
+        for _ in range(100):
+            if not event_bus.has_subscribers(-1):
+                break
+            time.sleep(0.01)
+        self.assertFalse(event_bus.has_subscribers(-1))
+
+        registry = IPCRegistry(os.path.join(self.tmp.name, 'missing.sock'))
+        self.assertRaises(ConnectionError, registry.subscribe, -1, 0.05)
+        self.assertRaises(NotImplementedError, SQLiteRegistry(
+            os.path.join(self.tmp.name, 'registry.db')).subscribe, -1, 0.05)
+
+    def test_forward(self):
+        """
+        Test that a process not running the proxy server schedules timelines
+        through it.
+        """
+        server = ProxyServer()  # never started, like another worker's
+        old_registry = clients.registry
+        clients.registry = self.registry
+        try:
+            timeline = server.schedule(-1, [(60, {'pattern': 'Off'}, None)])
+            self.assertEqual(timeline['cues'], 1)
+            self.assertListEqual(
+                [t['timeline_id'] for t in server.timelines(-1)],
+                [timeline['timeline_id']])
+            self.assertFalse(server.cancel_timeline(
+                -2, timeline['timeline_id']))
+            self.assertTrue(server.cancel_timeline(
+                -1, timeline['timeline_id']))
+            self.assertListEqual(server.timelines(-1), [])
+            self.assertRaises(ValueError, server.schedule, -1,
+                              [(60, {'pattern': 'Off'})])
+
+            clients.registry = Registry()
+            self.assertRaises(NotImplementedError, server.schedule, -1,
+                              [(60, {'pattern': 'Off'}, None)])
+        finally:
+            clients.registry = old_registry
+
+    def test_forward_synced(self):
+        """
+        Test that a process not running the proxy server sends synchronized
+        configurations through it.
+        """
+        worker = ProxyServer()  # never started, like another worker's
+        old = clients.registry, proxy_server.running, proxy_server.loop
+        # the proxy server runs on the command channel's loop, and looks up
+        # clients in its own process only
+        clients.registry = Registry()
+        clients.registry.forward = self.registry.forward
+        proxy_server.running, proxy_server.loop = True, self.loop
+        try:
+            start = time.time() + 0.01
+            start_at, futures = worker.broadcast_synced(
+                -1, {'pattern': 'Off'}, ['MyClient', 'OtherClient'], start)
+            self.assertEqual(start_at, start)
+            self.assertTrue(futures['MyClient'].result(1))
+            self.assertIsNone(futures['OtherClient'])
+
+            for _ in range(100):
+                if self.protocol.sent:
+                    break
+                time.sleep(0.01)
+            self.assertListEqual(self.protocol.sent, ['{"pattern": "Off"}'])
+            self.assertGreaterEqual(time.time(), start - 0.01)
+        finally:
+            clients.registry = old[0]
+            proxy_server.running, proxy_server.loop = old[1:]
+
+
+class TestCreateRegistry(unittest.TestCase):
+    """
+    Tests for create_registry function.
+    """
+
+    def test_create_registry(self):
+        self.assertIs(type(create_registry({})), Registry)
+        self.assertRaises(ValueError, create_registry,
+                          {'CLIENT_REGISTRY': 'redis'})
@@ -0,0 +1,84 @@
+import unittest
+
+from webcandy import render
+
+try:
+    import numpy as np
+except ImportError:
+    np = None
+
+
+@unittest.skipIf(np is None, 'NumPy is not installed')
+class TestRenderer(unittest.TestCase):
+    """
+    Tests for Renderer class.
+    """
+
+    def setUp(self):
+        self.renderer = render.Renderer()
+
+    def test_static(self):
+        frame = self.renderer.frame({'pattern': 'SolidColor',
+                                     'color': '#aa00aa'}, 4)
+        self.assertEqual(frame.shape, (4, 3))
+        self.assertListEqual(render.to_hex(frame), ['#aa00aa'] * 4)
+
+        frame = self.renderer.frame({'pattern': 'Stripes',
+                                     'color_list': ['#ff0000', '#0000ff']}, 3)
+        self.assertListEqual(render.to_hex(frame),
+                             ['#ff0000', '#0000ff', '#ff0000'])
+
+        self.assertListEqual(
+            render.to_hex(self.renderer.frame({'pattern': 'Off'}, 2)),
+            ['#000000'] * 2)
+
+    def test_fade(self):
+        config = {'pattern': 'Fade', 'speed': 1,
+                  'color_list': ['#000000', '#fe0000']}
+        frames = self.renderer.frames(config, 1, 3, fps=2)
+        self.assertListEqual([render.to_hex(f)[0] for f in frames],
+                             ['#000000', '#7f0000', '#fe0000'])
+
+    def test_still(self):
+        # a speed of 0 holds the pattern at its start
+        config = {'pattern': 'Fade', 'speed': 0,
+                  'color_list': ['#000000', '#fe0000']}
+        self.assertEqual(self.renderer.period(config, 60), 1)
+        frames = self.renderer.frames(config, 1, 3, fps=2)
+        self.assertListEqual([render.to_hex(f)[0] for f in frames],
+                             ['#000000'] * 3)
+
+    def test_rainbow(self):
+        frame = self.renderer.frame({'pattern': 'Rainbow'}, 3)
+        self.assertListEqual(render.to_hex(frame),
+                             ['#ff0000', '#00ff00', '#0000ff'])
+
+    def test_strobe(self):
+        config = {'pattern': 'SolidColor', 'color': '#ffffff', 'strobe': True}
+        lit, dark = self.renderer.frame(config, 1, 0, 20), \
+            self.renderer.frame(config, 1, 1, 20)
+        self.assertListEqual(render.to_hex(lit), ['#ffffff'])
+        self.assertListEqual(render.to_hex(dark), ['#000000'])
+
+    def test_cache(self):
+        config = {'pattern': 'Fade', 'speed': 2,
+                  'color_list': ['#ff0000', '#00ff00']}
+        self.assertEqual(self.renderer.period(config, 60), 60)
+
+        first = self.renderer.frame(config, 8, 5)
+        self.assertIs(self.renderer.frame(config, 8, 65), first)
+        self.assertFalse(first.flags.writeable)
+
+    def test_invalid(self):
+        self.assertRaises(ValueError, self.renderer.frame,
+                          {'pattern': 'Unknown'}, 4)
+        self.assertRaises(ValueError, self.renderer.frame,
+                          {'pattern': 'SolidColor', 'color': 'red'}, 4)
+        self.assertRaises(ValueError, self.renderer.frame,
+                          {'pattern': 'Fade', 'color_list': ['#ffffff']}, 4)
+
+    def test_source(self):
+        source = self.renderer.source({'pattern': 'Rainbow'}, 3, 60)
+        self.assertEqual(bytes(source()), b'\xff\x00\x00\x00\xff\x00'
+                                          b'\x00\x00\xff')
+        self.assertEqual(len(source()), 9)
@@ -1,7 +1,13 @@
 import unittest
+import os
 import json
 
-from webcandy.app import create_app
+from concurrent.futures import Future
+from unittest import mock
+
+from webcandy import routes
+from webcandy.app import create_app, register_metrics
+from webcandy.events import event_bus, stream_slots
 
 
 class TestAPI(unittest.TestCase):
@@ -82,3 +88,203 @@ class TestAPI(unittest.TestCase):
                 "#0000ff",
                 "#8b00ff"
             ])
+
+    def test_render_preview(self):
+        """
+        Test the /api/render/preview URI.
+        """
+        headers = {'Authorization': f'Bearer {self.token}'}
+        response = self.app.post('/api/render/preview', headers=headers,
+                                 json={'pattern': 'Unknown'})
+        self.assertIn(response.status_code, {400, 501})
+
+        response = self.app.post('/api/render/preview', headers=headers)
+        self.assertEqual(response.status_code, 400)
+        self.assertIn('pattern', json.loads(response.get_data())['messages'])
+        for field, value in (('color', 'nope'), ('pixels', 0),
+                             ('frames', 10 ** 6), ('speed', 1e40)):
+            response = self.app.post('/api/render/preview', headers=headers,
+                                     json={'pattern': 'SolidColor',
+                                           field: value})
+            self.assertEqual(response.status_code, 400)
+            self.assertIn(field, json.loads(response.get_data())['messages'])
+
+        response = self.app.post('/api/render/stream', headers=headers,
+                                 json={'pattern': 'SolidColor'})
+        self.assertEqual(response.status_code, 400)
+        self.assertIn('client_id', json.loads(response.get_data())['messages'])
+
+        response = self.app.post('/api/render/preview', headers=headers,
+                                 json={'pattern': 'SolidColor',
+                                       'color': '#aa00aa', 'pixels': 2,
+                                       'frames': 2})
+        if response.status_code == 501:
+            self.skipTest('NumPy is not installed')
+        self.assertDictEqual(json.loads(response.get_data()),
+                             {'fps': 60, 'frames': [['#aa00aa'] * 2] * 2})
+
+    def test_invalid_data(self):
+        """
+        Test that invalid request bodies are refused with 400.
+        """
+        headers = {'Authorization': f'Bearer {self.token}'}
+        response = self.app.put('/api/user/data', headers=headers,
+                                json={'colors': {'red': 'not a color'}})
+        self.assertEqual(response.status_code, 400)
+        self.assertIn('colors', json.loads(response.get_data())['messages'])
+
+        response = self.app.post('/api/submit', headers=headers,
+                                 json={'pattern': 'Off'})
+        self.assertEqual(response.status_code, 400)
+        self.assertIn('client_id', json.loads(response.get_data())['messages'])
+
+        for body in ({'colors': 'blue'}, {'moods': ['calm']}):
+            response = self.app.delete('/api/user/data', headers=headers,
+                                       json=body)
+            self.assertEqual(response.status_code, 400)
+        response = self.app.delete('/api/user/data', headers=headers)
+        self.assertEqual(response.status_code, 200)
+        self.assertDictEqual(json.loads(response.get_data()), {})
+
+    def test_schedule(self):
+        """
+        Test that timelines referring to unknown scenes are refused, and that
+        scheduling needs a reachable proxy server.
+        """
+        headers = {'Authorization': f'Bearer {self.token}'}
+        response = self.app.post('/api/schedule', headers=headers, json={
+            'cues': [{'at': 0, 'scene': 'no such scene'}]})
+        self.assertEqual(response.status_code, 400)
+
+        response = self.app.post('/api/schedule', headers=headers, json={
+            'cues': [{'at': 0}]})
+        self.assertEqual(response.status_code, 400)
+        self.assertIn('cues', json.loads(response.get_data())['messages'])
+
+        # the proxy server does not run in this process, and cannot be reached
+        response = self.app.post('/api/schedule', headers=headers, json={
+            'cues': [{'at': 0, 'lighting': {'pattern': 'Off'}}]})
+        self.assertEqual(response.status_code, 501)
+        self.assertIn('CLIENT_REGISTRY=ipc',
+                      json.loads(response.get_data())['error_description'])
+        self.assertEqual(self.get('/api/schedule', self.token).status_code,
+                         501)
+
+    def test_broadcast(self):
+        """
+        Test that the /api/broadcast URI reports which clients the
+        configuration was written to, and refuses unknown client groups.
+        """
+        headers = {'Authorization': f'Bearer {self.token}'}
+        response = self.app.post('/api/broadcast', headers=headers, json={
+            'pattern': 'Off', 'client_ids': ['Nope']})
+        self.assertDictEqual(json.loads(response.get_data()),
+                             {'success': False, 'results': {'Nope': False}})
+
+        # queued for both, but only written to one
+        written, lost = Future(), Future()
+        written.set_result(True)
+        lost.set_result(False)
+        groups = {'client_groups': {'lamps': ['Lamp', 'Desk']}}
+        with mock.patch.object(routes.user_data, 'load',
+                               return_value=groups), \
+                mock.patch.object(routes.proxy_server, 'broadcast',
+                                  return_value={'Lamp': written,
+                                                'Desk': lost}) as broadcast:
+            response = self.app.post('/api/broadcast', headers=headers, json={
+                'pattern': 'Off', 'group': 'lamps'})
+            self.assertListEqual(broadcast.call_args[0][2], ['Lamp', 'Desk'])
+            self.assertDictEqual(json.loads(response.get_data()),
+                                 {'success': False,
+                                  'results': {'Lamp': True, 'Desk': False}})
+
+            response = self.app.post('/api/broadcast', headers=headers, json={
+                'pattern': 'Off', 'group': 'other'})
+            self.assertEqual(response.status_code, 400)
+
+        response = self.app.post('/api/broadcast', headers=headers, json={
+            'pattern': 'Off', 'group': 'lamps', 'client_ids': ['Lamp']})
+        self.assertEqual(response.status_code, 400)
+        self.assertIn('group', json.loads(response.get_data())['messages'])
+
+    def test_broadcast_synced(self):
+        """
+        Test that synchronized broadcasts need a reachable proxy server.
+        """
+        headers = {'Authorization': f'Bearer {self.token}'}
+        response = self.app.post('/api/broadcast', headers=headers, json={
+            'pattern': 'Off', 'sync': True})
+        self.assertEqual(response.status_code, 501)
+
+    def test_user_events(self):
+        """
+        Test that the /api/user/events URI streams events to users with an
+        event stream token in the URL, or an access token in the headers.
+        """
+        response = self.app.get('/api/user/events?token=invalid')
+        self.assertEqual(response.status_code, 401)
+        # access tokens would end up in access logs
+        response = self.app.get(f'/api/user/events?token={self.token}')
+        self.assertEqual(response.status_code, 401)
+
+        response = self.app.post(
+            '/api/user/events/token',
+            headers={'Authorization': f'Bearer {self.token}'})
+        stream_token = json.loads(response.get_data())['token']
+        # and event stream tokens are no access tokens
+        self.assertEqual(self.get('/api/user/info', stream_token).status_code,
+                         401)
+
+        for open_stream in (
+                lambda: self.app.get(f'/api/user/events?token={stream_token}'),
+                lambda: self.get('/api/user/events', self.token)):
+            response = open_stream()
+            self.assertEqual(response.mimetype, 'text/event-stream')
+            first = next(response.response)
+            response.close()
+            self.assertEqual(first, b'event: clients\ndata: {}\n\n')
+            self.assertFalse(event_bus.has_subscribers(1))
+
+        # each process only serves a few streams at once
+        config = self.app.application.config
+        with mock.patch.dict(config, {'EVENTS_MAX_STREAMS': 1}):
+            response = self.get('/api/user/events', self.token)
+            self.assertEqual(self.get('/api/user/events',
+                                      self.token).status_code, 503)
+            response.close()
+            response = self.get('/api/user/events', self.token)
+            self.assertEqual(response.status_code, 200)
+            response.close()
+        self.assertEqual(stream_slots.open, 0)
+
+    def test_metrics(self):
+        """
+        Test that the /metrics URI exports request and token metrics when
+        enabled, to scrapers with the metrics token only.
+        """
+        self.assertEqual(self.app.get('/metrics').status_code, 404)
+
+        config = self.app.application.config
+        with mock.patch.dict(config, METRICS_ENABLED=True,
+                             METRICS_TOKEN='scrape'):
+            register_metrics(self.app.application)
+            self.get('/api/user/info', self.token)
+            self.assertEqual(self.app.get('/metrics').status_code, 401)
+            response = self.app.get(
+                '/metrics', headers={'Authorization': 'Bearer scrape'})
+        self.assertEqual(response.status_code, 200)
+        text = response.get_data(as_text=True)
+        # each process's series are labelled with its pid
+        pid = os.getpid()
+        self.assertIn('webcandy_http_requests_total{resource="UserInfo",'
+                      f'method="GET",status="200",pid="{pid}"}}', text)
+        self.assertIn('webcandy_token_verification_seconds_count'
+                      f'{{outcome="cached",pid="{pid}"}}', text)
+        self.assertIn('# TYPE webcandy_clients gauge', text)
+
+    def test_traces(self):
+        """
+        Test that the /api/admin/traces URI is refused to non-admin users.
+        """
+        response = self.get('/api/admin/traces', self.token)
+        self.assertEqual(response.status_code, 403)
@@ -0,0 +1,75 @@
+import unittest
+import asyncio
+import time
+
+from webcandy import protocol
+from webcandy.scheduler import Cue, Scheduler, Timeline
+
+
+class TestScheduler(unittest.TestCase):
+    """
+    Tests for Scheduler class.
+    """
+
+    def setUp(self):
+        self.loop = asyncio.new_event_loop()
+        asyncio.set_event_loop(self.loop)
+        self.fired = []
+        self.scheduler = Scheduler(
+            lambda timeline, cue: self.fired.append(cue.message.data),
+            max_timelines=2)
+
+    def tearDown(self):
+        self.loop.close()
+        asyncio.set_event_loop(None)
+
+    @staticmethod
+    def timeline(*offsets: float, start: float = None) -> Timeline:
+        cues = [Cue(at, protocol.Message({'at': at})) for at in offsets]
+        return Timeline(-1, cues, start)
+
+    def run_for(self, seconds: float) -> None:
+        self.loop.run_until_complete(asyncio.sleep(seconds))
+
+    def test_order(self):
+        first = self.timeline(0.03, 0.01)
+        second = self.timeline(0.02, start=first.start)
+        self.loop.call_soon(self.scheduler.add, first)
+        self.loop.call_soon(self.scheduler.add, second)
+
+        self.run_for(0)
+        self.assertListEqual(self.fired, [])
+        self.assertEqual(len(self.scheduler.pending(-1)), 2)
+
+        self.run_for(0.05)
+        self.assertListEqual(self.fired,
+                             [{'at': 0.01}, {'at': 0.02}, {'at': 0.03}])
+        self.assertListEqual(self.scheduler.pending(-1), [])
+        self.assertEqual(self.scheduler.stats['fired'], 3)
+        self.assertLess(self.scheduler.stats['late_max'], 0.05)
+
+    def test_past_start(self):
+        self.loop.call_soon(self.scheduler.add,
+                            self.timeline(0, 1, start=time.time() - 2))
+        self.run_for(0)
+        self.run_for(0)
+        self.assertListEqual(self.fired, [{'at': 0}, {'at': 1}])
+
+    def test_cancel(self):
+        kept = self.timeline(0.02)
+        cancelled = self.timeline(0.01, 0.03)
+        self.loop.call_soon(self.scheduler.add, kept)
+        self.loop.call_soon(self.scheduler.add, cancelled)
+        self.run_for(0)
+
+        self.assertRaises(ValueError, self.scheduler.add, self.timeline(0))
+        self.assertIs(self.scheduler.cancel(cancelled.timeline_id), cancelled)
+        self.assertIsNone(self.scheduler.cancel(cancelled.timeline_id))
+
+        self.run_for(0.05)
+        self.assertListEqual(self.fired, [{'at': 0.02}])
+        self.assertListEqual(self.scheduler._heap, [])
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,69 @@
+import unittest
+
+from marshmallow import ValidationError
+
+from webcandy.schemas import (
+    submit_schema, broadcast_schema, user_data_schema, error_response
+)
+
+
+class TestSchemas(unittest.TestCase):
+    """
+    Tests for shared validation schemas.
+    """
+
+    def test_submit(self):
+        data = {'client_id': 'MyClient', 'pattern': 'Fade', 'speed': 2,
+                'color_list': ['#ff0000', '#00ff00'], 'extra_arg': 1}
+        self.assertDictEqual(submit_schema.load(data), dict(data, speed=2.0))
+
+        with self.assertRaises(ValidationError) as context:
+            submit_schema.load({'pattern': 'Fade',
+                                'color_list': ['#ff0000', 'red']})
+        self.assertDictEqual(context.exception.messages, {
+            'client_id': ['Missing data for required field.'],
+            'color_list': {1: ['Not a valid color.']}})
+
+        self.assertRaises(ValidationError, submit_schema.load,
+                          {'client_id': 'MyClient', 'pattern': 'Fade',
+                           'speed': 1e40})
+
+    def test_broadcast(self):
+        self.assertRaises(ValidationError, broadcast_schema.load,
+                          {'pattern': 'Off', 'client_ids': [], 'group': 'g'})
+
+    def test_user_data(self):
+        data = {'colors': {'red': '#ff0000'},
+                'color_lists': {'warm': ['#ff0000', '#ff7f00']},
+                'client_groups': {'all': ['Left', 'Right']}}
+        self.assertDictEqual(user_data_schema.load(data), data)
+
+        # colors are normalized
+        self.assertDictEqual(user_data_schema.load({
+            'colors': {'red': '#F00'},
+            'color_lists': {'warm': ['rgb(255, 0, 0)', '#FF7F00']}}),
+            {'colors': {'red': '#ff0000'},
+             'color_lists': {'warm': ['#ff0000', '#ff7f00']}})
+
+        with self.assertRaises(ValidationError) as context:
+            user_data_schema.load({'color_lists': {'warm': ['#f00', 'red'],
+                                                   'cold': ['#00f']}})
+        self.assertDictEqual(context.exception.messages,
+                             {'color_lists': {'warm': {
+                                 1: ['Not a valid color.']}}})
+
+        self.assertRaises(ValidationError, user_data_schema.load,
+                          {'colors': {'red': 'ff0000'}})
+        self.assertRaises(ValidationError, user_data_schema.load,
+                          {'client_groups': {'all': 'Left'}})
+        self.assertRaises(ValidationError, user_data_schema.load,
+                          {'other': {}})
+
+    def test_error_response(self):
+        try:
+            user_data_schema.load({'colors': {'red': 'ff0000'}})
+        except ValidationError as err:
+            body, status = error_response(err)
+        self.assertEqual(status, 400)
+        self.assertEqual(body['error_description'], 'Invalid fields: colors')
+        self.assertIn('colors', body['messages'])
@@ -1,6 +1,21 @@
 import unittest
+import asyncio
+import threading
+import json
+import time
+import websockets
 
-from webcandy.server import ClientManager
+from unittest.mock import patch
+from flask import Flask
+
+from webcandy import protocol
+from webcandy.catalogue import catalogue, catalogue_hash
+from webcandy.clock import ClockEstimate
+from webcandy.config import Config
+from webcandy.events import event_bus, format_event
+from webcandy.extensions import db
+from webcandy.models import User
+from webcandy.server import ClientManager, FailureLimiter, ProxyServer, clients
 
 
 class TestClientManager(unittest.TestCase):
@@ -13,3 +28,530 @@ class TestClientManager(unittest.TestCase):
         # assert that RuntimeError is raised when app isn't initialized
         self.assertRaises(RuntimeError, manager.register,
                           'some-token', 'MyClient', [], None)
+
+    def test_replaced(self):
+        """
+        Test that a client replaced by a reconnection under the same name is
+        closed.
+        """
+        class FakeProtocol:
+            remote_address = ('127.0.0.1', 0)
+            closed = False
+
+            async def close(self):
+                self.closed = True
+
+        manager = ClientManager()
+        user = User(user_id=-1, username='testuser')
+        loop = asyncio.new_event_loop()
+        old, new = FakeProtocol(), FakeProtocol()
+        second = None
+
+        async def reconnect():
+            first = manager.add(user, 'MyClient', [], old, acks=True)
+            first.outbox.put('waiting')
+            first.acks.expect(1, time.perf_counter())
+            second = manager.add(user, 'MyClient', [], new)
+            await asyncio.sleep(0)
+            return first, second
+
+        try:
+            first, second = loop.run_until_complete(reconnect())
+            self.assertIs(manager.get_client(-1, 'MyClient'), second)
+            self.assertTrue(old.closed)
+            self.assertFalse(new.closed)
+            self.assertEqual(len(first.outbox), 0)
+            self.assertDictEqual(first.acks.pending, {})
+
+            # without the database, which the manager has no app for here
+            async def unregister():
+                manager.unregister(-1, 'MyClient', old)
+                self.assertIs(manager.get_client(-1, 'MyClient'), second)
+                manager.unregister(-1, 'MyClient', new)
+                await asyncio.sleep(0)
+
+            loop.run_until_complete(unregister())
+            self.assertFalse(manager.is_local(-1, 'MyClient'))
+            self.assertTrue(new.closed)
+        finally:
+            async def close():
+                if second:
+                    second.close()
+                await asyncio.sleep(0)
+
+            ClientManager.clients.pop(-1, None)
+            loop.run_until_complete(close())
+            loop.close()
+
+
+class TestProxyServer(unittest.TestCase):
+    """
+    Tests for ProxyServer class.
+    """
+
+    class FakeProtocol:
+        remote_address = ('127.0.0.1', 0)
+
+        def __init__(self):
+            self.sent = []
+
+        async def send(self, message):
+            self.sent.append(message)
+
+    def setUp(self):
+        self.loop = asyncio.new_event_loop()
+        self.thread = threading.Thread(target=self.loop.run_forever,
+                                       daemon=True)
+        self.thread.start()
+
+        self.server = ProxyServer()
+        self.server.loop = self.loop
+        self.server.running = True
+
+    def tearDown(self):
+        async def close():
+            for client in ClientManager.clients[-1].values():
+                client.outbox.close()
+            await asyncio.sleep(0)  # let the writer tasks finish
+
+        asyncio.run_coroutine_threadsafe(close(), self.loop).result(1)
+        del ClientManager.clients[-1]
+        self.loop.call_soon_threadsafe(self.loop.stop)
+        self.thread.join()
+
+    def add_client(self, client_name: str, encoding: str = 'json',
+                   acks: bool = False) -> FakeProtocol:
+        protocol = self.FakeProtocol()
+        ClientManager.clients[-1][client_name] = ClientManager.Client(
+            -1, client_name, [], protocol, encoding, acks=acks)
+        return protocol
+
+    def test_send_not_running(self):
+        server = ProxyServer()
+        self.assertIsNone(server.dispatch(1, 'MyClient', {}))
+        self.assertFalse(server.send(1, 'MyClient', {}))
+
+    def test_dispatch(self):
+        server = self.server
+        protocol = self.add_client('MyClient')
+
+        # unknown clients cannot be dispatched to
+        self.assertIsNone(server.dispatch(-1, 'OtherClient', {}))
+
+        future = server.dispatch(-1, 'MyClient', {'pattern': 'off'})
+        self.assertTrue(future.result(1))
+        self.assertTrue(server.send(-1, 'MyClient', {'pattern': 'on'},
+                                    wait=True, timeout=1))
+        self.assertListEqual([json.loads(m) for m in protocol.sent],
+                             [{'pattern': 'off'}, {'pattern': 'on'}])
+
+    def test_broadcast(self):
+        protocols = [self.add_client(name) for name in ('Left', 'Right')]
+
+        futures = self.server.broadcast(-1, {'pattern': 'off'})
+        self.assertSetEqual(set(futures), {'Left', 'Right'})
+        self.assertTrue(all(f.result(1) for f in futures.values()))
+
+        futures = self.server.broadcast(-1, {'pattern': 'on'},
+                                        ['Left', 'Missing'])
+        self.assertTrue(futures['Left'].result(1))
+        self.assertIsNone(futures['Missing'])
+
+        self.assertListEqual([json.loads(m) for m in protocols[0].sent],
+                             [{'pattern': 'off'}, {'pattern': 'on'}])
+        self.assertListEqual([json.loads(m) for m in protocols[1].sent],
+                             [{'pattern': 'off'}])
+
+    def test_broadcast_events(self):
+        self.add_client('MyClient')
+
+        with event_bus.subscribe(-1) as subscription:
+            futures = self.server.broadcast(-1, {'pattern': 'Off'},
+                                            ['MyClient'])
+            self.assertTrue(futures['MyClient'].result(1))
+            events = [subscription.get(1), subscription.get(1)]
+
+        self.assertEqual(events[0], format_event(
+            'lighting', {'client_names': ['MyClient'],
+                         'config': {'pattern': 'Off'}}))
+        self.assertEqual(events[1], format_event(
+            'delivered', {'client_name': 'MyClient', 'success': True}))
+
+    def test_request(self):
+        self.add_client('Plain')
+        acking = self.add_client('Acking', 'binary', acks=True)
+        client = ClientManager.clients[-1]['Acking']
+        self.assertRaises(ValueError, self.server.request, -1, 'Plain', {})
+        self.assertRaises(ValueError, self.server.request, -1, 'Missing', {})
+
+        future = self.server.request(-1, 'Acking', {'pattern': 'Off'})
+        for _ in range(100):
+            if acking.sent:
+                break
+            threading.Event().wait(0.01)
+        sent = protocol.decode(acking.sent[0])
+        self.assertEqual(sent['pattern'], 'Off')
+
+        self.loop.call_soon_threadsafe(
+            ProxyServer._receive, client,
+            json.dumps({'type': protocol.ACK, 'id': sent['id']}))
+        result = future.result(1)
+        self.assertTrue(result.acked)
+        self.assertIsNotNone(result.latency)
+        self.assertEqual(client.status()['acks']['acked'], 1)
+
+        # messages not requested are tracked too
+        self.assertTrue(self.server.send(-1, 'Acking', {'pattern': 'On'},
+                                         wait=True, timeout=1))
+        self.assertIn('id', protocol.decode(acking.sent[1]))
+        self.assertEqual(client.status()['acks']['pending'], 1)
+
+    def test_broadcast_encodings(self):
+        text = self.add_client('Text')
+        binary = self.add_client('Binary', 'binary')
+
+        data = {'pattern': 'Solid', 'color': '#ff00ff'}
+        futures = self.server.broadcast(-1, data)
+        self.assertTrue(all(f.result(1) for f in futures.values()))
+
+        self.assertIsInstance(text.sent[0], str)
+        self.assertIsInstance(binary.sent[0], bytes)
+        self.assertDictEqual(protocol.decode(text.sent[0]), data)
+        self.assertDictEqual(protocol.decode(binary.sent[0]), data)
+
+    def test_stream(self):
+        self.add_client('Text')
+        binary = self.add_client('Binary', 'binary')
+
+        self.assertRaises(ValueError, self.server.start_stream, -1, 'Text',
+                          2, 60)
+        self.assertFalse(self.server.push_frame(-1, 'Binary', b'\x00' * 6))
+
+        self.server.start_stream(-1, 'Binary', 2, 100)
+        self.assertRaises(ValueError, self.server.push_frame, -1, 'Binary',
+                          b'\x00' * 5)
+        self.assertTrue(self.server.push_frame(-1, 'Binary', b'\xff' * 6))
+
+        # wait for the frame to be written before stopping the stream
+        for _ in range(100):
+            if binary.sent:
+                break
+            threading.Event().wait(0.01)
+        self.assertTrue(self.server.stop_stream(-1, 'Binary'))
+        self.assertFalse(self.server.stop_stream(-1, 'Binary'))
+        self.assertDictEqual(protocol.decode(binary.sent[0]),
+                             {'sequence': 0, 'pixels': b'\xff' * 6})
+
+    def test_broadcast_synced(self):
+        synced = self.add_client('Synced')
+        plain = self.add_client('Plain')
+        client = ClientManager.clients[-1]['Synced']
+        client.clock = ClockEstimate()
+
+        # the synced client's clock is 5s ahead
+        now = time.time()
+        ProxyServer._receive(client, json.dumps({
+            'type': protocol.CLOCK_SYNC, 'server_time': now,
+            'received': now + 5.005, 'sent': now + 5.005}))
+        self.assertAlmostEqual(client.clock.offset, 5, places=2)
+
+        start, futures = self.server.broadcast_synced(
+            -1, {'pattern': 'Rainbow'}, start_at=time.time() + 0.1)
+        self.assertTrue(futures['Synced'].result(1))
+        self.assertListEqual(plain.sent, [])
+        self.assertEqual(json.loads(synced.sent[0]),
+                         {'pattern': 'Rainbow',
+                          'start_at': start + client.clock.offset})
+
+        # clients without a clock estimate are sent the plain configuration
+        # at the start time
+        self.assertTrue(futures['Plain'].result(1))
+        self.assertGreaterEqual(time.time(), start - 0.01)
+        self.assertEqual(json.loads(plain.sent[0]), {'pattern': 'Rainbow'})
+
+        # the lead covers the slowest client
+        client.latency = 1
+        self.assertEqual(ProxyServer.sync_lead([client]), Config.SYNC_LEAD)
+        ClientManager.clients[-1]['Plain'].latency = 1
+        self.assertEqual(ProxyServer.sync_lead(
+            ClientManager.clients[-1].values()), 2)
+
+    def test_schedule(self):
+        left = self.add_client('Left')
+        right = self.add_client('Right', 'binary')
+
+        timeline = self.server.schedule(-1, [
+            (0.02, {'pattern': 'Off'}, None),
+            (0.01, {'pattern': 'SolidColor', 'color': '#00ff00'}, ['Right'])
+        ])
+        cancelled = self.server.schedule(-1, [(0.02, {'pattern': 'On'}, None)])
+        self.assertListEqual(
+            sorted(t['timeline_id'] for t in self.server.timelines(-1)),
+            sorted((timeline['timeline_id'], cancelled['timeline_id'])))
+        self.assertFalse(self.server.cancel_timeline(
+            -2, cancelled['timeline_id']))
+        self.assertTrue(self.server.cancel_timeline(
+            -1, cancelled['timeline_id']))
+
+        for _ in range(100):
+            if len(right.sent) == 2:
+                break
+            threading.Event().wait(0.01)
+        self.assertListEqual([protocol.decode(m) for m in left.sent],
+                             [{'pattern': 'Off'}])
+        self.assertListEqual(
+            [protocol.decode(m) for m in right.sent],
+            [{'pattern': 'SolidColor', 'color': '#00ff00'}, {'pattern': 'Off'}])
+        self.assertListEqual(self.server.timelines(-1), [])
+
+    def test_schedule_elsewhere(self):
+        self.add_client('Here')
+        loop_thread = self.server._call(threading.current_thread)
+        looked_up = []
+        published = threading.Event()
+
+        def available_clients(user_id):
+            looked_up.append(threading.current_thread())
+            return ['Here', 'Elsewhere']
+
+        def publish(user_id, client_names, message, key=None):
+            self.assertListEqual(client_names, ['Elsewhere'])
+            published.set()
+
+        # clients connected to other processes are looked up off the loop
+        registry = clients.registry
+        with patch.object(registry, 'available_clients', available_clients), \
+                patch.object(registry, 'publish', publish):
+            self.server.schedule(-1, [(0, {'pattern': 'Off'}, None)])
+            self.assertTrue(published.wait(1))
+        self.assertNotIn(loop_thread, looked_up)
+
+
+class TestHeartbeat(unittest.TestCase):
+    """
+    Tests for ProxyServer._heartbeat.
+    """
+
+    class FakeProtocol:
+        remote_address = ('127.0.0.1', 0)
+
+        def __init__(self, answer: bool):
+            self.answer = answer
+            self.aborted = False
+            self.transport = self
+
+        async def ping(self):
+            pong = asyncio.get_event_loop().create_future()
+            if self.answer:
+                pong.set_result(None)
+            return pong
+
+        async def close(self):
+            pass
+
+        def abort(self):
+            self.aborted = True
+
+    def setUp(self):
+        app = Flask(__name__)
+        app.config['SQLALCHEMY_DATABASE_URI'] = 'sqlite://'
+        app.config['SQLALCHEMY_TRACK_MODIFICATIONS'] = False
+        db.init_app(app)
+        with app.app_context():
+            db.create_all()
+            db.session.add(User(user_id=-1, username='testuser'))
+            db.session.commit()
+
+        self.old_app = clients.app
+        clients.app = app
+        self.loop = asyncio.new_event_loop()
+
+    def tearDown(self):
+        clients.app = self.old_app
+        ClientManager.clients.pop(-1, None)
+        self.loop.close()
+
+    def beat(self, answer: bool) -> ClientManager.Client:
+        protocol = self.FakeProtocol(answer)
+        client = ClientManager.Client(-1, 'MyClient', [], protocol)
+        ClientManager.clients[-1]['MyClient'] = client
+
+        with patch.object(Config, 'HEARTBEAT_INTERVAL', 0), \
+                patch.object(Config, 'HEARTBEAT_TIMEOUT', 0.01):
+            task = self.loop.create_task(ProxyServer._heartbeat(client))
+            self.loop.run_until_complete(asyncio.wait([task], timeout=0.1))
+            task.cancel()
+            self.loop.run_until_complete(asyncio.sleep(0))
+        return client
+
+    def test_alive(self):
+        client = self.beat(answer=True)
+        self.assertIsNotNone(client.latency)
+        self.assertTrue(clients.is_local(-1, 'MyClient'))
+        self.assertFalse(client.protocol.aborted)
+
+    def test_evicted(self):
+        client = self.beat(answer=False)
+        self.assertIsNone(client.latency)
+        self.assertFalse(clients.is_local(-1, 'MyClient'))
+        self.assertTrue(client.protocol.aborted)
+
+
+class TestFailureLimiter(unittest.TestCase):
+    """
+    Tests for FailureLimiter class.
+    """
+
+    def test_blocked(self):
+        limiter = FailureLimiter(2, 60)
+        limiter.add('1.2.3.4')
+        self.assertFalse(limiter.blocked('1.2.3.4'))
+        limiter.add('1.2.3.4')
+        self.assertTrue(limiter.blocked('1.2.3.4'))
+        self.assertFalse(limiter.blocked('5.6.7.8'))
+
+    def test_expired(self):
+        limiter = FailureLimiter(1, 0)
+        limiter.add('1.2.3.4')
+        self.assertFalse(limiter.blocked('1.2.3.4'))
+
+    def test_prune(self):
+        limiter = FailureLimiter(2, 0.01)
+        for i in range(100):
+            limiter.add(f'10.0.0.{i}')
+        time.sleep(0.02)
+        # hosts that never fail again are forgotten too
+        limiter.add('1.2.3.4')
+        self.assertListEqual(list(limiter._failures), ['1.2.3.4'])
+
+
+class TestHandshake(unittest.TestCase):
+    """
+    Tests for the registration handshake in ProxyServer._ws_handler.
+    """
+
+    class FakeProtocol:
+        remote_address = ('127.0.0.1', 0)
+
+        def __init__(self, *received):
+            self.received = asyncio.Queue()
+            for message in received:
+                self.received.put_nowait(message)
+            # clients that send anything hang up once they have sent it all
+            self.hang_up = bool(received)
+            self.sent = []
+            self.close_code = None
+
+        async def send(self, message):
+            self.sent.append(message)
+
+        async def recv(self):
+            if self.close_code is not None or \
+                    (self.hang_up and self.received.empty()):
+                raise websockets.ConnectionClosed(1000, '')
+            return await self.received.get()
+
+        async def close(self, code=1000, reason=''):
+            self.close_code = code
+
+    def setUp(self):
+        app = Flask(__name__)
+        app.config['SQLALCHEMY_DATABASE_URI'] = 'sqlite://'
+        app.config['SQLALCHEMY_TRACK_MODIFICATIONS'] = False
+        db.init_app(app)
+        with app.app_context():
+            db.create_all()
+            user = User(user_id=-1, username='testuser')
+            db.session.add(user)
+            db.session.commit()
+            self.token = user.generate_auth_token().decode()
+
+        self.old_app = clients.app
+        clients.app = app
+        self.loop = asyncio.new_event_loop()
+        self.server = ProxyServer()
+
+    def tearDown(self):
+        clients.app = self.old_app
+        ClientManager.clients.pop(-1, None)
+        self.loop.close()
+
+    def connect(self, *received) -> FakeProtocol:
+        protocol = self.FakeProtocol(*received)
+        with patch.object(Config, 'HANDSHAKE_TIMEOUT', 0.5):
+            self.loop.run_until_complete(
+                self.server._ws_handler(protocol, '/'))
+        return protocol
+
+    def test_registered(self):
+        client = self.connect(json.dumps({
+            'token': self.token, 'client_name': 'MyClient', 'patterns': [],
+            'encodings': ['msgpack', 'binary']}))
+        self.assertEqual(client.sent[-1], "Registered client 'MyClient' with "
+                                          "user 'testuser' using binary "
+                                          "encoding and pattern catalogue "
+                                          f"{catalogue_hash([])!r}.")
+        self.assertEqual(self.server.handshakes['registered'], 1)
+        # unregistered and closed normally once the connection closed
+        self.assertEqual(client.close_code, 1000)
+        self.assertFalse(clients.is_local(-1, 'MyClient'))
+
+    def test_patterns_hash(self):
+        patterns = [{'name': 'Off', 'type': 'static', 'args': []}]
+        patterns_hash = catalogue_hash(patterns)
+        data = {'token': self.token, 'client_name': 'MyClient',
+                'patterns_hash': patterns_hash}
+
+        # unknown hashes are refused until the patterns are sent
+        client = self.FakeProtocol(json.dumps(data), json.dumps(
+            {'token': self.token, 'client_name': 'MyClient',
+             'patterns': patterns}))
+        with patch.object(Config, 'HANDSHAKE_TIMEOUT', 0.5):
+            self.loop.run_until_complete(self.server._ws_handler(client, '/'))
+        self.assertEqual(client.sent[1], "[Error] Unknown pattern catalogue "
+                                         f"{patterns_hash!r}, please send "
+                                         "patterns")
+
+        client = self.connect(json.dumps(data))
+        self.assertTrue(client.sent[-1].startswith('Registered client'))
+        self.assertEqual(self.server.handshakes['registered'], 2)
+
+    def test_invalid_token(self):
+        self.server.failures.limit = 2
+        data = json.dumps({'token': 'invalid', 'client_name': 'MyClient',
+                           'patterns': []})
+
+        for _ in range(2):
+            protocol = self.connect(data)
+            self.assertEqual(protocol.sent[-1],
+                             '[Error] Invalid authentication token\n')
+            self.assertEqual(protocol.close_code, 1008)
+        self.assertEqual(self.server.handshakes['rejected'], 2)
+
+        # further attempts from the same host are refused outright
+        protocol = self.connect(data)
+        self.assertListEqual(protocol.sent, [])
+        self.assertEqual(protocol.close_code, 1008)
+        self.assertEqual(self.server.handshakes['rejected'], 2)
+
+    def test_invalid_token_catalogue(self):
+        patterns = [{'name': 'Unauthenticated', 'type': 'static', 'args': []}]
+        patterns_hash = catalogue_hash(patterns)
+        self.connect(json.dumps({'token': 'invalid', 'client_name': 'MyClient',
+                                 'patterns': patterns}))
+        self.assertIsNone(catalogue.get(patterns_hash))
+
+        # nor can they learn whether a hash is stored
+        protocol = self.connect(json.dumps(
+            {'token': 'invalid', 'client_name': 'MyClient',
+             'patterns_hash': catalogue_hash([])}))
+        self.assertEqual(protocol.sent[-1],
+                         '[Error] Invalid authentication token\n')
+
+    def test_timeout(self):
+        with patch.object(Config, 'HANDSHAKE_TIMEOUT', 0.01):
+            protocol = self.FakeProtocol()
+            self.loop.run_until_complete(
+                self.server._ws_handler(protocol, '/'))
+        self.assertEqual(protocol.close_code, 1008)
+        self.assertEqual(self.server.handshakes['timed_out'], 1)
@@ -0,0 +1,169 @@
+import unittest
+import os
+import json
+import tempfile
+import threading
+
+from flask import Flask
+
+from webcandy.extensions import db
+from webcandy.models import User
+from webcandy.storage import JSONBackend, SQLBackend
+
+
+class TestJSONBackend(unittest.TestCase):
+    """
+    Tests for JSONBackend class.
+    """
+
+    def setUp(self):
+        self.tmp = tempfile.TemporaryDirectory()
+        self.backend = JSONBackend(self.tmp.name)
+        self.backend.create(1)
+
+    def tearDown(self):
+        self.tmp.cleanup()
+
+    def read_file(self, user_id: int) -> dict:
+        with open(os.path.join(self.tmp.name, f'{user_id}.json')) as file:
+            return json.load(file)
+
+    def test_load(self):
+        self.assertRaises(ValueError, self.backend.load, 2)
+        self.assertDictEqual(self.backend.load(1),
+                             {'colors': {}, 'color_lists': {}})
+
+    def test_put_delete(self):
+        old = self.backend.put(1, {'colors': {'blue': '#0000ff'}})
+        self.assertDictEqual(old, {'colors': {'blue': None}})
+        old = self.backend.put(1, {'colors': {'blue': '#0000aa'}})
+        self.assertDictEqual(old, {'colors': {'blue': '#0000ff'}})
+        self.assertEqual(self.read_file(1)['colors']['blue'], '#0000aa')
+
+        deleted = self.backend.delete(1, {'colors': ['blue', 'red'],
+                                          'color_lists': ['warm']})
+        self.assertDictEqual(deleted, {'colors': {'blue': '#0000aa'}})
+        self.assertDictEqual(self.read_file(1)['colors'], {})
+
+    def test_select(self):
+        self.backend.put(1, {'colors': {'blue': '#0000ff', 'pink': '#ff69b4'}})
+        self.assertDictEqual(
+            self.backend.select(1, {'colors': ['pink', 'red'],
+                                    'client_groups': None}),
+            {'colors': {'pink': '#ff69b4'}})
+
+    def test_loaded_documents_unchanged(self):
+        document = self.backend.load(1)
+        self.backend.put(1, {'colors': {'blue': '#0000ff'}})
+        self.assertDictEqual(document['colors'], {})
+
+    def test_external_change(self):
+        self.backend.load(1)
+        other = JSONBackend(self.tmp.name)
+        other.put(1, {'colors': {'blue': '#0000ff'}, 'color_lists': {}})
+        self.assertEqual(self.backend.load(1)['colors']['blue'], '#0000ff')
+
+    def test_concurrent_puts(self):
+        def go(i: int):
+            self.backend.put(1, {'colors': {f'color{i}': '#000000'}})
+
+        threads = [threading.Thread(target=go, args=(i,)) for i in range(20)]
+        for thread in threads:
+            thread.start()
+        for thread in threads:
+            thread.join()
+
+        self.assertEqual(len(self.read_file(1)['colors']), 20)
+
+    def test_file_mode(self):
+        path = os.path.join(self.tmp.name, '1.json')
+        os.chmod(path, 0o640)
+        self.backend.put(1, {'colors': {'blue': '#0000ff'}})
+        self.assertEqual(os.stat(path).st_mode & 0o777, 0o640)
+
+    def test_concurrent_processes(self):
+        # a backend per thread stands in for a process each
+        def go(i: int):
+            JSONBackend(self.tmp.name).put(
+                1, {'colors': {f'color{i}': '#000000'}})
+
+        threads = [threading.Thread(target=go, args=(i,)) for i in range(20)]
+        for thread in threads:
+            thread.start()
+        for thread in threads:
+            thread.join()
+
+        self.assertEqual(len(self.read_file(1)['colors']), 20)
+
+    def test_flush_delay(self):
+        backend = JSONBackend(self.tmp.name, flush_delay=60)
+        backend.put(1, {'colors': {'blue': '#0000ff'}})
+        backend.put(1, {'colors': {'pink': '#ff69b4'}})
+        self.assertDictEqual(self.read_file(1)['colors'], {})
+        self.assertEqual(len(backend.load(1)['colors']), 2)
+
+        backend.flush()
+        self.assertEqual(len(self.read_file(1)['colors']), 2)
+
+
+class TestSQLBackend(unittest.TestCase):
+    """
+    Tests for SQLBackend class.
+    """
+
+    def setUp(self):
+        app = Flask(__name__)
+        app.config['SQLALCHEMY_DATABASE_URI'] = 'sqlite://'
+        app.config['SQLALCHEMY_TRACK_MODIFICATIONS'] = False
+        db.init_app(app)
+
+        self.context = app.app_context()
+        self.context.push()
+        db.create_all()
+        db.session.add(User(user_id=1, username='testuser'))
+        db.session.commit()
+
+        self.backend = SQLBackend()
+
+    def tearDown(self):
+        db.session.remove()
+        self.context.pop()
+
+    def test_put_delete(self):
+        self.assertDictEqual(self.backend.load(1),
+                             {'colors': {}, 'color_lists': {}})
+
+        old = self.backend.put(1, {'colors': {'blue': '#0000ff'},
+                                   'color_lists': {'warm': ['#ff0000']}})
+        self.assertDictEqual(old, {'colors': {'blue': None},
+                                   'color_lists': {'warm': None}})
+        old = self.backend.put(1, {'color_lists': {'warm': ['#ffff00']}})
+        self.assertDictEqual(old, {'color_lists': {'warm': ['#ff0000']}})
+        self.assertDictEqual(self.backend.load(1),
+                             {'colors': {'blue': '#0000ff'},
+                              'color_lists': {'warm': ['#ffff00']}})
+
+        deleted = self.backend.delete(1, {'colors': ['blue', 'red']})
+        self.assertDictEqual(deleted, {'colors': {'blue': '#0000ff'}})
+        self.assertDictEqual(self.backend.load(1)['colors'], {})
+
+    def test_invalid_section(self):
+        self.assertRaises(ValueError, self.backend.put, 1,
+                          {'patterns': {'name': 'value'}})
+
+    def test_import_document(self):
+        count = self.backend.import_document(1, {
+            'colors': {'blue': '#0000ff', 'pink': '#ff69b4'},
+            'color_lists': {'warm': ['#ff0000', '#ffff00']}
+        })
+        self.assertEqual(count, 3)
+        self.assertEqual(len(self.backend.load(1)['colors']), 2)
+
+    def test_select(self):
+        self.backend.put(1, {'colors': {'blue': '#0000ff', 'pink': '#ff69b4'},
+                             'color_lists': {'warm': ['#ff0000']}})
+        self.assertDictEqual(
+            self.backend.select(1, {'colors': ['pink', 'red']}),
+            {'colors': {'pink': '#ff69b4'}})
+        self.assertDictEqual(self.backend.select(1, {'color_lists': None}),
+                             {'color_lists': {'warm': ['#ff0000']}})
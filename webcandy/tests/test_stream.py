@@ -0,0 +1,98 @@
+import unittest
+import asyncio
+
+from webcandy import protocol
+from webcandy.stream import PixelStream
+
+
+class TestPixelStream(unittest.TestCase):
+    """
+    Tests for PixelStream class.
+    """
+
+    class FakeProtocol:
+        remote_address = ('127.0.0.1', 0)
+
+        def __init__(self):
+            self.sent = []
+            self.times = []
+
+        async def send(self, message):
+            # copy, since the stream reuses its buffers
+            self.sent.append(bytes(message))
+            self.times.append(asyncio.get_event_loop().time())
+
+    def run(self, result=None):
+        self.loop = asyncio.new_event_loop()
+        asyncio.set_event_loop(self.loop)
+        try:
+            return super().run(result)
+        finally:
+            self.loop.close()
+            asyncio.set_event_loop(None)
+
+    def frame(self, value: int) -> bytes:
+        return bytes([value] * 6)  # 2 pixels
+
+    def test_invalid_arguments(self):
+        self.assertRaises(ValueError, PixelStream, None, 0, 60)
+        self.assertRaises(ValueError, PixelStream, None, 2, 0)
+        self.assertRaises(ValueError, PixelStream, None, 0x10000, 60)
+
+        stream = PixelStream(None, 2, 60)
+        self.assertRaises(ValueError, stream.push, b'\x00' * 5)
+
+    def test_drop_oldest(self):
+        async def go():
+            client = self.FakeProtocol()
+            stream = PixelStream(client, 2, 1000, buffer=2)
+            for value in range(5):
+                stream.push(self.frame(value))
+            self.assertEqual(stream.dropped, 3)
+
+            while stream.sent < 2:
+                await asyncio.sleep(0.001)
+            stream.close()
+            return client
+
+        client = self.loop.run_until_complete(go())
+        frames = [protocol.decode(frame) for frame in client.sent]
+        self.assertListEqual([f['sequence'] for f in frames], [3, 4])
+        self.assertListEqual([f['pixels'] for f in frames],
+                             [self.frame(3), self.frame(4)])
+
+    def test_pacing(self):
+        async def go():
+            client = self.FakeProtocol()
+            stream = PixelStream(client, 2, 50, buffer=4)
+            for value in range(3):
+                stream.push(self.frame(value))
+            while stream.sent < 3:
+                await asyncio.sleep(0.001)
+            stream.close()
+            return client
+
+        client = self.loop.run_until_complete(go())
+        gaps = [b - a for a, b in zip(client.times, client.times[1:])]
+        self.assertTrue(all(gap >= 0.018 for gap in gaps), gaps)
+
+    def test_source(self):
+        async def go():
+            client = self.FakeProtocol()
+            values = iter(range(256))
+            stream = PixelStream(client, 2, 1000,
+                                 source=lambda: self.frame(next(values)))
+            while stream.sent < 3:
+                await asyncio.sleep(0.001)
+            stream.close()
+            return client
+
+        client = self.loop.run_until_complete(go())
+        self.assertListEqual([protocol.decode(f)['pixels']
+                              for f in client.sent[:3]],
+                             [self.frame(0), self.frame(1), self.frame(2)])
+
+    def test_closed(self):
+        stream = PixelStream(self.FakeProtocol(), 2, 60)
+        stream.close()
+        self.assertFalse(stream.push(self.frame(0)))
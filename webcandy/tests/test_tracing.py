@@ -0,0 +1,111 @@
+import unittest
+import json
+import os
+import tempfile
+import threading
+
+from concurrent.futures import Future
+from flask import Flask
+
+from webcandy import tracing
+from webcandy.tracing import Tracer, span, traced
+
+
+class TestTracer(unittest.TestCase):
+    """
+    Tests for Trace and Tracer classes.
+    """
+
+    def make_tracer(self, **config) -> Tracer:
+        app = Flask(__name__)
+        app.config['TRACING'] = 'memory'
+        app.config.update(config)
+        return Tracer(app)
+
+    def test_disabled(self):
+        self.assertIsNone(Tracer().start('submit'))
+        app = Flask(__name__)
+        app.config['TRACING'] = 'elsewhere'
+        self.assertRaises(ValueError, Tracer, app)
+
+    def test_spans(self):
+        tracer = self.make_tracer()
+        trace = tracer.start('submit')
+        self.assertRegex(trace.trace_id, '^[0-9a-f]{16}$')
+        with trace.span('auth'):
+            pass
+        with trace.span('validation', fields=2):
+            pass
+
+        written = Future()
+        trace.follow(written, 'write', 0, lambda ok: {'written': ok})
+        trace.release()
+        # held open until the write finishes
+        self.assertListEqual(tracer.recent(), [])
+
+        written.set_result(True)
+        self.assertListEqual(tracer.recent(), [trace])
+        self.assertIs(tracer.get(trace.trace_id), trace)
+
+        status = trace.status()
+        self.assertListEqual([s['name'] for s in status['spans']],
+                             ['write', 'auth', 'validation'])
+        self.assertDictEqual(status['spans'][0]['attributes'],
+                             {'written': True})
+        self.assertDictEqual(status['spans'][2]['attributes'], {'fields': 2})
+        self.assertGreaterEqual(status['duration'],
+                                status['spans'][2]['duration'])
+
+    def test_ring_buffer(self):
+        tracer = self.make_tracer(TRACE_BUFFER_SIZE=2)
+        traces = [tracer.start('submit') for _ in range(3)]
+        for trace in traces:
+            trace.release()
+        self.assertListEqual(tracer.recent(), traces[:0:-1])
+        self.assertListEqual(tracer.recent(1), traces[2:])
+        self.assertIsNone(tracer.get(traces[0].trace_id))
+
+    def test_file(self):
+        with tempfile.TemporaryDirectory() as directory:
+            path = os.path.join(directory, 'traces.jsonl')
+            tracer = self.make_tracer(TRACING='file', TRACE_FILE=path)
+            trace = tracer.start('submit')
+            trace.release()
+
+            for _ in range(100):
+                if os.path.exists(path) and os.path.getsize(path):
+                    break
+                threading.Event().wait(0.01)
+            with open(path) as file:
+                self.assertEqual(json.loads(file.readline())['trace_id'],
+                                 trace.trace_id)
+
+    def test_traced(self):
+        app = Flask(__name__)
+        app.config['TRACING'] = 'memory'
+        old_tracer = tracing.tracer
+        tracing.tracer = Tracer(app)
+        try:
+            @app.route('/submit')
+            @traced('submit')
+            def submit():
+                with span('auth'):
+                    pass
+                return tracing.current_trace().trace_id
+
+            response = app.test_client().get('/submit')
+            trace_id = response.get_data(as_text=True)
+            self.assertEqual(response.headers[tracing.TRACE_HEADER], trace_id)
+            trace = tracing.tracer.get(trace_id)
+            self.assertEqual(trace.spans[0].name, 'auth')
+        finally:
+            tracing.tracer = old_tracer
+
+        # spans outside of traced requests are ignored
+        with app.test_request_context():
+            with span('auth'):
+                pass
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -7,6 +7,38 @@ class TestUtil(unittest.TestCase):
     Tests for ``util`` module.
     """
 
+    def test_is_color(self):
+        self.assertTrue(util.is_color('#aB09fF'))
+        self.assertFalse(util.is_color('#aB09fF0'))
+        self.assertFalse(util.is_color('aB09fF'))
+        self.assertFalse(util.is_color('#ab09fg'))
+        self.assertFalse(util.is_color(None))
+
+    def test_normalize_color(self):
+        self.assertEqual(util.normalize_color('#AbCdEf'), '#abcdef')
+        self.assertEqual(util.normalize_color('#F0a'), '#ff00aa')
+        self.assertEqual(util.normalize_color('RGB(255, 0,16)'), '#ff0010')
+        self.assertIsNone(util.normalize_color('rgb(256, 0, 0)'))
+        self.assertIsNone(util.normalize_color('#abcd'))
+        self.assertIsNone(util.normalize_color(7))
+
+    def test_parse_colors(self):
+        parsed = util.parse_colors(['#FF0000', '#0f0', 'rgb(0, 0, 255)'])
+        self.assertListEqual(parsed.colors, ['#ff0000', '#00ff00', '#0000ff'])
+        self.assertEqual(parsed.packed, bytes.fromhex('ff000000ff000000ff'))
+        self.assertListEqual(parsed.invalid, [])
+
+        parsed = util.parse_colors(['#ff0000', 'red', None, '#00ff00\n#ff'])
+        self.assertListEqual(parsed.colors, ['#ff0000', None, None, None])
+        self.assertEqual(len(parsed.packed), 12)
+        self.assertListEqual(parsed.invalid, [1, 2, 3])
+
+        # a newline can't split one invalid color into two valid ones
+        parsed = util.parse_colors(['#ff0000\n#00ff00'])
+        self.assertListEqual(parsed.invalid, [0])
+
+        self.assertEqual(util.parse_colors([]), ([], bytearray(), []))
+
     def test_load_user_data(self):
         # User "testfakeuser" does not exist
         self.assertRaises(ValueError, util.load_user_data, 'testfakeuser')
@@ -25,3 +57,15 @@ class TestUtil(unittest.TestCase):
         self.assertEqual(util.format_error(404, 'Not Found test'),
                          {'error': 'Not Found',
                           'error_description': 'Not Found test'})
+
+    def test_parse_fields(self):
+        self.assertDictEqual(util.parse_fields('color_lists'),
+                             {'color_lists': None})
+        self.assertDictEqual(
+            util.parse_fields('colors.pink, colors.blue,colors.pink,'),
+            {'colors': ['pink', 'blue']})
+        # selecting a whole section overrides selecting single items
+        self.assertDictEqual(util.parse_fields('colors.blue,colors'),
+                             {'colors': None})
+        self.assertDictEqual(util.parse_fields('colors,colors.blue'),
+                             {'colors': None})
@@ -0,0 +1,300 @@
+"""
+Opt-in tracing of lighting submissions, to tell where the time between a
+request reaching the API and a client applying the configuration goes.
+
+A trace is started for each traced request and stamped with a trace ID, which
+is returned in the ``X-Trace-Id`` response header and sent to clients in the
+"trace_id" field of the lighting configuration (see ``webcandy.protocol``).
+Spans record the time taken by each stage: ``auth``, ``validation``,
+``dispatch`` (client lookup, encoding and hand-off to the proxy server loop),
+``write`` (until the configuration is written to the websocket) and ``ack``
+(until the client acknowledges it). Stages that finish on the proxy server
+loop after the response has been sent are still part of the trace, which is
+exported once every stage is done.
+
+Finished traces are kept in a ring buffer, viewable through the admin API,
+and appended to a file of JSON lines if configured.
+"""
+import json
+import time
+import queue
+import logging
+import secrets
+import threading
+
+from collections import deque
+from concurrent.futures import Future
+from contextlib import contextmanager
+from functools import wraps
+from typing import Any, Callable, Deque, Dict, List, NamedTuple, Optional
+from flask import Flask, g, has_request_context, after_this_request
+
+from .config import configure_logger
+
+logger = logging.getLogger(__name__)
+configure_logger(logger)
+
+TRACE_HEADER = 'X-Trace-Id'
+TRACING_MODES = {'memory', 'file'}
+
+
+def new_trace_id() -> str:
+    """
+    Make a random 64-bit trace ID, as 16 hex digits.
+    """
+    return secrets.token_hex(8)
+
+
+class Span(NamedTuple):
+    """
+    A timed stage of a trace.
+    """
+    name: str
+    offset: float  # seconds from the start of the trace
+    duration: float  # seconds
+    attributes: Dict[str, Any]
+
+    def status(self) -> Dict:
+        return dict(self._asdict())
+
+
+class Trace:
+    """
+    The spans of one traced request. The trace is exported once the request
+    and every stage held open past it are done. Safe to use from any thread.
+    """
+
+    def __init__(self, tracer: 'Tracer', name: str):
+        self.tracer = tracer
+        self.trace_id = new_trace_id()
+        self.name = name
+        self.start = time.time()
+        self.attributes: Dict[str, Any] = dict()
+        self.spans: List[Span] = []
+        # time.perf_counter() at the start, which spans are measured against
+        self._origin = time.perf_counter()
+        # the request itself, plus stages held open past it
+        self._open = 1
+        self._lock = threading.Lock()
+
+    def add(self, name: str, start: float, duration: float,
+            **attributes) -> None:
+        """
+        Record a span.
+
+        :param name: the stage the span measures
+        :param start: ``time.perf_counter()`` when the stage started
+        :param duration: seconds the stage took
+        """
+        span = Span(name, start - self._origin, duration, attributes)
+        with self._lock:
+            self.spans.append(span)
+
+    @contextmanager
+    def span(self, name: str, **attributes):
+        """
+        Record a span for the time spent in a ``with`` block.
+        """
+        start = time.perf_counter()
+        try:
+            yield
+        finally:
+            self.add(name, start, time.perf_counter() - start, **attributes)
+
+    def follow(self, future: Future, name: str, start: float,
+               describe: Callable[[Any], Dict] = None) -> None:
+        """
+        Record a span lasting until a future resolves, keeping the trace open
+        until then.
+
+        :param future: the future, usually resolved on the proxy server loop
+        :param name: the stage the span measures
+        :param start: ``time.perf_counter()`` when the stage started
+        :param describe: function making the attributes of the span from the
+            result of the future
+        """
+        self.hold()
+
+        def done(_):
+            attributes = dict()
+            if describe and not future.cancelled() and \
+                    future.exception() is None:
+                attributes = describe(future.result())
+            self.add(name, start, time.perf_counter() - start, **attributes)
+            self.release()
+
+        future.add_done_callback(done)
+
+    def hold(self) -> None:
+        """
+        Keep the trace open until ``release`` is called, for a stage that
+        finishes elsewhere.
+        """
+        with self._lock:
+            self._open += 1
+
+    def release(self) -> None:
+        """
+        Mark the request, or a stage held open with ``hold``, as done, and
+        export the trace if nothing else is.
+        """
+        with self._lock:
+            self._open -= 1
+            done = not self._open
+        if done:
+            self.tracer.export(self)
+
+    def status(self) -> Dict:
+        """
+        Get a JSON serializable description of the trace.
+        """
+        with self._lock:
+            spans = sorted(self.spans, key=lambda s: s.offset)
+        return {'trace_id': self.trace_id,
+                'name': self.name,
+                'start': self.start,
+                'duration': max((s.offset + s.duration for s in spans),
+                                default=0.0),
+                'attributes': self.attributes,
+                'spans': [span.status() for span in spans]}
+
+
+class Tracer:
+    """
+    Starts traces when tracing is enabled, and keeps the ones that finished.
+    """
+
+    def __init__(self, app: Flask = None):
+        self.enabled = False
+        self.path: Optional[str] = None
+        self.traces: Deque[Trace] = deque(maxlen=256)
+        self._lock = threading.Lock()
+        # finished traces waiting to be written to the file
+        self._pending: 'queue.SimpleQueue[Trace]' = queue.SimpleQueue()
+        self._writer: Optional[threading.Thread] = None
+        if app:
+            self.init_app(app)
+
+    def init_app(self, app: Flask) -> None:
+        """
+        Set up tracing according to the app's ``TRACING`` setting.
+
+        :raises ValueError: if the tracing mode is invalid
+        """
+        mode = app.config.get('TRACING')
+        if mode and mode not in TRACING_MODES:
+            raise ValueError(f"Invalid tracing mode {mode!r}; expected "
+                             f"'memory' or 'file'")
+        self.enabled = bool(mode)
+        self.path = app.config.get('TRACE_FILE') if mode == 'file' else None
+        self.traces = deque(self.traces,
+                            maxlen=app.config.get('TRACE_BUFFER_SIZE', 256))
+
+    def start(self, name: str) -> Optional[Trace]:
+        """
+        Start a trace.
+
+        :return: the trace; ``None`` if tracing is disabled
+        """
+        return Trace(self, name) if self.enabled else None
+
+    def export(self, trace: Trace) -> None:
+        """
+        Keep a finished trace, and queue it to be written to the file.
+        """
+        with self._lock:
+            self.traces.append(trace)
+            if self.path is None:
+                return
+            if self._writer is None:
+                self._writer = threading.Thread(target=self._write,
+                                                daemon=True)
+                self._writer.start()
+        self._pending.put(trace)
+
+    def _write(self) -> None:
+        """
+        Append finished traces to the file as they come, off the threads that
+        finish them.
+        """
+        while True:
+            trace = self._pending.get()
+            try:
+                with open(self.path, 'a') as file:
+                    file.write(json.dumps(trace.status()) + '\n')
+            except OSError as err:
+                logger.error(f'Failed to write trace {trace.trace_id} to '
+                             f'{self.path}: {err}')
+
+    def recent(self, limit: Optional[int] = None) -> List[Trace]:
+        """
+        Get the most recently finished traces, newest first.
+        """
+        with self._lock:
+            traces = list(self.traces)
+        traces.reverse()
+        return traces[:limit]
+
+    def get(self, trace_id: str) -> Optional[Trace]:
+        """
+        Get a recently finished trace by ID.
+        """
+        with self._lock:
+            return next((t for t in self.traces if t.trace_id == trace_id),
+                        None)
+
+
+tracer = Tracer()  # make sure to call init_app on this
+
+
+def current_trace() -> Optional[Trace]:
+    """
+    Get the trace of the current request, if it is traced.
+    """
+    return g.get('trace') if has_request_context() else None
+
+
+@contextmanager
+def span(name: str, **attributes):
+    """
+    Record a span of the current request's trace for the time spent in a
+    ``with`` block. Does nothing if the request is not traced.
+    """
+    trace = current_trace()
+    if trace is None:
+        yield
+        return
+    with trace.span(name, **attributes):
+        yield
+
+
+def traced(name: str):
+    """
+    Decorator tracing every call of a view function, including any
+    decorators applied under it, when tracing is enabled.
+
+    :param name: name of the traces
+    """
+
+    def decorator(view):
+        @wraps(view)
+        def wrapper(*args, **kwargs):
+            trace = tracer.start(name)
+            if trace is None:
+                return view(*args, **kwargs)
+
+            g.trace = trace
+
+            @after_this_request
+            def stamp(response):
+                response.headers[TRACE_HEADER] = trace.trace_id
+                return response
+
+            try:
+                return view(*args, **kwargs)
+            finally:
+                trace.release()
+
+        return wrapper
+
+    return decorator
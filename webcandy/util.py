@@ -2,10 +2,19 @@ import os
 import re
 import json
 
-from typing import Optional, Dict
+from typing import Optional, Dict, Iterable, List, NamedTuple
 from .definitions import USERS_DIR, Address
 
 
+COLOR_PATTERN = re.compile(r'#[A-Fa-f0-9]{6}')
+# forms accepted by normalize_color: #RRGGBB, #RGB and rgb(R, G, B)
+COLOR_FORMS = re.compile(r'#([A-Fa-f0-9]{6})|#([A-Fa-f0-9]{3})|'
+                         r'rgb\(\s*(\d{1,3})\s*,\s*(\d{1,3})\s*,'
+                         r'\s*(\d{1,3})\s*\)', re.IGNORECASE)
+# a newline-separated run of #RRGGBB colors
+COLOR_RUN = re.compile(r'#[A-Fa-f0-9]{6}(?:\n#[A-Fa-f0-9]{6})*')
+
+
 def is_color(s: str) -> bool:
     """
     Determine if ``s`` is a color hex in the format #RRGGBB.
@@ -13,7 +22,86 @@ def is_color(s: str) -> bool:
     :param s: the string to check
     :return: ``True`` if ``s`` fits the pattern; ``False`` otherwise
     """
-    return bool(re.match(r'^#[A-Fa-f0-9]{6}$', s))
+    return isinstance(s, str) and COLOR_PATTERN.fullmatch(s) is not None
+
+
+def _color_hex(s: str) -> Optional[str]:
+    """
+    Get the six lowercase hex digits of a color in any of the forms accepted
+    by ``normalize_color``.
+    """
+    if not isinstance(s, str):
+        return None
+    if COLOR_PATTERN.fullmatch(s):  # by far the most common form
+        return s[1:].lower()
+
+    match = COLOR_FORMS.fullmatch(s)
+    if match is None:
+        return None
+    full, short, r, g, b = match.groups()
+    if full:
+        return full.lower()
+    if short:
+        return ''.join(c + c for c in short.lower())
+    channels = int(r), int(g), int(b)
+    if max(channels) > 255:
+        return None
+    return '%02x%02x%02x' % channels
+
+
+def normalize_color(s: str) -> Optional[str]:
+    """
+    Convert a color given as #RRGGBB, #RGB or rgb(R, G, B), in any case, to
+    the form #rrggbb.
+
+    :param s: the color to convert
+    :return: the converted color; ``None`` if ``s`` is not a valid color
+    """
+    digits = _color_hex(s)
+    return None if digits is None else '#' + digits
+
+
+class ParsedColors(NamedTuple):
+    """
+    Result of ``parse_colors``.
+    """
+    # the colors in the form #rrggbb; invalid colors are None
+    colors: List[Optional[str]]
+    # 3 bytes of RGB per color; invalid colors are black
+    packed: bytearray
+    # indices of the invalid colors
+    invalid: List[int]
+
+
+def parse_colors(colors: Iterable[str]) -> ParsedColors:
+    """
+    Validate and normalize a list of colors in a single pass (see
+    ``normalize_color``).
+
+    :param colors: the colors to parse
+    :return: the normalized colors, packed RGB values and invalid indices
+    """
+    colors = colors if isinstance(colors, list) else list(colors)
+
+    # fast path: check a list of only #RRGGBB colors with a single match
+    try:
+        joined = '\n'.join(colors)
+    except TypeError:
+        joined = None
+    if joined is not None and COLOR_RUN.fullmatch(joined):
+        joined = joined.lower()
+        normalized = joined.split('\n')
+        if len(normalized) == len(colors):  # no color had a newline in it
+            # fromhex skips the newlines
+            return ParsedColors(normalized,
+                                bytearray.fromhex(joined.replace('#', '')),
+                                [])
+
+    digits = [_color_hex(c) for c in colors]
+    normalized = [None if d is None else '#' + d for d in digits]
+    invalid = [i for i, color in enumerate(normalized) if color is None]
+    packed = bytearray.fromhex(''.join(d or '000000' for d in digits))
+    return ParsedColors(normalized, packed, invalid)
 
 
 def get_level(env_level: Optional[str]) -> Optional[int]:
@@ -55,6 +143,31 @@ def load_user_data(user_id: int) -> Dict:
         return json.load(file)
 
 
+def parse_fields(fields: str) -> Dict[str, Optional[List[str]]]:
+    """
+    Parse a comma-separated field selection such as
+    ``"color_lists,colors.blue,colors.pink"``. A bare section name selects the
+    whole section; ``section.name`` selects a single item of a section.
+
+    :param fields: the field selection to parse
+    :return: map of section name to the selected item names in the order they
+        were given, or ``None`` if the whole section is selected
+    """
+    selection: Dict[str, Optional[Dict[str, None]]] = dict()
+    for field in fields.split(','):
+        section, _, name = field.strip().partition('.')
+        if not section:
+            continue
+        if not name:
+            selection[section] = None
+        elif section not in selection:
+            selection[section] = {name: None}
+        elif selection[section] is not None:
+            selection[section][name] = None
+    return {section: names if names is None else list(names)
+            for section, names in selection.items()}
+
+
 def format_error(status: int, description: str) -> Dict[str, str]:
     """
     Uniform error format for API responses.
@@ -66,8 +179,12 @@ def format_error(status: int, description: str) -> Dict[str, str]:
     errors = {
         400: 'Bad Request',
         401: 'Unauthorized',
+        403: 'Forbidden',
         404: 'Not Found',
-        500: 'Internal Server Error'
+        429: 'Too Many Requests',
+        500: 'Internal Server Error',
+        501: 'Not Implemented',
+        503: 'Service Unavailable'
     }
     return {'error': errors.get(status) or '(undefined)',
             'error_description': description}